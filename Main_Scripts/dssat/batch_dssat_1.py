@@ -31,6 +31,8 @@ Created on Mon Dec 21 09:45:10 2020
 
 import subprocess
 import os
+from filex_template import FileXTemplate
+from soil_library import SoilLibrary
 
 #------------------------#
 # USER-DEFINED FUNCTIONS #
@@ -84,13 +86,10 @@ if __name__== "__main__":
     # Get all soils from .SOL #
     #-------------------------#
     
-    # Iterate the .SOL file and extract all IDs
-    soilIDs = []
-    inSoil  = open(path2sol,'r')
-    for line in inSoil.readlines()[1:]: # Skip first line
-        if line[0] == '*':
-            soilIDs.append(line[1:11])
-    inSoil.close()
+    # Soil IDs come from the .SOL index (only rebuilt when the file changes).
+    # Use soils.select(texture=..., minDepth=...) to run a subset instead
+    soils   = SoilLibrary(path2sol)
+    soilIDs = soils.ids
     
     print('%d soils to perform experiments'%(len(soilIDs)))
 
@@ -101,6 +100,10 @@ if __name__== "__main__":
     
     # List to store which soils fail in DSSAT simulation
     errorSoils = []
+    
+    # Parse the skeleton control file once. Each experiment only changes the
+    # soil ID columns in the *FIELDS section
+    template = FileXTemplate(skeletetonFile)
 
     # Iterate soils in .SOL
     for s,soil in enumerate(soilIDs):
@@ -114,32 +117,7 @@ if __name__== "__main__":
         # Use the skeleton file to write a new exp file to output folder using
         # a different soil class
         eFile  = controlFile       
-        oFile  = open('%s/%s'%(oDir,eFile),'w')
-        countI = -1000
-        # Not super elegant but gets the job done
-        with open(skeletetonFile, 'r+') as f:
-            
-            lines = f.readlines()
-            
-            # Iterate each line in control file
-            for i in range(0, len(lines)):
-                
-                line = lines[i]
-                
-                # Parse field section of control file
-                if line[:7] == '*FIELDS':
-                    countI   = i+2
-                    fieldRow = lines[countI]
-                    outField = fieldRow.replace(fieldRow[69:79],soil)     
-                
-                # Write new field
-                if i != countI:
-                    oFile.write(line)
-                else:
-                    oFile.write(outField) 
-        
-        # Close new control file
-        oFile.close()
+        template.write('%s/%s'%(oDir,eFile), soil = soil)
         
         #-------#
         # DSSAT #
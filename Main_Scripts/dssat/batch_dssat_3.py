@@ -4,7 +4,9 @@
 PURPOSE: Same as batch_dssat_2.py but uses parallel processing on a multi-core
 architecture. If your machine doesnt have multiple cores, do not run this.
 
-Sends a subset of soil_ids to each core. 
+Soils are handed out a few at a time to whichever core is free, so one slow
+soil no longer holds up a whole slice of the experiment. Results are reported
+as they finish, along with how busy each core was.
 
     Wihtin each core, this file does:
         
@@ -19,6 +21,20 @@ Sends a subset of soil_ids to each core.
         download. 
         
         Each soil will have its own directory within the overall experiment
+        
+    Each core keeps its own scratch directory for the whole run. The static
+    DSSAT inputs (.CUL, .ECO, .SPE, DSSATPRO.L47) are copied there once when
+    the core starts, DSSAT is launched directly in that directory (no shell,
+    no os.chdir) and the outputs are moved to the soil's directory afterwards.
+    
+    Runs whose inputs (FileX, soil profile, weather, Kcb, genotype files and the
+    executable) haven't changed since they were last simulated are restored
+    from the simulation cache instead of running DSSAT again.
+    
+    Every soil's state is kept in a run ledger (SQLite) in the experiment
+    directory. Restarting the script after a crash or reboot skips the soils
+    that already finished (unless their inputs changed since) and retries
+    failed ones up to maxAttempts times.
     
 
 AUTHOR: Zachary Zambreski, Kansas State University (2020)
@@ -33,27 +49,199 @@ Created on Tues Dec 21 8:30:10 2020
 
 import subprocess
 import os
+import shutil
+import glob
+from filex_template import FileXTemplate
+from soil_library import SoilLibrary
+from result_store import ResultStore
+from sim_cache import SimCache, inputKey
+from run_ledger import RunLedger
 import multiprocessing as mp
 import time
-import numpy as np
+import math
 
 #------------------------#
 # USER-DEFINED FUNCTIONS #
 #------------------------#
 
-def chunks(l, n):
+# Per-core state, filled in by initWorker when the pool starts the core
+WORKER = {}
+
+# Batch file written for runmodes B and N, and the name in its $BATCH line
+BATCH_FILE  = 'DSSBATCH.V47'
+BATCH_NAMES = {'B':'BATCH','N':'SEASONAL'}
+
+def forcingFiles(template, weatherDir):
+    
+    """ Weather and Kcb forcing files of the experiment's weather station """
+    
+    wsta = template.value('wsta')[:4]
+    
+    return (glob.glob('%s/%s*.[Ww][Tt][Hh]'%(weatherDir,wsta)) +
+            glob.glob('%s/%s*.[Kk][Cc][Bb]'%(weatherDir,wsta)))
+
+def initWorker(scratchRoot, stageFiles, skeletonFile, path2sol, cacheInfo):
+    
+    """ Runs once in each core when the pool starts it.
+    
+        Creates the core's scratch directory and stages the static DSSAT
+        inputs into it, so individual runs only have to drop in a FileX.
+        The skeleton control file, the soil index and the simulation cache
+        are opened once here as well.
+    
+        cacheInfo: [cache directory, size cap (bytes), weather directory], or
+                   None to always run DSSAT
+    
+    """
+    
+    scratch = '%s/%s'%(scratchRoot,mp.current_process().name)
+    if os.path.exists(scratch):
+        shutil.rmtree(scratch)
+    os.makedirs(scratch)
+    
+    for f in stageFiles:
+        shutil.copy(f,scratch)
+    
+    WORKER['scratch']  = scratch
+    WORKER['staged']   = set(os.listdir(scratch))
+    WORKER['template'] = FileXTemplate(skeletonFile)
+    WORKER['trnos']    = WORKER['template'].treatments()
+    
+    # Runs DSSAT writes for one soil: every treatment, NYERS seasons each
+    years = WORKER['template'].runs()
+    WORKER['runs']     = sum(years.get(t,1) for t in WORKER['trnos'])
+    WORKER['soils']    = SoilLibrary(path2sol)
+    WORKER['inputs']   = list(stageFiles)
+    WORKER['cache']    = None
+    
+    if cacheInfo is not None:
+        
+        cacheDir,cacheSize,weatherDir = cacheInfo
+        WORKER['cache'] = SimCache(cacheDir,cacheSize)
+        WORKER['inputs'] += forcingFiles(WORKER['template'],weatherDir)
+
+def chunkSize(nJobs, nCores, maxBatch = 8):
+    
+    """ Number of soils handed to a free core at a time.
+    
+        Small batches keep the tail of the run short (no core waits on a long
+        slice while the others sit idle), but a batch of one means a round
+        trip to the scheduler for every soil. Aim for ~8 hand-outs per core
+        and never more than maxBatch soils per hand-out.
+    
+    """
+    
+    return max(1, min(maxBatch, int(nJobs/(nCores*8))))
+
+def batchSize(nSoils, nCores, maxBatch = 50):
+    
+    """ Number of soils packed into one DSSAT call in batch mode (B or N).
+    
+        Bigger batches pay the executable start-up and input loading less
+        often. Still aim for ~4 batches per core so the cores finish together.
     
-    """ Yield successive n-sized chunks from l."""
+    """
     
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    return max(1, min(maxBatch, int(math.ceil(nSoils/(nCores*4.)))))
+
+def writeBatchFile(bFile, fileXs, trnos, runmode):
+    
+    """ Write a DSSAT batch file that runs every treatment of every FileX.
+    
+        The FILEX column is 92 characters wide, so the FileXs should be given
+        relative to the directory DSSAT runs in. A longer path would push the
+        treatment number out of its column: it raises a ValueError instead.
+    
+    """
+    
+    for fileX in fileXs:
+        if len(fileX) > 92:
+            raise ValueError('FileX path longer than 92 characters for the '
+                             'batch file: %s'%(fileX))
+    
+    with open(bFile,'w') as f:
+        f.write('$BATCH(%s)\n!\n'%(BATCH_NAMES[runmode]))
+        f.write('%-92s  TRTNO     RP     SQ     OP     CO\n'%('@FILEX'))
+        for fileX in fileXs:
+            for trno in trnos:
+                f.write('%-92s%7d%7d%7d%7d%7d\n'%(fileX,trno,1,0,0,0))
+
+def splitRuns(lines, nRuns):
+    
+    """ Split a DSSAT output file written by a batch run into its runs.
+    
+        Summary.OUT has one row per run under its '@' header. The other
+        output files have one section per run, each starting with a
+        '*DSSAT Cropping System Model' line. Returns the lines before the
+        first run and a list of lines per run, or None if the file isn't
+        written per run (no run sections at all), in which case every soil
+        gets a full copy. A file with a different number of runs than nRuns
+        can't be split: raises a ValueError.
+    
+    """
+    
+    if lines and lines[0].startswith('*SUMMARY'):
+        n = [i for i,line in enumerate(lines) if line[:1] == '@'][0] + 1
+        runs = [[line] for line in lines[n:] if line.strip()]
+    else:
+        starts = [i for i,line in enumerate(lines)
+                  if line.startswith('*DSSAT Cropping System Model')]
+        n    = starts[0] if starts else len(lines)
+        runs = [lines[a:b] for a,b in zip(starts,starts[1:] + [len(lines)])]
+    
+    if not runs:
+        return None
+    if len(runs) != nRuns:
+        raise ValueError('%d runs in a batch output, expected %d'%(len(runs),
+                                                                  nRuns))
+    
+    return lines[:n], runs
+
+def demultiplex(scratch, outputs, runDirs, runsPerSoil):
+    
+    """ Split each output file of a batch run into the run directory of
+        each soil (runs are written in the order of the batch file).
+        Raises a ValueError (with the file name) if a file can't be split.
+    """
+    
+    for f in outputs:
+        
+        with open('%s/%s'%(scratch,f),'r') as inFile:
+            lines = inFile.readlines()
+        try:
+            parts = splitRuns(lines,len(runDirs)*runsPerSoil)
+        except ValueError as e:
+            raise ValueError('%s: %s'%(f,e))
+        
+        for i,runDir in enumerate(runDirs):
+            with open('%s/%s'%(runDir,f),'w') as oFile:
+                if parts is None:
+                    oFile.writelines(lines)
+                    continue
+                oFile.writelines(parts[0])
+                for run in parts[1][i*runsPerSoil:(i + 1)*runsPerSoil]:
+                    oFile.writelines(run)
+        
+        os.remove('%s/%s'%(scratch,f))
 
 def cpuProcess(package):
     
-    """  Function that the core uses to run DSSAT for limited # of soil IDs.
+    """  Function that the core uses to run DSSAT for a group of soil IDs.
     
         Core cannot see global variables so we pass it all the path info defined
-        in the inputs. 
+        in the inputs. DSSAT runs in the core's scratch directory:
+            
+            runmode A:    one soil (one FileX) per DSSAT call
+            runmode B/N:  all soils of the group in one DSSAT call through a
+                          batch file; the outputs are split back per soil
+        
+        The FileX plus everything DSSAT wrote for a soil is then moved to the
+        soil's output directory. Returns a list with, for each soil: the soil,
+        the DSSAT exit code (0 is success, -1 if it couldn't be started), the
+        name of the worker that ran it, the start and end times and whether
+        the outputs came from the simulation cache. If the outputs of a
+        batch can't be split per soil, every soil of the group gets exit
+        code -2 (nothing is cached).
     
     """
   
@@ -64,71 +252,114 @@ def cpuProcess(package):
     pathDSSAT, model, runmode = dPath
     
     # Unpack the experiment related paths from "epath"
-    resultsDir,EXPNAME,controlFile,skeletonFile = expPath
+    resultsDir,EXPNAME,controlFile = expPath
     
-    errorSoils = []
+    tic     = time.time()
+    scratch = WORKER['scratch']
+    cache   = WORKER['cache']
+    worker  = mp.current_process().name
+    eFile   = controlFile
     
-    # Iterate soils in .SOL
-    for s,soil in enumerate(soils):
+    results = []
+    runs    = []
+    for soil in soils:
         
         # Create new output directories for the soil
         oDir = '%s/%s/%s'%(resultsDir,EXPNAME,soil)
         if not os.path.exists(oDir):
-            print('Creating output directory')
             os.makedirs(oDir)
         
-        # Use the skeleton file to write a new exp file to output folder using
-        # a different soil class
-        eFile  = controlFile       
-        oFile  = open('%s/%s'%(oDir,eFile),'w')
-        countI = -1000
-        # Not super elegant but gets the job done
-        with open(skeletonFile, 'r+') as f:
-            
-            lines = f.readlines()
-            
-            # Iterate each line in control file
-            for i in range(0, len(lines)):
-                
-                line = lines[i]
-                
-                # Parse field section of control file
-                if line[:7] == '*FIELDS':
-                    countI   = i+2
-                    fieldRow = lines[countI]
-                    outField = fieldRow.replace(fieldRow[69:79],soil)     
-                
-                # Write new field
-                if i != countI:
-                    oFile.write(line)
-                else:
-                    oFile.write(outField) 
-        
-        # Close new control file
-        oFile.close()
+        # Use the skeleton file to make a new exp file using a different soil
+        # class
+        text = WORKER['template'].render(soil = soil)
         
         #-------#
-        # DSSAT #
+        # Cache #
         #-------#
         
-        try:
+        # Nothing this run depends on has changed: restore the old outputs
+        key = None
+        if cache is not None:
+            # The crop model and runmode change what DSSAT writes as well
+            key = cache.key([text,WORKER['soils'].profile(soil),model,
+                             runmode],WORKER['inputs'] + [pathDSSAT])
+            if cache.get(key,oDir):
+                results.append((soil,0,worker,tic,time.time(),True))
+                continue
         
-            print('Running DSSAT for %s, %s, %d'%(soil,eFile,s))
-            
-            # Change directory to the location of experiment file
-            os.chdir('%s'%(oDir))
-            
-            # Format the full command as a string
-            command = "%s %s %s %s"%(pathDSSAT,model,runmode,eFile)
-            
-            # Pass the command to the system (Runs DSSAT for input options)
-            subprocess.check_call(command, shell=True)
-            
-        except:
-            
-            errorSoils.append(soil)
+        # Each soil that needs to run gets its own folder in the scratch
+        # directory for its FileX (and later its outputs)
+        runDir = '%s/%d'%(scratch,len(runs))
+        os.makedirs(runDir)
+        with open('%s/%s'%(runDir,eFile),'w') as f:
+            f.write(text)
+        runs.append([soil,oDir,key,runDir])
+    
+    if not runs:
+        return results
+    
+    #-------#
+    # DSSAT #
+    #-------#
+    
+    if runmode == 'A':
+        # The FileX sits next to the staged inputs
+        os.replace('%s/%s'%(runs[0][3],eFile),'%s/%s'%(scratch,eFile))
+        argument = eFile
+    else:
+        # One batch file lists every treatment of every soil's FileX (paths
+        # relative to the scratch directory DSSAT runs in, e.g. 12/UFGA7812.SNX)
+        argument = BATCH_FILE
+        writeBatchFile('%s/%s'%(scratch,argument),
+                       ['%d/%s'%(i,eFile) for i in range(len(runs))],
+                       WORKER['trnos'],runmode)
+    
+    try:
+        
+        # Launch the executable directly inside the scratch directory. The
+        # arguments are passed as a list so no shell is started
+        command  = [pathDSSAT,model,runmode,argument]
+        exitCode = subprocess.call(command, cwd = scratch,
+                                   stdout = subprocess.DEVNULL)
+        
+    except:
+        
+        exitCode = -1
+    
+    # DSSAT outputs (the staged inputs stay behind for the next run on this
+    # core). Give every soil its share of them
+    outputs = [f for f in os.listdir(scratch) if f not in WORKER['staged'] and
+               os.path.isfile('%s/%s'%(scratch,f))]
+    if runmode == 'A':
+        for f in outputs:
+            os.replace('%s/%s'%(scratch,f),'%s/%s'%(runs[0][3],f))
+    else:
+        os.remove('%s/%s'%(scratch,argument))
+        outputs.remove(argument)
+        try:
+            demultiplex(scratch,outputs,[r[3] for r in runs],WORKER['runs'])
+        except ValueError as e:
+            # Don't hand (or cache) another soil's outputs: the whole group
+            # failed and is tried again on the next restart
+            print('%s: outputs of %d soils not split (%s)'%(worker,len(runs),
+                  e))
+            for f in os.listdir(scratch):
+                if f not in WORKER['staged'] and \
+                   os.path.isfile('%s/%s'%(scratch,f)):
+                    os.remove('%s/%s'%(scratch,f))
+            exitCode = -2
+    
+    # Move the FileX and outputs to the soil's directory
+    for soil,oDir,key,runDir in runs:
+        files = ['%s/%s'%(runDir,f) for f in os.listdir(runDir)]
+        if exitCode == 0 and cache is not None:
+            cache.put(key,files)
+        for f in files:
+            os.replace(f,'%s/%s'%(oDir,os.path.basename(f)))
+        os.rmdir(runDir)
+        results.append((soil,exitCode,worker,tic,time.time(),False))
       
-    return errorSoils
+    return results
 
 #------#
 # MAIN #
@@ -156,6 +387,12 @@ if __name__== "__main__":
     # E: Sensitivty analysis (FileX TN) .. TN is treatment number
     # N: Seasonal analysis   (bathfilename)
     # Q: Sequence analysis   (batchfilename)
+    #
+    # With A, DSSAT is started once per soil. With B or N, the script writes
+    # a batch file so each DSSAT call runs a group of soils (all treatments),
+    # which saves the start-up/input loading for every soil but the first.
+    # E and Q can't be packed this way (Q carries the soil state from one
+    # batch row to the next)
     runmode   = 'A' 
 
     # Path to store your results
@@ -172,6 +409,22 @@ if __name__== "__main__":
     # Path to control file
     skeletonFile = '%s/Seasonal/%s'%(tierDir,controlFile)
     
+    # Static DSSAT inputs copied once into each core's scratch directory
+    stageFiles = ['%s/DSSATPRO.L47'%(tierDir),
+                  '%s/Genotype/SBGRO047.CUL'%(tierDir),
+                  '%s/Genotype/SBGRO047.ECO'%(tierDir),
+                  '%s/Genotype/SBGRO047.SPE'%(tierDir)]
+    
+    # Simulation cache: reuse outputs of runs whose inputs haven't changed
+    # Set useCache = False to always run DSSAT
+    useCache   = True
+    cacheDir   = '%s/Results/_cache'%(tierDir)
+    cacheSize  = 20    # GB
+    weatherDir = '%s/Weather'%(tierDir)
+    
+    # Number of times a failed soil is tried (across restarts) before giving up
+    maxAttempts = 3
+    
     #
     # Parallel processing 
     #
@@ -185,13 +438,10 @@ if __name__== "__main__":
     # Get all soils from .SOL #
     #-------------------------#
     
-    # Iterate the .SOL file and extract all IDs
-    soilIDs = []
-    inSoil  = open(path2sol,'r')
-    for line in inSoil.readlines()[1:]: # Skip first line
-        if line[0] == '*':
-            soilIDs.append(line[1:11])
-    inSoil.close()
+    # Soil IDs come from the .SOL index (only rebuilt when the file changes).
+    # Use soils.select(texture=..., minDepth=...) to run a subset instead
+    soils   = SoilLibrary(path2sol)
+    soilIDs = soils.ids
     
     print('%d soils to perform experiments'%(len(soilIDs)))
 
@@ -215,24 +465,94 @@ if __name__== "__main__":
     print('You selected %d cores'%(nCores))
     input("Press Enter to continue...") 
     
-    # Divide the soil_ids list into nCore processings
-    splits = list(chunks(soilIDs,int(len(soilIDs)/nCores)))
+    # The ledger remembers which soils finished in earlier (interrupted) runs
+    # of this experiment. Only run the ones that still need it. Soils are
+    # registered with the digest of their inputs (the simulation cache key),
+    # so a soil whose inputs changed since it finished is run again
+    if not os.path.exists('%s/%s'%(resultsDir,EXPNAME)):
+        os.makedirs('%s/%s'%(resultsDir,EXPNAME))
+    template = FileXTemplate(skeletonFile)
+    inputs   = (stageFiles + forcingFiles(template,weatherDir) +
+                [pathDSSAT])
+    ledger   = RunLedger('%s/%s/ledger.sqlite'%(resultsDir,EXPNAME))
+    ledger.register({soil:inputKey([template.render(soil = soil),
+                                    soils.profile(soil),model,runmode],inputs)
+                     for soil in soilIDs})
+    todo   = ledger.todo(maxAttempts)
+    print('%d soils already finished, %d to run'%(len(soilIDs) - len(todo),
+                                                  len(todo)))
+    
+    if runmode not in ['A','B','N']:
+        raise ValueError('runmode %s is not supported by this script'%(runmode))
     
-    # Add information to each split that needs to be passed
-    # The core can't see anything in the inputs section
+    # Every soil is its own job in runmode A. In B/N a job is a group of soils
+    # that share one DSSAT call. Add information to each job that needs to be
+    # passed. The core can't see anything in the inputs section
+    group     = 1 if runmode == 'A' else batchSize(len(todo),nCores)
     dPathInfo = [pathDSSAT,model,runmode]
-    expPath   = [resultsDir,EXPNAME,controlFile,skeletonFile]
-    subsets   = [[soils,expPath,dPathInfo] for i,soils in enumerate(splits)]
+    expPath   = [resultsDir,EXPNAME,controlFile]
+    jobs      = [[todo[i:i + group],expPath,dPathInfo]
+                 for i in range(0,len(todo),group)]
+    
+    # Free cores pull the next job(s) from the queue as soon as they finish
+    # their current one (dynamic scheduling instead of fixed slices)
+    chunk = chunkSize(len(jobs),nCores)
+    print('%d soil(s) per DSSAT call, %d job(s) handed out at a time'%(group,
+          chunk))
     
     # Create the pool of processes (pool)
-    # Pass the function and data splits to each core
-    pool     = mp.Pool(processes = len(subsets))       
-    tic      = time.time()
-    results  = pool.map(cpuProcess,subsets)
+    # Results stream back in the order they finish, not the order submitted
+    # Each core stages the static inputs into its scratch directory once
+    doneSoils  = []
+    busyTime   = {}
+    nCached    = 0
+    cacheInfo  = [cacheDir,cacheSize*1e9,weatherDir] if useCache else None
+    scratchDir = '%s/%s/_scratch'%(resultsDir,EXPNAME)
+    pool       = mp.Pool(processes = nCores, initializer = initWorker,
+                         initargs = (scratchDir,stageFiles,skeletonFile,
+                                     path2sol,cacheInfo))
+    tic        = time.time()
+    n          = 0
+    for results in pool.imap_unordered(cpuProcess,jobs,chunk):
+        
+        # Time the core spent on the whole job
+        worker = results[0][2]
+        busyTime[worker] = (busyTime.get(worker,0) +
+                            max(r[4] for r in results) - results[0][3])
+        
+        for soil,exitCode,worker,started,finished,cached in results:
+            
+            n       += 1
+            nCached += cached
+            
+            # Record the outcome right away so it survives a crash
+            ledger.record(soil,exitCode,started,finished,
+                          '%s/%s/%s'%(resultsDir,EXPNAME,soil),worker)
+            if exitCode == 0:
+                doneSoils.append(soil)
+            
+            status = ('cached' if cached else 'finished' if exitCode == 0 else
+                      'FAILED (exit code %d)'%(exitCode))
+            print('[%d/%d] %s %s on %s (%.1f s)'%(n,len(todo),soil,status,
+                  worker,finished - started))
+        
     pool.close()
+    pool.join()
     toc      = time.time()
+    shutil.rmtree(scratchDir)
+    
+    # Keep the cache under its size cap (least recently used runs go first)
+    if useCache:
+        print('%d of %d soils restored from the cache'%(nCached,len(todo)))
+        print('%d old runs evicted from the cache'%(
+              SimCache(cacheDir,cacheSize*1e9).evict()))
     print('Parallel processing time: %.2f minutes' %((toc - tic)/60))
-    nWorkers = np.shape(results)[0]  
+    
+    # Fraction of the wall-clock time each core spent running DSSAT
+    print('')
+    print('Core utilisation:')
+    for worker in sorted(busyTime):
+        print('    %s: %5.1f%%'%(worker,100*busyTime[worker]/(toc - tic)))
     
     input("Press Enter to continue...") 
 
@@ -241,8 +561,22 @@ if __name__== "__main__":
     # Output information #
     #--------------------#
     
-# =============================================================================
-#     print('************')
-#     print('%d soils failed simulation'%(len(errorSoils)))            
-#     [print('%s failed'%(s)) for s in errorSoils]
-# =============================================================================
+    # Failures from this run and any earlier runs of the experiment
+    errorSoils = ledger.failed()
+    print('************')
+    print('%d soils failed simulation'%(len(errorSoils)))            
+    [print('%s failed %d time(s), last exit code %d'%(s)) for s in errorSoils]
+    print('Ledger: %s'%(ledger.counts()))
+    ledger.close()
+
+#%%---------------------------------------------------------------------------#
+    #---------------------#
+    # Collect the results #
+    #---------------------#
+    
+    # Add the seasonal summary of every soil that ran to the result store
+    store    = ResultStore('%s/%s/store'%(resultsDir,EXPNAME))
+    sumFiles = ['%s/%s/%s/Summary.OUT'%(resultsDir,EXPNAME,soil)
+                for soil in doneSoils]
+    nRows    = store.ingest([f for f in sumFiles if os.path.exists(f)])
+    print('%d seasons added to the result store'%(nRows))
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Parse a skeleton DSSAT experiment file (FileX, e.g. UFGA7812.SNX)
+once and render new experiments from it by substituting typed fields.
+
+    The skeleton is split into literal text and fixed-width "slots". A slot's
+    columns come from the '@' header line of its section, the same way DSSAT
+    reads them:
+
+        (1) Text fields (IDs) are left-aligned: they start under the header
+            name and run up to the next header name
+        (2) Numeric/code fields are right-aligned: they end under the last
+            character of the header name
+
+    Rendering a variant is a single string format of the precompiled buffer, so
+    thousands of experiments can be written without re-reading or re-scanning
+    the skeleton. Only the columns of the requested field are touched (unlike
+    str.replace, which hits any identical text on the line).
+
+    Example:
+
+        template = FileXTemplate('C:/DSSAT47/Seasonal/UFGA7812.SNX')
+        template.write('./UFGA7812.SNX', soil = 'IBSB910015')
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import datetime
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Fields that can be substituted
+# name: (section, header name, alignment)
+FIELDS = {'soil'  : ('*FIELDS',              'ID_SOIL', 'left'),
+          'wsta'  : ('*FIELDS',              'WSTA',    'left'),
+          'pdate' : ('*PLANTING DETAILS',    'PDATE',   'right'),
+          'irrig' : ('*SIMULATION CONTROLS', 'IRRIG',   'right')}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def formatValue(value):
+
+    """ Convert a typed field value to the text DSSAT expects.
+
+        Dates become YYDDD, everything else is converted with str()
+
+    """
+
+    if isinstance(value,(datetime.date,datetime.datetime)):
+        return value.strftime('%y%j')
+
+    return str(value)
+
+def headerColumns(header):
+
+    """ Return [name, start, end] for every name in an '@' header line """
+
+    columns = []
+    i = 0
+    for name in header.rstrip('\r\n').split():
+        start = header.index(name,i)
+        i     = start + len(name)
+        columns.append([name,start,i])
+
+    return columns
+
+class FileXTemplate(object):
+
+    """ Skeleton FileX parsed once into literal text and fixed-width slots
+
+    Parameters
+    ----------
+    skeletonFile : String
+        Path to the skeleton FileX
+    fields : Dictionary
+        Fields that can be substituted (defaults to FIELDS)
+
+    """
+
+    def __init__(self, skeletonFile, fields = FIELDS):
+
+        with open(skeletonFile,'r') as f:
+            self.lines = f.readlines()
+
+        self.path = skeletonFile
+
+        # Locate every slot: [line index, start column, end column, field]
+        slots = []
+        for field,(section,name,align) in fields.items():
+            for i,start,end in self.locate(section,name,align):
+                slots.append((i,start,end,field))
+        slots.sort()
+
+        # Absolute offset of each line in the file
+        offsets = [0]
+        for line in self.lines:
+            offsets.append(offsets[-1] + len(line))
+        text = ''.join(self.lines)
+
+        # Precompile: literal text (with % escaped) and one %s per slot
+        pieces   = []
+        self.slots    = []
+        self.widths   = []
+        self.defaults = []
+        last = 0
+        for i,start,end,field in slots:
+            a = offsets[i] + start
+            b = offsets[i] + end
+            pieces.append(text[last:a].replace('%','%%'))
+            pieces.append('%s')
+            self.slots.append(field)
+            self.widths.append((end - start,fields[field][2]))
+            self.defaults.append(text[a:b])
+            last = b
+        pieces.append(text[last:].replace('%','%%'))
+        self.buffer = ''.join(pieces)
+
+        self.fields = sorted(set(self.slots))
+
+    def locate(self, section, name, align):
+
+        """ Yield (line index, start, end) of a field in every data row of
+            the section that has it in its header
+        """
+
+        inSection = False
+        columns   = None
+        for i,line in enumerate(self.lines):
+
+            if line[:1] == '*':
+                inSection = line.startswith(section)
+                columns   = None
+                continue
+
+            if not inSection:
+                continue
+
+            if line[:1] == '@':
+                columns = headerColumns(line)
+                names   = [c[0].rstrip('.') for c in columns]
+                if name not in names:
+                    columns = None
+                    continue
+
+                # Column span from the neighbouring header names
+                j = names.index(name)
+                if align == 'left':
+                    start = columns[j][1]
+                    if j + 1 < len(columns):
+                        end = columns[j + 1][1] - 1
+                    else:
+                        end = None
+                else:
+                    start = columns[j - 1][2] + 1 if j > 0 else 0
+                    end   = columns[j][2]
+                continue
+
+            if columns is None or line[:1] == '!' or not line.strip():
+                continue
+
+            # Data row under a header containing the field
+            row = line.rstrip('\r\n')
+            yield i, start, len(row) if end is None else min(end,len(row))
+
+    def value(self, field):
+
+        """ The skeleton's own value of a field (first occurrence) """
+
+        return self.defaults[self.slots.index(field)].strip()
+
+    def treatments(self):
+
+        """ Treatment numbers (TRNO) listed in the *TREATMENTS section """
+
+        trnos     = []
+        inSection = False
+        for line in self.lines:
+            if line[:1] == '*':
+                inSection = line.startswith('*TREATMENTS')
+            elif inSection and line[:1] not in '@!' and line.strip():
+                trnos.append(int(line.split()[0]))
+
+        return trnos
+
+    def runs(self):
+
+        """ Number of runs DSSAT makes of each treatment {TRNO: runs}: the
+            NYERS (seasons) of the simulation controls (SM) the treatment uses
+        """
+
+        # NYERS of every simulation control level
+        nyers = {}
+        for i,start,end in self.locate('*SIMULATION CONTROLS','NYERS',
+                                       'right'):
+            line = self.lines[i]
+            nyers[int(line.split()[0])] = int(line[start:end])
+
+        # SM of every treatment (last, right-aligned column)
+        runs = {}
+        for i,start,end in self.locate('*TREATMENTS','SM','right'):
+            line = self.lines[i]
+            runs[int(line.split()[0])] = nyers.get(int(line[start:end]),1)
+
+        return runs
+
+    def render(self, **values):
+
+        """ Return the text of a new FileX.
+
+            Keyword arguments are field names (e.g. soil = 'IBSB910015').
+            Fields that are not given keep the skeleton's value.
+
+        """
+
+        for field in values:
+            if field not in self.fields:
+                raise KeyError('%s is not a field of %s'%(field,self.path))
+
+        out = []
+        for field,default,(width,align) in zip(self.slots,self.defaults,
+                                               self.widths):
+            if field not in values:
+                out.append(default)
+                continue
+
+            value = formatValue(values[field])
+            if len(value) > width:
+                raise ValueError('%s "%s" is wider than %d columns'%(field,
+                                 value,width))
+            out.append(value.ljust(width) if align == 'left' else
+                       value.rjust(width))
+
+        return self.buffer%tuple(out)
+
+    def renderMany(self, variants):
+
+        """ Yield the text of a FileX for each dictionary of field values """
+
+        for values in variants:
+            yield self.render(**values)
+
+    def write(self, oFile, **values):
+
+        """ Render a new FileX and write it to oFile """
+
+        with open(oFile,'w') as f:
+            f.write(self.render(**values))
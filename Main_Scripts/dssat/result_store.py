@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Collect DSSAT seasonal summaries (Summary.OUT / *.OSU) from many runs
+into one columnar store on disk (Parquet) that can be queried without touching
+the original text files again.
+
+    Layout of the store (partitioned by experiment and soil):
+
+        root/EXNAME=AL018102/SOIL_ID=IB00000005/<run>.parquet
+
+    Every summary file becomes one Parquet file, so ingesting the same run
+    again overwrites it instead of duplicating rows. Every file is written
+    with the same column types (summary_parser.columnType): dates (SDAT,
+    PDAT, ...), counts and whole kg/ha or mm amounts (HWAH, CWAM, PRCM, ...)
+    are nullable int32, all other numbers (HWUM, LAIX, ...) float32 and -99
+    is stored as missing, so the files of different runs can always be read
+    together. A YEAR column (from PDAT) is added so queries can filter on it.
+    Filters on soil, treatment and year are pushed down to the Parquet
+    reader, so only the matching files/row groups are read.
+
+    Requires pandas with pyarrow installed.
+
+    Example:
+
+        store = ResultStore('./store')
+        store.ingest(glob.glob('../SeasonalAnalysis/AL0181*.OSU'))
+        df = store.query(columns = ['SOIL_ID','YEAR','HWAH'], trno = [2],
+                         years = (1990,2000))
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import hashlib
+import os
+import pandas as pd
+from summary_parser import columnType, readSummary
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Columns the store is partitioned by
+PARTITIONS = ['EXNAME','SOIL_ID']
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+class ResultStore(object):
+
+    """ Partitioned Parquet store of DSSAT summary outputs
+
+    Parameters
+    ----------
+    root : String
+        Directory holding the store (created if missing)
+
+    """
+
+    def __init__(self, root):
+
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def ingest(self, sumFiles):
+
+        """ Add (or replace) the runs in each summary file. Returns the
+            number of rows written.
+        """
+
+        if isinstance(sumFiles,str):
+            sumFiles = [sumFiles]
+
+        nRows = 0
+        for sumFile in sumFiles:
+
+            df  = readSummary(sumFile)
+            df  = df.astype({c:columnType(c) for c in df.columns})
+            df['YEAR'] = (df['PDAT']//1000).astype('Int16')
+            run = hashlib.md5(os.path.abspath(sumFile).encode()).hexdigest()
+
+            for (exname,soil),part in df.groupby(PARTITIONS):
+                oDir = '%s/EXNAME=%s/SOIL_ID=%s'%(self.root,exname,soil)
+                if not os.path.exists(oDir):
+                    os.makedirs(oDir)
+                part.drop(columns = PARTITIONS).to_parquet(
+                    '%s/%s.parquet'%(oDir,run),index = False)
+                nRows += len(part)
+
+        return nRows
+
+    def query(self, columns = None, soil = None, trno = None, years = None,
+              exname = None):
+
+        """ Read runs from the store.
+
+        Parameters
+        ----------
+        columns : List
+            Columns to return (all if None)
+        soil, trno, exname : List
+            Only return these soil IDs / treatments / experiments
+        years : Tuple
+            (first, last) planting year, inclusive
+
+        Returns
+        -------
+        df : pandas DataFrame
+
+        """
+
+        filters = []
+        if exname is not None:
+            filters.append(('EXNAME','in',list(exname)))
+        if soil is not None:
+            filters.append(('SOIL_ID','in',list(soil)))
+        if trno is not None:
+            filters.append(('TRNO','in',list(trno)))
+        if years is not None:
+            filters.append(('YEAR','>=',years[0]))
+            filters.append(('YEAR','<=',years[1]))
+
+        return pd.read_parquet(self.root,columns = columns,
+                               filters = filters if filters else None)
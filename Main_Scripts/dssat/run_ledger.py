@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Persistent ledger (SQLite) of the jobs in a DSSAT sweep, so a sweep
+that crashes or gets preempted can be restarted without redoing finished work.
+
+    One row per job (a soil in batch_dssat_3.py) with its state, number of
+    attempts, start and end times, DSSAT exit code and output directory:
+
+        pending -> done      (exit code 0)
+                -> failed    (anything else; retried on the next start until
+                              maxAttempts is reached)
+
+    Each job is registered with a digest of its inputs (the simulation cache
+    key). A job whose inputs changed since it was registered (edited cultivar,
+    FileX, weather...) starts over as pending, so only unchanged jobs are
+    skipped when a sweep is restarted.
+
+    Only the main process writes to the ledger (results come back to it from
+    the cores), so there is never more than one writer.
+
+    Example:
+
+        ledger = RunLedger('./ledger.sqlite')
+        ledger.register({soil: inputKey(...) for soil in soilIDs})
+        for soil in ledger.todo(maxAttempts = 3):
+            ...
+            ledger.record(soil, exitCode, started, finished, oDir)
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import sqlite3
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+class RunLedger(object):
+
+    """ SQLite ledger of sweep jobs
+
+    Parameters
+    ----------
+    dbFile : String
+        Path to the SQLite file (created if missing)
+
+    """
+
+    def __init__(self, dbFile):
+
+        self.db = sqlite3.connect(dbFile)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                               job       TEXT PRIMARY KEY,
+                               state     TEXT NOT NULL DEFAULT 'pending',
+                               attempts  INTEGER NOT NULL DEFAULT 0,
+                               started   REAL,
+                               finished  REAL,
+                               exit_code INTEGER,
+                               output    TEXT,
+                               worker    TEXT,
+                               inputs    TEXT)''')
+
+        # Ledgers written before the input digests were kept
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(jobs)')]
+        if 'inputs' not in columns:
+            self.db.execute('ALTER TABLE jobs ADD COLUMN inputs TEXT')
+        self.db.commit()
+
+    def register(self, jobs):
+
+        """ Add jobs ({job: input digest}) to the ledger. Jobs already in it
+            keep their state if their inputs are the same, otherwise they
+            start over (pending, no attempts)
+        """
+
+        self.db.executemany('INSERT OR IGNORE INTO jobs (job, inputs) '
+                            'VALUES (?, ?)',list(jobs.items()))
+        self.db.executemany('''UPDATE jobs SET state = 'pending', attempts = 0,
+                                                inputs = ?
+                               WHERE job = ? AND inputs IS NOT ?''',
+                            [(digest,job,digest) for job,digest in jobs.items()])
+        self.db.commit()
+
+    def todo(self, maxAttempts = 3):
+
+        """ Jobs that still need to run: never finished (e.g. the last sweep
+            died first) or failed fewer than maxAttempts times
+        """
+
+        rows = self.db.execute('''SELECT job FROM jobs
+                                  WHERE state != 'done' AND attempts < ?
+                                  ORDER BY rowid''',(maxAttempts,))
+
+        return [row[0] for row in rows]
+
+    def record(self, job, exitCode, started, finished, output = None,
+               worker = None):
+
+        """ Store the outcome of one attempt at a job """
+
+        self.db.execute('''UPDATE jobs SET state = ?, attempts = attempts + 1,
+                                           started = ?, finished = ?,
+                                           exit_code = ?, output = ?,
+                                           worker = ?
+                           WHERE job = ?''',
+                        ('done' if exitCode == 0 else 'failed',started,
+                         finished,exitCode,output,worker,job))
+        self.db.commit()
+
+    def failed(self):
+
+        """ Jobs whose last attempt failed, with their attempts and exit code """
+
+        return self.db.execute('''SELECT job, attempts, exit_code FROM jobs
+                                  WHERE state = 'failed'
+                                  ORDER BY rowid''').fetchall()
+
+    def counts(self):
+
+        """ Number of jobs in each state """
+
+        return dict(self.db.execute('''SELECT state, COUNT(*) FROM jobs
+                                       GROUP BY state'''))
+
+    def close(self):
+
+        self.db.close()
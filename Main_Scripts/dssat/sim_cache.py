@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Content-addressed cache of DSSAT runs. If none of the inputs of a run
+have changed since it was last simulated, its outputs are copied back from the
+cache instead of running DSSAT again.
+
+    The cache key is a SHA-256 hash of everything the run depends on:
+
+        (1) The text of the rendered FileX
+        (2) The soil profile text
+        (3) The input files it reads: weather (.WTH), Kcb forcing (.KCB),
+            genotype files (.CUL, .ECO, .SPE) and the DSSAT executable itself
+
+    Editing one cultivar parameter therefore only changes the key of the runs
+    that use that genotype file. Files are hashed once per process and the
+    hash is reused until the file's size or modification time changes.
+
+    Each entry is a directory of output files:
+
+        root/ab/abcdef.../Summary.OUT
+
+    The cache is kept under a size cap: evict() removes the least recently
+    used entries (oldest modification time; a hit refreshes it) until the
+    cache fits.
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import hashlib
+import os
+import shutil
+import uuid
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Hashes of files already read: path -> (size, mtime, hash)
+DIGESTS = {}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def fileDigest(path):
+
+    """ SHA-256 of a file, reused while its size and mtime don't change """
+
+    stat = os.stat(path)
+    if path in DIGESTS and DIGESTS[path][:2] == (stat.st_size,stat.st_mtime):
+        return DIGESTS[path][2]
+
+    h = hashlib.sha256()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(1 << 20),b''):
+            h.update(block)
+
+    DIGESTS[path] = (stat.st_size,stat.st_mtime,h.hexdigest())
+
+    return DIGESTS[path][2]
+
+def inputKey(texts, files):
+
+    """ SHA-256 of the inputs of a run.
+
+    Parameters
+    ----------
+    texts : List
+        Text inputs (rendered FileX, soil profile, ...)
+    files : List
+        Paths of the input files the run reads
+
+    """
+
+    h = hashlib.sha256()
+    for text in texts:
+        h.update(text.encode('latin-1'))
+        h.update(b'\0')
+    for path in sorted(files):
+        h.update(('%s:%s\0'%(os.path.basename(path).upper(),
+                             fileDigest(path))).encode())
+
+    return h.hexdigest()
+
+def dirSize(path):
+
+    """ Total size (bytes) of the files in a directory """
+
+    return sum(os.path.getsize(os.path.join(path,f)) for f in os.listdir(path))
+
+class SimCache(object):
+
+    """ Cache of DSSAT outputs keyed by a hash of the run's inputs
+
+    Parameters
+    ----------
+    root : String
+        Directory holding the cache (created if missing)
+    maxBytes : Integer
+        Size cap enforced by evict()
+
+    """
+
+    def __init__(self, root, maxBytes):
+
+        self.root     = root
+        self.maxBytes = maxBytes
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def key(self, texts, files):
+
+        """ Cache key for a run (see inputKey) """
+
+        return inputKey(texts,files)
+
+    def entry(self, key):
+
+        """ Directory of a cache entry """
+
+        return '%s/%s/%s'%(self.root,key[:2],key)
+
+    def get(self, key, oDir):
+
+        """ Copy the cached outputs to oDir. Returns False on a miss """
+
+        entry = self.entry(key)
+        if not os.path.isdir(entry):
+            return False
+
+        for f in os.listdir(entry):
+            shutil.copy2('%s/%s'%(entry,f),oDir)
+
+        # Mark as recently used
+        os.utime(entry)
+
+        return True
+
+    def put(self, key, files):
+
+        """ Store the output files of a run under its key """
+
+        entry = self.entry(key)
+        if os.path.isdir(entry):
+            return
+
+        # Copy to a temporary directory first so other cores never see a
+        # half-written entry
+        tmp = '%s/tmp_%s'%(self.root,uuid.uuid4().hex)
+        os.makedirs(tmp)
+        for f in files:
+            shutil.copy2(f,tmp)
+
+        if not os.path.exists(os.path.dirname(entry)):
+            os.makedirs(os.path.dirname(entry),exist_ok = True)
+        try:
+            os.rename(tmp,entry)
+        except OSError:
+            # Another core stored the same run first
+            shutil.rmtree(tmp)
+
+    def evict(self):
+
+        """ Remove least recently used entries until the cache fits under
+            maxBytes. Returns the number of entries removed.
+        """
+
+        entries = []
+        for prefix in os.listdir(self.root):
+            if len(prefix) != 2:
+                continue
+            for key in os.listdir('%s/%s'%(self.root,prefix)):
+                entry = '%s/%s/%s'%(self.root,prefix,key)
+                entries.append((os.path.getmtime(entry),dirSize(entry),entry))
+
+        entries.sort()
+        total   = sum(e[1] for e in entries)
+        removed = 0
+        for mtime,size,entry in entries:
+            if total <= self.maxBytes:
+                break
+            shutil.rmtree(entry)
+            total   -= size
+            removed += 1
+
+        return removed
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Random access to the profiles in a DSSAT soil file (.SOL) by soil ID.
+
+    The first time a .SOL file is opened, it is scanned once and an index is
+    saved next to it ("soil.sol" -> "soil.sol.idx"). The index holds, for every
+    profile, its byte offset and length in the file plus the texture, depth and
+    description from the profile header line:
+
+        *IBSB910015  SCS         SL     180 Millhopper Fine Sand
+
+    Later runs read the index instead of re-scanning the file. The index is
+    rebuilt automatically whenever the .SOL file's size or modification time
+    changes. Profiles are read lazily from a memory map, so only the profiles
+    you ask for are ever decoded.
+
+    Example:
+
+        soils = SoilLibrary('C:/DSSAT47/Soil/soil.sol')
+        sands = soils.select(texture = 'S', minDepth = 150)
+        soils.extract(sands,'./SANDS.SOL')
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import json
+import mmap
+import os
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def parseHeader(line):
+
+    """ Split a profile header line into ID, texture, depth and description.
+
+        ID and texture follow the DSSAT format (1X,A10,2X,A11,1X,A5,...). Depth
+        and description are split on white space since files written by
+        other tools don't always line them up with the F5.0 column.
+
+    """
+
+    rest = line[30:].split(None,1)
+    try:
+        depth = float(rest[0])
+    except (IndexError,ValueError):
+        depth = None
+
+    return (line[1:11].strip(), line[25:30].strip(), depth,
+            rest[1].strip() if len(rest) > 1 else '')
+
+def scanSol(solFile):
+
+    """ Scan a .SOL file once and return {soil ID: [offset, length, texture,
+        depth, description]}
+    """
+
+    profiles = {}
+    size     = os.path.getsize(solFile)
+    if size == 0:
+        return profiles
+
+    with open(solFile,'rb') as f:
+        mm = mmap.mmap(f.fileno(),0,access = mmap.ACCESS_READ)
+
+        # Offsets of every line that starts with '*'
+        starts = [0] if mm[:1] == b'*' else []
+        i = mm.find(b'\n*')
+        while i != -1:
+            starts.append(i + 1)
+            i = mm.find(b'\n*',i + 1)
+        starts.append(size)
+
+        for start,end in zip(starts[:-1],starts[1:]):
+            eol  = mm.find(b'\n',start,end)
+            line = mm[start:end if eol == -1 else eol].decode('latin-1')
+
+            # File header, e.g. *SOILS: General DSSAT Soil Input File
+            if line.upper().startswith('*SOILS'):
+                continue
+
+            soilID,texture,depth,description = parseHeader(line)
+            profiles[soilID] = [start,end - start,texture,depth,description]
+
+        mm.close()
+
+    return profiles
+
+class SoilLibrary(object):
+
+    """ Indexed, lazily loaded DSSAT soil file
+
+    Parameters
+    ----------
+    solFile : String
+        Path to the .SOL file
+    indexFile : String
+        Path to the saved index (defaults to solFile + '.idx')
+
+    """
+
+    def __init__(self, solFile, indexFile = None):
+
+        self.solFile   = solFile
+        self.indexFile = indexFile if indexFile else solFile + '.idx'
+        self.mm        = None
+        self.profiles  = self.loadIndex()
+
+    def loadIndex(self):
+
+        """ Read the saved index, or rebuild it if the .SOL file changed """
+
+        stat = os.stat(self.solFile)
+
+        if os.path.exists(self.indexFile):
+            try:
+                with open(self.indexFile,'r') as f:
+                    index = json.load(f)
+                if (index['size'] == stat.st_size and
+                    index['mtime'] == stat.st_mtime):
+                    return index['profiles']
+            except (ValueError,KeyError):
+                pass
+
+        profiles = scanSol(self.solFile)
+
+        # A read-only directory just means the index isn't kept between runs
+        try:
+            with open(self.indexFile,'w') as f:
+                json.dump({'size':stat.st_size,'mtime':stat.st_mtime,
+                           'profiles':profiles},f)
+        except OSError:
+            pass
+
+        return profiles
+
+    @property
+    def ids(self):
+
+        """ Soil IDs in the order they appear in the file """
+
+        return sorted(self.profiles,key = lambda s: self.profiles[s][0])
+
+    def __len__(self):
+        return len(self.profiles)
+
+    def __contains__(self, soilID):
+        return soilID in self.profiles
+
+    def info(self, soilID):
+
+        """ Texture, depth (cm) and description of a profile """
+
+        offset,length,texture,depth,description = self.profiles[soilID]
+
+        return {'texture':texture,'depth':depth,'description':description}
+
+    def profile(self, soilID):
+
+        """ Full text of one profile, read from the memory map """
+
+        if self.mm is None:
+            with open(self.solFile,'rb') as f:
+                self.mm = mmap.mmap(f.fileno(),0,access = mmap.ACCESS_READ)
+
+        offset,length = self.profiles[soilID][:2]
+
+        return self.mm[offset:offset + length].decode('latin-1')
+
+    def select(self, texture = None, minDepth = None, maxDepth = None):
+
+        """ Soil IDs matching a texture code and/or a depth range (cm) """
+
+        out = []
+        for soilID in self.ids:
+            offset,length,tx,depth,description = self.profiles[soilID]
+            if texture is not None and tx != texture:
+                continue
+            if minDepth is not None and (depth is None or depth < minDepth):
+                continue
+            if maxDepth is not None and (depth is None or depth > maxDepth):
+                continue
+            out.append(soilID)
+
+        return out
+
+    def extract(self, soilIDs, oFile):
+
+        """ Write a new .SOL file that only holds the given profiles """
+
+        with open(oFile,'w',newline = '') as f:
+            f.write('*SOILS: Subset of %s\n\n'%(os.path.basename(self.solFile)))
+            for soilID in soilIDs:
+                f.write(self.profile(soilID))
+
+    def close(self):
+
+        """ Release the memory map """
+
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Fast reader for DSSAT *SUMMARY output (Summary.OUT / *.OSU files).
+
+    pd.read_fwf has to guess the column widths of every file it reads, and the
+    dotted DSSAT headers ('SOIL_ID...') end up as column names. This reader
+    instead:
+
+        (1) Takes the column boundaries from the '@' header line (every column
+            ends under the last character of its name). The boundaries are
+            cached by header line, so files with the same layout only work
+            them out once.
+        (2) Loads all data rows into one 2-D byte array and decodes each
+            column with a single NumPy slice/conversion (no per-row Python)
+        (3) Types every column by its name, so a column has the same type
+            in every file: dates and counts (INT_COLS) are int32, every other
+            number is float32
+        (4) Treats -99 as missing: NaN for decimal columns, a masked (<NA>)
+            value for integer columns
+        (5) Strips the dots from the names ('SOIL_ID...' -> 'SOIL_ID')
+
+    Example:
+
+        df = readSummary('./AL018102.OSU')
+        df['HWAH']
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import numpy as np
+import pandas as pd
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Text columns in a *SUMMARY table (everything else is numeric)
+TEXT_COLS = ['CR','MODEL','EXNAME','TNAM','FNAM','WSTA','SOIL_ID']
+
+# Integer columns: run/treatment numbers, YYYYDDD dates, counts (number of
+# applications, grains, days) and the amounts DSSAT writes as whole kg/ha or
+# mm (yield, biomass, water and nutrient totals). Every other numeric column
+# is float32
+INT_COLS = ['RUNNO','TRNO','R#','O#','C#','P#','SDAT','PDAT','EDAT','ADAT',
+            'MDAT','HDAT','IR#M','NI#M','PI#M','KI#M','NDCH','H#AM',
+            'DWAP','CWAM','HWAM','HWAH','BWAH','PWAM',
+            'IRCM','PRCM','ETCM','EPCM','ESCM','ROCM','DRCM','SWXM',
+            'NICM','NFXM','NUCM','NLCM','NIAM','CNAM','GNAM',
+            'PICM','PUPC','SPAM','KICM','KUPC','SKAM','RECM',
+            'ONTAM','ONAM','OPTAM','OPAM','OCTAM','OCAM']
+
+# DSSAT missing value
+MISSING = -99
+
+# Column boundaries already worked out, by header line
+SPECS = {}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def columnSpecs(header):
+
+    """ Return [(name, start, end)] for a *SUMMARY '@' header line.
+
+        A column starts right after the previous name and ends under the last
+        character of its own name, which fits both the right-aligned numbers
+        and the left-aligned text (IDs, treatment names) DSSAT writes.
+
+    """
+
+    if header in SPECS:
+        return SPECS[header]
+
+    specs = []
+    end   = 1 # skip the '@'
+    for name in header[1:].split():
+        start = header.index(name,end)
+        specs.append((name.rstrip('.'),end,start + len(name)))
+        end   = start + len(name)
+
+    SPECS[header] = specs
+
+    return specs
+
+def columnType(name):
+
+    """ pandas dtype of a *SUMMARY column (the same for every file) """
+
+    if name in TEXT_COLS:
+        return 'str'
+    if name in INT_COLS:
+        return 'Int32'
+
+    return 'float32'
+
+def decodeColumn(block, name):
+
+    """ Decode one column (2-D uint8 array, one row per line) to a 1-D array """
+
+    raw = np.ascontiguousarray(block).view('S%d'%(block.shape[1])).ravel()
+
+    if name in TEXT_COLS:
+        return np.char.decode(np.char.strip(raw),'latin-1')
+
+    # Blank fields (short lines) are missing
+    blank = (block == 32).all(axis = 1)
+    if blank.any():
+        raw = raw.copy()
+        raw[blank] = str(MISSING).encode()
+
+    if name not in INT_COLS:
+        values = raw.astype(np.float64)
+        values[values == MISSING] = np.nan
+        return values.astype(np.float32)
+
+    values  = raw.astype(np.int32)
+    missing = values == MISSING
+    if missing.any():
+        return pd.arrays.IntegerArray(values,missing)
+
+    return values
+
+def parseSummary(sumFile):
+
+    """ Read a *SUMMARY file into a list of {column name: NumPy array},
+        one per '@' table in the file (normally just one)
+    """
+
+    with open(sumFile,'rb') as f:
+        lines = f.read().splitlines()
+
+    # Group the data rows under the header line they belong to
+    tables = []
+    for line in lines:
+        if line[:1] == b'@':
+            tables.append((line.decode('latin-1'),[]))
+        elif tables and line.strip() and line[:1] not in b'*!':
+            tables[-1][1].append(line)
+
+    if not tables:
+        raise ValueError('No @ header line in %s'%(sumFile))
+
+    out = []
+    for header,rows in tables:
+        specs = columnSpecs(header)
+        width = max(max(len(r) for r in rows) if rows else 0,specs[-1][2])
+
+        # One row per line, padded with spaces to the same width
+        block = np.frombuffer(b''.join(r.ljust(width) for r in rows),
+                              dtype = np.uint8).reshape(len(rows),width)
+
+        out.append({name:decodeColumn(block[:,start:end],name)
+                    for name,start,end in specs})
+
+    return out
+
+def readSummary(sumFile):
+
+    """ Read a *SUMMARY file into a pandas DataFrame """
+
+    frames = [pd.DataFrame(table) for table in parseSummary(sumFile)]
+
+    return frames[0] if len(frames) == 1 else pd.concat(frames,
+                                                        ignore_index = True)
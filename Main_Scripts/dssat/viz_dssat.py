@@ -24,9 +24,11 @@ AUTHOR: Zachary Zambreski, Kansas State University (2020)
 #--------------------#
 
 from __future__ import division
+import glob
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from result_store import ResultStore
 
 #------#
 # MAIN #
@@ -48,6 +50,9 @@ if __name__== "__main__":
     
     # NASS file name
     inNass = 'NASS_Obs.xlsx'
+    
+    # Columnar store that collects the DSSAT output of every run
+    storeDir = '%s/store'%(inDir)
 
 #%%---------------------------------------------------------------------------#
     
@@ -56,40 +61,38 @@ if __name__== "__main__":
     #-----------------#
     
     #
-    # Load DSSAT file into python/pandas dataframe
+    # Load DSSAT files into the result store
     # Create a new panel 
     #
     
-    # Blank dataframe to store processed data
-    outpd = pd.DataFrame()
-    
-    # Iterate each .OSU file using file format
-    for s in range(1,38):
-
-        try:
-            # Load the .OSU file using fixed width
-            # If column widths aren't provided,assumes white space is delimeter
-            # Skip rows that are metadata
-            inDSSAT = pd.read_fwf('%s/%s%02d%s'%(inDir,pref,s,ext),skiprows = 3)        
-            
-            # We only need one row for soil id since it is constant. Retrieve the
-            # first index, which is 0. Python index always starts from 0. In Matlab,
-            # indices start from 1. 
-            soil_id       = inDSSAT['SOIL_ID...'].iloc[0] 
-            harvest_yield = inDSSAT['HWAH']
-        
-            # Add yield for soil type as column
-            outpd[soil_id] = harvest_yield
-        except:
-            pass
+    # Add every .OSU file (using the file format) to the store. Each file is
+    # parsed once; running this again just replaces those runs. The store is
+    # our saved panel: later analysis can query it directly, which is much 
+    # faster than going back to the fixed width text (or Excel) files
+    store = ResultStore(storeDir)
+    store.ingest(sorted(glob.glob('%s/%s*%s'%(inDir,pref,ext))))
+    
+    # Only read the columns we need, of these experiments (EXNAME is the
+    # name of the .OSU file; the store can hold other runs). Then make one
+    # column of yields per soil type, with one row per season
+    runs = store.query(columns = ['EXNAME','SOIL_ID','YEAR','HWAH'])
+    runs = runs[runs['EXNAME'].astype(str).str.startswith(pref)]
+    runs = runs.astype({'SOIL_ID':str})
+    
+    # A soil with more than one run of the same season (several files or
+    # treatments) has no single yield to plot
+    dup = runs.duplicated(['YEAR','SOIL_ID'],keep = False)
+    if dup.any():
+        raise ValueError('More than one %s%s run of the same season and soil: '
+                         '%s'%(pref,ext,', '.join(sorted(
+                         runs.loc[dup,'SOIL_ID'].unique()))))
+    
+    outpd = runs.pivot(index = 'YEAR',columns = 'SOIL_ID',values = 'HWAH')
+    outpd = outpd.reset_index(drop = True)
     
     # Print first couple of rows from dataframe
     print(outpd.head())
     
-    # Save new panel before visualization. We can use this new file later to
-    # accerlate post-simulation analysis
-    outpd.to_excel('./yield_AL.xlsx')
-    
     #
     # Load observed county yield from NASS 
     #
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Run many Google Earth Engine exports (years / regions / bands) at
+    the same time and download the finished GeoTIFFs, instead of starting one
+    Export task per year and downloading the files by hand.
+
+    (1) Every export is described by an ExportJob (dataset, band, dates,
+        reducer, scale, region). The job's content (not its name) is hashed
+        into a key, and the finished raster is kept in a local cache under
+        that key: a job that was exported before is never exported again
+    (2) At most maxActive tasks are submitted/running on the EE servers at
+        once (EE limits the tasks of a user). When EE refuses a task because
+        of the quota it is submitted again later (quotaRetries times at
+        most)
+    (3) The running tasks are polled, waiting longer between polls (backoff)
+        while nothing changes. Failed tasks are submitted again up to
+        retries times
+    (4) Finished rasters are downloaded in a thread pool while the other
+        tasks keep running
+
+    The EE calls are in EEApi. Anything with the same methods (start,
+    status, download, isQuotaError) can be used instead, e.g. a local
+    stand-in for the EE task API when testing.
+
+    Example:
+
+        ee.Initialize()
+        manager = ExportManager(EEApi(bucket = 'my-bucket'),'./rasters/cache')
+        files   = manager.run([ExportJob('NDVI_%d'%(y),'MODIS/006/MOD13A1',
+                                         'NDVI','%d-06-01'%(y),'%d-08-31'%(y),
+                                         'mean',500,region)
+                               for y in range(2001,2021)])
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+REFERENCES:
+
+    https://developers.google.com/earth-engine/guides/exporting
+    https://developers.google.com/earth-engine/guides/usage
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import collections
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Task states (ee.batch.Task.State)
+DONE_STATES   = ['COMPLETED']
+FAILED_STATES = ['FAILED','CANCELLED','CANCEL_REQUESTED']
+
+# Words in the error of a task refused because of the quota
+QUOTA_ERRORS = ['quota','too many','rate limit','429']
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+# One export: name of the output, what to reduce and where
+ExportJob = collections.namedtuple('ExportJob',['name','dataset','band',
+                                                'startDate','endDate',
+                                                'reducer','scale','region'])
+
+class ExportError(IOError):
+
+    """ Some exports failed. files has the rasters of the jobs that did
+        finish ({job name: path}), failed the error of each failed job
+    """
+
+    def __init__(self, message, files, failed):
+
+        IOError.__init__(self,message)
+        self.files  = files
+        self.failed = failed
+
+def jobKey(job):
+
+    """ Content key of a job: everything but the name (same image and region
+        -> same key)
+    """
+
+    spec = [job.dataset,job.band,job.startDate,job.endDate,job.reducer,
+            job.scale,job.region]
+
+    return hashlib.sha1(json.dumps(spec,sort_keys = True).encode()
+                        ).hexdigest()[:16]
+
+class EEApi(object):
+
+    """ Earth Engine side of the exports
+
+    Parameters
+    ----------
+    bucket : String
+        Cloud Storage bucket the rasters are exported to and downloaded
+        from. If None, they are exported to Google Drive and copied from
+        driveDir
+    driveDir : String
+        Local (synced) folder of the Google Drive export folder
+    folder : String
+        Folder (Drive) or path prefix (bucket) of the exports
+    syncTimeout : Float
+        Longest wait (s) for a finished Drive export to be synced to driveDir
+    syncInterval : Float
+        Seconds between checks of driveDir
+
+    """
+
+    def __init__(self, bucket = None, driveDir = None, folder = 'ee_exports',
+                 syncTimeout = 600., syncInterval = 5.):
+
+        if bucket is None and driveDir is None:
+            raise ValueError('Set a bucket or the local Google Drive folder')
+
+        self.bucket   = bucket
+        self.driveDir = driveDir
+        self.folder   = folder
+
+        self.syncTimeout  = syncTimeout
+        self.syncInterval = syncInterval
+
+    def image(self, job):
+
+        """ Image of a job: the band of the dataset reduced over the dates """
+
+        import ee
+
+        collection = ee.ImageCollection(job.dataset).filter(
+                        ee.Filter.date(job.startDate,job.endDate))
+
+        return collection.select(job.band).reduce(
+                        getattr(ee.Reducer,job.reducer)())
+
+    def start(self, job, fileName):
+
+        """ Submit the export of a job, returns the task """
+
+        import ee
+
+        options = dict(image = self.image(job),
+                       description = fileName[:100],
+                       fileFormat = 'GeoTIFF',
+                       region = ee.Geometry(job.region),
+                       scale = job.scale,
+                       fileNamePrefix = self.folder + '/' + fileName
+                                        if self.bucket else fileName)
+        if self.bucket:
+            task = ee.batch.Export.image.toCloudStorage(bucket = self.bucket,
+                                                        **options)
+        else:
+            task = ee.batch.Export.image.toDrive(folder = self.folder,
+                                                 **options)
+        task.start()
+
+        return task
+
+    def status(self, task):
+
+        """ Status dictionary of a task ('state', 'error_message', ...) """
+
+        return task.status()
+
+    def download(self, task, fileName, oFile):
+
+        """ Copy the exported raster of a finished task to oFile """
+
+        if self.bucket is None:
+            shutil.copyfile(self.synced('%s/%s.tif'%(self.driveDir,fileName)),
+                            oFile)
+            return
+
+        import ee
+        import requests
+        from google.auth.transport.requests import Request
+
+        credentials = ee.data.get_persistent_credentials()
+        credentials.refresh(Request())
+        url = 'https://storage.googleapis.com/%s/%s/%s.tif'%(
+                self.bucket,self.folder,fileName)
+        with requests.get(url,stream = True,timeout = 300,
+                          headers = {'Authorization':'Bearer %s'
+                                     %(credentials.token)}) as response:
+            response.raise_for_status()
+            with open(oFile,'wb') as f:
+                shutil.copyfileobj(response.raw,f)
+
+    def synced(self, dFile):
+
+        """ Wait until the Drive client has synced a finished export to
+            driveDir (the file is there and its size stopped changing)
+        """
+
+        deadline = time.monotonic() + self.syncTimeout
+        size     = None
+        while True:
+            if os.path.exists(dFile):
+                if os.path.getsize(dFile) == size and size > 0:
+                    return dFile
+                size = os.path.getsize(dFile)
+            if time.monotonic() > deadline:
+                raise IOError('%s was not synced from Google Drive within %g s'
+                              %(dFile,self.syncTimeout))
+            time.sleep(self.syncInterval)
+
+    def isQuotaError(self, error):
+
+        """ The task was refused because of the quota (try again later) """
+
+        return any(w in str(error).lower() for w in QUOTA_ERRORS)
+
+class ExportManager(object):
+
+    """ Concurrent, polled EE exports with a local raster cache
+
+    Parameters
+    ----------
+    api : EEApi
+        Earth Engine calls (or a stand-in with the same methods)
+    cacheDir : String
+        Directory of the downloaded rasters (<name>_<key>.tif)
+    maxActive : Integer
+        Most tasks submitted/running at once
+    pollInterval : Float
+        Seconds between the first polls of a task
+    maxInterval : Float
+        Longest wait (s) between polls
+    retries : Integer
+        Times a failed task is submitted again
+    maxDownloads : Integer
+        Downloads at the same time
+    quotaRetries : Integer
+        Times a task refused because of the quota is submitted again before
+        the job is given up
+
+    """
+
+    def __init__(self, api, cacheDir = './rasters/cache', maxActive = 3,
+                 pollInterval = 10., maxInterval = 120., retries = 2,
+                 maxDownloads = 4, quotaRetries = 30):
+
+        self.api          = api
+        self.cacheDir     = cacheDir
+        self.maxActive    = maxActive
+        self.pollInterval = pollInterval
+        self.maxInterval  = maxInterval
+        self.retries      = retries
+        self.maxDownloads = maxDownloads
+        self.quotaRetries = quotaRetries
+        self.log          = []
+
+        if not os.path.exists(cacheDir):
+            os.makedirs(cacheDir)
+
+    def cacheFile(self, job):
+
+        return '%s/%s_%s.tif'%(self.cacheDir,job.name,jobKey(job))
+
+    def cached(self, job):
+
+        """ Raster of a job exported before (any name), None if there is none
+        """
+
+        key = jobKey(job)
+        for f in os.listdir(self.cacheDir):
+            if f.endswith('_%s.tif'%(key)):
+                return '%s/%s'%(self.cacheDir,f)
+
+        return None
+
+    def record(self, job, event, detail = ''):
+
+        self.log.append({'time':time.time(),'name':job.name,'event':event,
+                         'detail':detail})
+
+    def run(self, jobs):
+
+        """
+
+        Export (or take from the cache) the raster of every job
+
+        Parameters
+        ----------
+        jobs : List
+            ExportJob per raster
+
+        Returns
+        -------
+        files : Dictionary
+            {job name: path to the GeoTIFF}. If any job failed, ExportError
+            is raised instead, with the files of the others
+
+        """
+
+        files   = {}
+        waiting = collections.deque()
+        for job in jobs:
+            cFile = self.cached(job)
+            if cFile is not None:
+                files[job.name] = cFile
+                self.record(job,'cached',cFile)
+            else:
+                waiting.append(job)
+
+        active   = {}  # name: [job, task, next poll, interval]
+        loading  = {}  # name: (job, future, temporary file)
+        failed   = {}
+        attempts = collections.Counter()
+        refused  = collections.Counter()
+
+        with ThreadPoolExecutor(max_workers = self.maxDownloads) as pool:
+
+            while waiting or active or loading:
+
+                now = time.monotonic()
+
+                # Submit while there is room under the limit
+                while waiting and len(active) < self.maxActive:
+                    job = waiting.popleft()
+                    try:
+                        task = self.api.start(job,'%s_%s'%(job.name,
+                                                           jobKey(job)))
+                    except Exception as e:
+                        if not self.api.isQuotaError(e):
+                            raise
+                        refused[job.name] += 1
+                        self.record(job,'quota',str(e))
+                        if refused[job.name] > self.quotaRetries:
+                            failed[job.name] = 'quota: %s'%(e)
+                            self.record(job,'failed',failed[job.name])
+                            continue
+                        # Quota: try again when a task has finished
+                        waiting.appendleft(job)
+                        if not active:
+                            time.sleep(self.pollInterval)
+                        break
+                    attempts[job.name] += 1
+                    active[job.name] = [job,task,now + self.pollInterval,
+                                        self.pollInterval]
+                    self.record(job,'started',attempts[job.name])
+
+                # Poll the tasks that are due
+                for name in list(active):
+                    job,task,due,interval = active[name]
+                    if due > now:
+                        continue
+                    status = self.api.status(task)
+                    state  = status.get('state')
+
+                    if state in DONE_STATES:
+                        del active[name]
+                        tFile = self.cacheFile(job) + '.tmp'
+                        loading[name] = (job,pool.submit(
+                            self.api.download,task,'%s_%s'%(name,jobKey(job)),
+                            tFile),tFile)
+                        self.record(job,'completed')
+                    elif state in FAILED_STATES:
+                        del active[name]
+                        error = status.get('error_message',state)
+                        self.record(job,'failed',error)
+                        if attempts[name] <= self.retries:
+                            waiting.append(job)
+                        else:
+                            failed[name] = error
+                    else:
+                        # Still running: poll less often the longer it takes
+                        interval = min(interval*1.5,self.maxInterval)
+                        active[name][2:] = [now + interval,interval]
+
+                # Downloads that finished
+                for name in list(loading):
+                    job,future,tFile = loading[name]
+                    if not future.done():
+                        continue
+                    del loading[name]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed[name] = 'download: %s'%(e)
+                        self.record(job,'failed',failed[name])
+                        continue
+                    os.replace(tFile,self.cacheFile(job))
+                    files[name] = self.cacheFile(job)
+                    self.record(job,'downloaded',files[name])
+
+                # Sleep until the next poll is due
+                if active or loading:
+                    nextPoll = min([a[2] for a in active.values()] +
+                                   [time.monotonic() + 1.])
+                    time.sleep(max(0.,min(nextPoll - time.monotonic(),
+                                          self.maxInterval)))
+
+        if failed:
+            raise ExportError('Exports failed (the others are in %s): %s'%(
+                self.cacheDir,'; '.join('%s: %s'%(k,v)
+                                        for k,v in failed.items())),
+                files,failed)
+
+        return files
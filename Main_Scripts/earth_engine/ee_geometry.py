@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Shapefile polygons as a GeoJSON FeatureCollection for Google Earth
+    Engine (regions of exports, feature collections to reduce over).
+
+    (1) The whole layer is converted in one pass (__geo_interface__) instead
+        of one to_json() string per row
+    (2) Geometries are reprojected to lat/lon (what EE expects for GeoJSON)
+        and simplified to a tolerance (degrees): detailed county and field
+        boundaries make large uploads for no gain at 500 m
+    (3) The result is cached as JSON under a key made of the shapefile
+        contents and the options, so a shapefile is converted only once
+
+    Packages: geopandas (geometryPayload only, shapefileHash doesn't need it)
+
+    Example:
+
+        payload  = geometryPayload('./shapefiles/EKSRB.shp',tolerance = 0.001)
+        features = [ee.Feature(f) for f in payload['features']]
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import glob
+import hashlib
+import json
+import os
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Coordinates of GeoJSON sent to EE
+EE_CRS = 'EPSG:4326'
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def shapefileHash(shpFile):
+
+    """ sha1 of all files of a shapefile (.shp, .dbf, .prj, ...) """
+
+    h = hashlib.sha1()
+    for f in sorted(glob.glob(os.path.splitext(shpFile)[0] + '.*')):
+        if f.endswith('.xml'):
+            continue # ArcGIS metadata, doesn't change the geometries
+        h.update(os.path.basename(f).encode())
+        with open(f,'rb') as fid:
+            for chunk in iter(lambda: fid.read(2**20),b''):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+def geometryPayload(shpFile, tolerance = 0., columns = None, dissolve = False,
+                    cacheDir = './cache'):
+
+    """
+
+    GeoJSON FeatureCollection (dictionary) of a shapefile in lat/lon
+
+    Parameters
+    ----------
+    shpFile : String
+        Path to shapefile
+    tolerance : Float
+        Simplify the geometries to this tolerance (degrees, 0 keeps them as
+        they are). Topology is preserved
+    columns : List
+        Attributes kept as feature properties (all if None)
+    dissolve : Boolean
+        Merge all polygons into one feature (e.g. the region of an export)
+    cacheDir : String
+        Directory of the cached payloads
+
+    Returns
+    -------
+    payload : Dictionary
+        {'type': 'FeatureCollection', 'features': [...]}
+
+    """
+
+    import geopandas as gpd
+
+    key = hashlib.sha1(json.dumps([shapefileHash(shpFile),tolerance,columns,
+                                   dissolve,EE_CRS]).encode())
+    cFile = '%s/geometry_%s.json'%(cacheDir,key.hexdigest()[:16])
+    if os.path.exists(cFile):
+        with open(cFile,'r') as f:
+            return json.load(f)
+
+    shapefile = gpd.read_file(shpFile)
+    if columns is not None:
+        shapefile = shapefile[list(columns) + ['geometry']]
+    if shapefile.crs is not None:
+        shapefile = shapefile.to_crs(EE_CRS)
+    if dissolve:
+        shapefile = shapefile[['geometry']].dissolve()
+    if tolerance > 0:
+        shapefile['geometry'] = shapefile.geometry.simplify(
+                                    tolerance,preserve_topology = True)
+
+    # Whole layer at once. The bounding boxes only make the upload bigger
+    payload = shapefile.__geo_interface__
+    payload.pop('bbox',None)
+    for feature in payload['features']:
+        feature.pop('bbox',None)
+
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+    with open(cFile + '.tmp','w') as f:
+        json.dump(payload,f,default = lambda o: o.item()
+                  if hasattr(o,'item') else str(o))
+    os.replace(cFile + '.tmp',cFile)
+
+    # Same types (lists, not tuples) as a payload from the cache
+    with open(cFile,'r') as f:
+        return json.load(f)
@@ -42,14 +42,16 @@ AUTHOR: Zachary Zambreski
 # LIBRARIES IMPORTED #
 #--------------------#
 
+import shutil
 import ee
-import geopandas as gpd
+from ee_exports import EEApi, ExportError, ExportJob, ExportManager
+from ee_geometry import geometryPayload
 
 #------------------------#
 # USER-DEFINED FUNCTIONS #
 #------------------------#
 
-def extractShp(ifile):
+def extractShp(ifile, tolerance = 0.):
     
     """
     
@@ -60,6 +62,8 @@ def extractShp(ifile):
     ----------
     ifile : String
         Path to shapefile
+    tolerance : Float
+        Simplify the polygons to this tolerance (degrees)
 
     Returns
     -------
@@ -68,17 +72,10 @@ def extractShp(ifile):
 
     """
     
+    # All features converted at once (and cached, see ee_geometry.py)
+    payload = geometryPayload(ifile,tolerance)
     
-    shapefile = gpd.read_file(ifile)
-    
-    features = []
-    for i in range(shapefile.shape[0]):
-        geom = shapefile.iloc[i:i+1,:] 
-        jsonDict = eval(geom.to_json()) 
-        geojsonDict = jsonDict['features'][0] 
-        features.append(ee.Feature(geojsonDict)) 
-    
-    return features
+    return [ee.Feature(f) for f in payload['features']]
 
 #------#
 # MAIN #
@@ -107,6 +104,22 @@ if __name__== "__main__":
     
     # Path to EKSRB shapefile
     shpFile= './shapefiles/EKSRB.shp'
+    
+    # Simplify the boundary to this tolerance (degrees) before uploading it.
+    # 0.001 degrees is ~100 m, well below the 500 m of the NDVI
+    tolerance = 0.001
+    
+    # Where EE puts the exports: a Cloud Storage bucket (downloaded
+    # automatically) or your Google Drive (set driveDir to the folder Google
+    # Drive for desktop syncs it to)
+    bucket   = None
+    driveDir = 'G:/My Drive/ee_exports'
+    
+    # Downloaded rasters are kept here, nothing is exported twice
+    cacheDir = './rasters/cache'
+    
+    # Most export tasks running on the EE servers at once
+    maxActive = 3
 
 #%%---------------------------------------------------------------------------#
     
@@ -114,74 +127,62 @@ if __name__== "__main__":
     # Google Earth Processing #
     #-------------------------#
     
-    # Iterate years
+    # Initialize the Earth Engine module (once).
+    # It will tell you that you need to authenticate if it's your first time
+    # Just follow the instructions on your screen. Type the command in your 
+    # anaconda prompt terminal window
+    # Once you do this, you will have access to all the back-end functionality
+    ee.Initialize()
+    
+    # The region of the exports: the EKSRB boundary as one GeoJSON geometry
+    # (also part of the export cache key)
+    region = geometryPayload(shpFile,tolerance,dissolve = True)
+    region = region['features'][0]['geometry']
+    
+    # One export per year: mean NDVI over the dates
+    # scale: resolution you want(meters).. Always specifiy resolution or it
+    # will make it coarse by defualt
+    jobs = []
     for year in years:
         
-        print('Processing %d'%(year))
-        
         # Format start and end dates that EE likes
         sDate = '{}-{:02d}-{:02}'.format(year,startDate[0],startDate[1])
         eDate = '{}-{:02d}-{:02}'.format(year,endDate[0],endDate[1])
         
-        # Initialize the Earth Engine module.
-        # It will tell you that you need to authenticate if it's your first time
-        # Just follow the instructions on your screen. Type the command in your 
-        # anaconda prompt terminal window
-        # Once you do this, you will have access to all the back-end functionality
-        ee.Initialize()
-        
-        # Load collection of available iamges across the dates
-        dataset = ee.ImageCollection(ee_dataset).filter(ee.Filter.date(sDate, eDate));
-        # Select NDVI band
-        ndvi_coll = dataset.select('NDVI');
-        
-        # Calculate the mean NDVI
-        ndvi_mean =  ndvi_coll.reduce(ee.Reducer.mean());
-        
-        # Upload the shapefile into google Earth Engine
-        features = extractShp(shpFile)
-        fc = ee.FeatureCollection(features)
-        geometry = fc.geometry()
-        
-        # Create a geometry representing an export region. This is just a basic
-        # rectangle
-        #geometry = ee.Geometry.Rectangle([-96, 38.8412, -94, 40.01236]);
-        # Export excel table to your google drive. This is YOUR drive. Not Zach's.
-        task = ee.batch.Export.image.toDrive(image=ndvi_mean, 
-                                         description ='export_%d'%(year),
-                                         fileFormat = 'GeoTIFF',
-                                         region = geometry,
-                                         scale = res,   
-                                         # scale: resolution you want(meters).. Always specifiy 
-                                         # resolution or it will make it coarse by defualt
-                                         fileNamePrefix= oName + '%d'%(year))
-        
-        # Start the above task, which is export command. This task may take
-        # some time. 
-        task.start()
-        
-        # Check the status of the task, it may say "RUNNING" for status. Keep printing
-        # until it says completed for the state key. This command returns a python
-        # dictionary.
-        task.status()
-    
-    # Go check your google drive to make sure the files are there!!!
-    # download them to this directory. They will be used to create visualizations
-    # I have already put the two downloaded files from my drive
+        jobs.append(ExportJob(oName + '%d'%(year),ee_dataset,'NDVI',sDate,
+                              eDate,'mean',res,region))
+    
+    # Submit all of the tasks (maxActive at a time), check on them until they
+    # are done and download the GeoTIFFs
+    manager = ExportManager(EEApi(bucket,driveDir),cacheDir,maxActive)
+    try:
+        files  = manager.run(jobs)
+        error  = None
+    except ExportError as e:
+        files  = e.files
+        error  = e
+    
+    # Copy them to the ./rasters folder for the visualizations (the ones
+    # that finished, even if others failed)
+    for name,f in files.items():
+        print('Processed %s'%(name))
+        shutil.copyfile(f,'./rasters/%s.tif'%(name))
+    if error is not None:
+        raise error
 
 #%%--------------------------------------------------------------------------#
 
-    # ASSUMES YOU HAVE DOWNLOADED the two geotiffs to your computer in the
-    # ./rasters folder
+    # The two geotiffs are in the ./rasters folder
     
     #----------------#
     # Visualizations #
     #----------------#
     
+    import sys
     import cartopy.crs as ccrs
-    from cartopy.io.shapereader import Reader
-    import cartopy.feature as cfeature
     from osgeo import gdal
+    sys.path.append('../../Mini_Scripts')
+    from basemap_cache import Basemap, NE_STATES
     import matplotlib.pyplot as plt
     import numpy as np
     
@@ -205,25 +206,27 @@ if __name__== "__main__":
     vmin = -0.5
     vmax = 1
     
+    # Extent of the map in latitude and longitude. Here we can use latitude
+    # and longitude rather than use meters, which would be yikes...
+    # LEt's Zoom in!
+    zoom = [-97.0, -94.4, 38.6,40.1]
+    
+    # Basemap layers read once for both years (and saved for the next run,
+    # see Mini_Scripts/basemap_cache.py). Each map is about half of the
+    # 8 inch figure at 1000 dpi
+    basemap = Basemap(prj,zoom,widthPixels = 4000)
+    
     def drawbasemap(ax):
         
         """ Standard basemap for each subplot """
     
-        # Extent of the map in latitude and longitude. Here we can use latitude
-        # and longitude rather than use meters, which would be yikes...
-        # LEt's Zoom in!
-        zoom = [-97.0, -94.4, 38.6,40.1]
         ax.set_extent(zoom)
     
-        # Draw states using built-in shape features
-        # First arguement is shapely geometry, second argument is crs
-        ax.add_feature(cfeature.NaturalEarthFeature('cultural','admin_1_states_provinces_lines',
-                                                    '10m',edgecolor='gray', 
-                                                    facecolor='none',zorder=100))
+        # Draw states using built-in shape features (Natural Earth)
+        basemap.add(ax,NE_STATES,edgecolor='gray',facecolor='none',zorder=100)
         
         # Add eastern KS RB shapefile boundary only
-        ax.add_geometries(Reader(shpFile).geometries(),ccrs.PlateCarree(),
-                          edgecolor='k',facecolor='none')
+        basemap.add(ax,shpFile,edgecolor='k',facecolor='none')
         
     
     # Iterate the files/open them/plot them
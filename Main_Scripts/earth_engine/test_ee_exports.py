@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Tests of ee_exports against a local stand-in for the Earth Engine
+    task API (no ee package or account needed).
+
+    python -m pytest -q Main_Scripts/earth_engine
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import os
+import sys
+import threading
+import time
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from ee_exports import EEApi, ExportError, ExportJob, ExportManager
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+REGION = {'type':'Point','coordinates':[-96.,39.]}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+class StandIn(object):
+
+    """ EE task API with the methods of EEApi. The first `quota` submissions
+        are refused because of the quota, tasks run for `seconds` and the
+        jobs in `fail` fail once
+    """
+
+    def __init__(self, quota = 0, seconds = 0.05, fail = ()):
+
+        self.quota   = quota
+        self.seconds = seconds
+        self.fail    = set(fail)
+        self.started = []
+        self.active  = 0
+        self.most    = 0
+
+    def start(self, job, fileName):
+
+        if self.quota:
+            self.quota -= 1
+            raise Exception('Too many tasks in queue')
+        self.started.append(job.name)
+        self.active += 1
+        self.most    = max(self.most,self.active)
+
+        return {'name':job.name,'done':time.monotonic() + self.seconds}
+
+    def status(self, task):
+
+        if time.monotonic() < task['done']:
+            return {'state':'RUNNING'}
+        if 'state' not in task:
+            self.active -= 1
+            task['state'] = 'COMPLETED'
+            if task['name'] in self.fail:
+                self.fail.discard(task['name'])
+                task['state'] = 'FAILED'
+        return {'state':task['state'],'error_message':'stand-in failure'}
+
+    def download(self, task, fileName, oFile):
+
+        with open(oFile,'w') as f:
+            f.write(fileName)
+
+    def isQuotaError(self, error):
+
+        return EEApi.isQuotaError(self,error)
+
+def ndviJobs(years):
+
+    return [ExportJob('NDVI_%d'%(y),'MODIS/006/MOD13A1','NDVI','%d-06-01'%(y),
+                      '%d-08-31'%(y),'mean',500,REGION) for y in years]
+
+def manager(api, cacheDir, **kwargs):
+
+    return ExportManager(api,str(cacheDir),pollInterval = 0.01,
+                         maxInterval = 0.05,**kwargs)
+
+def test_exports_quota_and_retries(tmp_path):
+
+    api   = StandIn(quota = 2,fail = ['NDVI_2003'])
+    m     = manager(api,tmp_path,maxActive = 3)
+    files = m.run(ndviJobs(range(2001,2009)))
+
+    assert sorted(files) == ['NDVI_%d'%(y) for y in range(2001,2009)]
+    assert all(os.path.exists(f) for f in files.values())
+    assert not any(f.endswith('.tmp') for f in os.listdir(str(tmp_path)))
+    assert api.most <= 3
+    assert api.started.count('NDVI_2003') == 2
+    assert [e['event'] for e in m.log].count('quota') == 2
+
+def test_cache_by_content(tmp_path):
+
+    jobs = ndviJobs(range(2001,2004))
+    manager(StandIn(),tmp_path).run(jobs)
+
+    # Same content under another name: nothing is exported again
+    api   = StandIn()
+    files = manager(api,tmp_path).run(jobs + [jobs[0]._replace(name = 'other')])
+    assert api.started == []
+    assert files['other'] == files['NDVI_2001']
+
+def test_failed_after_retries(tmp_path):
+
+    api = StandIn(fail = ['NDVI_2002'])
+    m   = manager(api,tmp_path,retries = 0)
+    with pytest.raises(ExportError,match = 'NDVI_2002') as error:
+        m.run(ndviJobs([2001,2002]))
+
+    # The other raster is kept and handed back with the failure
+    assert list(error.value.failed) == ['NDVI_2002']
+    assert list(error.value.files) == ['NDVI_2001']
+    assert os.path.exists(error.value.files['NDVI_2001'])
+
+def test_quota_retries_are_capped(tmp_path):
+
+    api = StandIn(quota = 10**6)
+    m   = manager(api,tmp_path,quotaRetries = 3)
+    with pytest.raises(IOError,match = 'quota'):
+        m.run(ndviJobs([2001,2002]))
+
+    assert api.started == []
+    assert [e['event'] for e in m.log].count('quota') == 8
+
+def test_drive_waits_for_sync(tmp_path):
+
+    driveDir = tmp_path/'drive'
+    driveDir.mkdir()
+    api = EEApi(driveDir = str(driveDir),syncTimeout = 5.,syncInterval = 0.05)
+
+    # The Drive client writes the file a while after the task finished
+    def sync():
+        time.sleep(0.3)
+        (driveDir/'NDVI_2001_key.tif').write_bytes(b'tif')
+    threading.Thread(target = sync).start()
+
+    oFile = str(tmp_path/'out.tif')
+    api.download(None,'NDVI_2001_key',oFile)
+    with open(oFile,'rb') as f:
+        assert f.read() == b'tif'
+
+    api.syncTimeout = 0.2
+    with pytest.raises(IOError,match = 'synced'):
+        api.download(None,'NDVI_2002_key',oFile)
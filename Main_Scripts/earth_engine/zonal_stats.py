@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Per-polygon (zonal) statistics of a raster: mean NDVI of every
+    county, corn hectares of every zone from CDL, Kcb inputs of every
+    Roth_Zones.shp zone...
+
+    Instead of clipping the raster with every polygon, the polygons are
+    rasterized once into a label grid (zone number of every pixel, 0 outside
+    of all zones) on the grid of the raster:
+
+        (1) The label grid is cached (GeoTIFF + zone names) under a key made
+            of the shapefile contents and the raster grid, so it is only
+            rasterized again when either changes
+        (2) The raster and the label grid are read window by window (GDAL
+            blocks, native dtype: BlockRaster of Mini_9/raster_blocks.py).
+            Every window adds to per zone sums with np.bincount, so all
+            zones are done in one pass and the whole raster is never in
+            memory
+        (3) A per zone histogram of the values is kept in the same pass, for
+            percentiles and for class counts/areas (exact for integer
+            rasters with no more than maxBins different values, like CDL)
+
+    Packages: numpy, pandas and gdal (ogr/osr)
+
+    Example:
+
+        zs = ZonalStats('./rasters/NDVI_2019.tif',counties,'NAME10')
+        table = zs.stats(percentiles = (10,50,90))  # count, mean, std, ...
+
+        zs = ZonalStats(cdl,zones,'HWAZ',nodata = 255)
+        corn = zs.classAreas()[1]                   # hectares of corn
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import hashlib
+import json
+import os
+import sys
+from osgeo import gdal, ogr, osr
+import numpy as np
+import pandas as pd
+from ee_geometry import shapefileHash
+
+# Window by window reads are shared with the Mini_9 raster scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..','..','Mini_Scripts','Mini_9'))
+from raster_blocks import BlockRaster
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def rasterizeZones(shpFile, raster, attribute = None, allTouched = False,
+                   cacheDir = './cache'):
+
+    """
+
+    Label grid of the polygons of a shapefile on the grid of a raster. Zone
+    i (1, 2, ...) is the i'th feature of the shapefile, 0 is outside of all
+    zones. Polygons are reprojected to the raster if needed.
+
+    Parameters
+    ----------
+    shpFile : String
+        Path to shapefile
+    raster : gdal.Dataset
+        Raster giving the grid (size, geotransform, projection)
+    attribute : String
+        Field with the zone names (the feature number if None)
+    allTouched : Boolean
+        Every pixel a polygon touches is in the zone (else only pixels with
+        their center in the polygon)
+    cacheDir : String
+        Directory of the cached label grids
+
+    Returns
+    -------
+    labelFile : String
+        Path to the label grid (GeoTIFF)
+    names : List
+        Name of zone 1, 2, ...
+
+    """
+
+    # Key: the polygons, the zone names and the grid they are burned into
+    key = hashlib.sha1(json.dumps([shapefileHash(shpFile),attribute,
+                                   allTouched,raster.RasterXSize,
+                                   raster.RasterYSize,
+                                   list(raster.GetGeoTransform()),
+                                   raster.GetProjection()]).encode())
+    key = key.hexdigest()[:16]
+
+    labelFile = '%s/labels_%s.tif'%(cacheDir,key)
+    nameFile  = '%s/labels_%s.json'%(cacheDir,key)
+    if os.path.exists(labelFile) and os.path.exists(nameFile):
+        with open(nameFile,'r') as f:
+            return labelFile,json.load(f)
+
+    if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+
+    # Copy of the polygons with the zone number as an integer field
+    source = ogr.Open(shpFile)
+    if source is None:
+        raise IOError('Could not open shapefile: %s'%(shpFile))
+    layer  = source.GetLayer()
+    memory = ogr.GetDriverByName('Memory').CreateDataSource('zones')
+    zones  = memory.CreateLayer('zones',layer.GetSpatialRef(),ogr.wkbUnknown)
+    zones.CreateField(ogr.FieldDefn('ZONE',ogr.OFTInteger64))
+
+    names = []
+    for i,feature in enumerate(layer):
+        names.append(str(feature.GetFID()) if attribute is None else
+                     feature.GetField(attribute))
+        zone = ogr.Feature(zones.GetLayerDefn())
+        zone.SetGeometry(feature.GetGeometryRef())
+        zone.SetField('ZONE',i + 1)
+        zones.CreateFeature(zone)
+
+    dtype  = gdal.GDT_UInt16 if len(names) < 2**16 else gdal.GDT_UInt32
+    target = gdal.GetDriverByName('GTiff').Create(
+                labelFile + '.tmp',raster.RasterXSize,raster.RasterYSize,1,
+                dtype,['TILED=YES','COMPRESS=DEFLATE'])
+    target.SetGeoTransform(raster.GetGeoTransform())
+    target.SetProjection(raster.GetProjection())
+    target.GetRasterBand(1).Fill(0)
+
+    options = ['ATTRIBUTE=ZONE']
+    if allTouched:
+        options.append('ALL_TOUCHED=TRUE')
+    err = gdal.RasterizeLayer(target,[1],zones,options = options)
+    target = None # Equivalent to closing a file
+    if err != 0:
+        raise IOError('Could not rasterize %s (GDAL error %d)'%(shpFile,err))
+
+    with open(nameFile,'w') as f:
+        json.dump(names,f)
+    os.replace(labelFile + '.tmp',labelFile)
+
+    return labelFile,names
+
+class ZonalStats(object):
+
+    """ Statistics of the pixels of a raster inside every polygon of a
+        shapefile
+
+    Parameters
+    ----------
+    rasterFile : String
+        Path to raster
+    shpFile : String
+        Path to shapefile with the zones (polygons)
+    attribute : String
+        Field with the zone names (the feature number if None)
+    band : Integer
+        Band number (starts at 1)
+    nodata : Number
+        Value left out if the raster doesn't define a nodata value
+    allTouched : Boolean
+        See rasterizeZones
+    maxBins : Integer
+        Bins of the per zone histograms (percentiles, class counts)
+    minPixels : Integer
+        Smallest window (pixels) read at once
+    cacheDir : String
+        Directory of the cached label grids
+
+    """
+
+    def __init__(self, rasterFile, shpFile, attribute = None, band = 1,
+                 nodata = None, allTouched = False, maxBins = 256,
+                 minPixels = 2**20, cacheDir = './cache'):
+
+        self.rasterFile = rasterFile
+        self.data       = BlockRaster(rasterFile,band,nodata,minPixels)
+        self.raster     = self.data.dataset
+        self.dtype      = self.data.dtype
+
+        labelFile,self.names = rasterizeZones(shpFile,self.raster,attribute,
+                                              allTouched,cacheDir)
+        self.labels  = gdal.Open(labelFile).GetRasterBand(1)
+        self.maxBins = maxBins
+
+        self.sums = None
+
+    def bins(self):
+
+        """ Lower edge, width and number of the histogram bins, and whether
+            there is one bin per value (categorical). Integer rasters with no
+            more than maxBins values are categorical (the min/max of the band
+            are computed unless the dtype is small enough, e.g. uint8)
+        """
+
+        if np.issubdtype(self.dtype,np.integer):
+            info = np.iinfo(self.dtype)
+            if int(info.max) - int(info.min) + 1 <= self.maxBins:
+                return int(info.min),1.,int(info.max) - int(info.min) + 1,True
+
+        lo,hi = self.data.band.ComputeRasterMinMax(False)
+        if np.issubdtype(self.dtype,np.integer) and hi - lo + 1 <= self.maxBins:
+            return int(lo),1.,int(hi - lo + 1),True
+
+        return lo,max(hi - lo,1e-12)/self.maxBins,self.maxBins,False
+
+    def accumulate(self):
+
+        """ The one pass over the raster: count, sum, sum of squares, min,
+            max and histogram of every zone (index 0 is outside of the
+            zones). Done once, every statistic is taken from it.
+        """
+
+        if self.sums is not None:
+            return self.sums
+
+        n = len(self.names) + 1
+        lo,width,nBins,categorical = self.bins()
+
+        count = np.zeros(n,dtype = np.int64)
+        total = np.zeros(n)
+        sq    = np.zeros(n)
+        vmin  = np.full(n,np.inf)
+        vmax  = np.full(n,-np.inf)
+        hist  = np.zeros(n*nBins,dtype = np.int64)
+
+        for window,block in self.data.blocks():
+
+            label = self.labels.ReadAsArray(*window).ravel()
+            value = block.data.ravel()
+
+            valid = (label > 0) & ~np.ma.getmaskarray(block).ravel()
+            if np.issubdtype(self.dtype,np.floating):
+                valid &= np.isfinite(value)
+            if not valid.any():
+                continue
+
+            label = label[valid].astype(np.intp)
+            value = value[valid].astype(np.float64)
+
+            count += np.bincount(label,minlength = n)
+            total += np.bincount(label,value,minlength = n)
+            sq    += np.bincount(label,value*value,minlength = n)
+            np.minimum.at(vmin,label,value)
+            np.maximum.at(vmax,label,value)
+
+            b = np.clip(((value - lo)/width).astype(np.intp),0,nBins - 1)
+            hist += np.bincount(label*nBins + b,minlength = n*nBins)
+
+        self.sums = {'count':count,'sum':total,'sq':sq,'min':vmin,
+                     'max':vmax,'hist':hist.reshape(n,nBins),'lo':lo,
+                     'width':width,'categorical':categorical}
+
+        return self.sums
+
+    def percentiles(self, q):
+
+        """ Percentile q (0 - 100) of every zone from the histograms (same as
+            np.percentile for integer rasters with one bin per value,
+            interpolated inside the bins otherwise)
+        """
+
+        s     = self.accumulate()
+        hist  = s['hist'][1:]
+        count = s['count'][1:]
+        cums  = np.cumsum(hist,axis = 1)
+
+        def value(k):
+
+            # Value of the k'th smallest pixel (0-based) of every zone
+            b      = (cums <= k[:,None]).sum(axis = 1)
+            b      = np.minimum(b,hist.shape[1] - 1)
+            before = np.take_along_axis(cums,b[:,None],1)[:,0] - \
+                     np.take_along_axis(hist,b[:,None],1)[:,0]
+            inBin  = np.take_along_axis(hist,b[:,None],1)[:,0]
+            if s['categorical']:
+                return s['lo'] + b
+            return s['lo'] + (b + (k - before + 0.5)/np.maximum(inBin,1))*\
+                   s['width']
+
+        rank = q/100.*np.maximum(count - 1,0)
+        low  = np.floor(rank)
+        out  = value(low) + (rank - low)*(value(np.ceil(rank)) - value(low))
+        out  = np.clip(out,s['min'][1:],s['max'][1:])
+
+        return np.where(count > 0,out,np.nan)
+
+    def stats(self, percentiles = (10,50,90)):
+
+        """
+
+        Count, mean, std (population), min, max and percentiles of every zone
+
+        Parameters
+        ----------
+        percentiles : List
+            Percentiles (0 - 100) to add as columns p10, p50, ...
+
+        Returns
+        -------
+        table : DataFrame
+            One row per zone (index: zone name)
+
+        """
+
+        s     = self.accumulate()
+        count = s['count'][1:]
+        n     = np.maximum(count,1)
+        mean  = s['sum'][1:]/n
+        var   = np.maximum(s['sq'][1:]/n - mean*mean,0)
+        empty = count == 0
+
+        table = pd.DataFrame({'count':count,
+                              'mean':np.where(empty,np.nan,mean),
+                              'std':np.where(empty,np.nan,np.sqrt(var)),
+                              'min':np.where(empty,np.nan,s['min'][1:]),
+                              'max':np.where(empty,np.nan,s['max'][1:])},
+                             index = pd.Index(self.names,name = 'zone'))
+        for q in percentiles:
+            table['p%g'%(q)] = self.percentiles(q)
+
+        return table
+
+    def classCounts(self):
+
+        """ Pixels of every class (value) in every zone: one row per zone,
+            one column per class. Integer rasters with no more than maxBins
+            values only (e.g. CDL)
+        """
+
+        s = self.accumulate()
+        if not s['categorical']:
+            raise TypeError('Class counts need an integer raster with at most '
+                            '%d values: %s'%(self.maxBins,self.rasterFile))
+
+        hist    = s['hist'][1:]
+        present = np.flatnonzero(hist.sum(axis = 0))
+
+        return pd.DataFrame(hist[:,present],
+                            index = pd.Index(self.names,name = 'zone'),
+                            columns = (s['lo'] + present).astype(int))
+
+    def classAreas(self):
+
+        """ Hectares of every class in every zone (classCounts times the
+            pixel area). The raster has to be projected (meters)
+        """
+
+        srs = osr.SpatialReference(wkt = self.raster.GetProjection())
+        if srs.IsGeographic():
+            raise ValueError('Pixel area in degrees, reproject the raster: %s'
+                             %(self.rasterFile))
+
+        area = self.data.pixelArea()*srs.GetLinearUnits()**2
+
+        return self.classCounts()*area/1e4
+
+    def close(self):
+
+        self.labels = None
+        self.raster = None
+        self.data.close() # Equivalent to closing a file
+
+#------#
+# MAIN #
+#------#
+
+if __name__== "__main__":
+
+    #--------#
+    # INPUTS #
+    #--------#
+
+    # Counties of the eastern Kansas River Basin (zone name: NAME10)
+    counties = '../../Mini_Scripts/Mini_9/boundary_counties.shp'
+
+    # Summer mean NDVI rasters exported by ee_ndvi_eksrb.py
+    rasters = ['./rasters/NDVI_2012.tif','./rasters/NDVI_2019.tif']
+
+#%%---------------------------------------------------------------------------#
+
+    for rFile in rasters:
+
+        zs = ZonalStats(rFile,counties,'NAME10')
+        print(rFile)
+        print(zs.stats(percentiles = (10,50,90)).round(1).to_string(),'\n')
+        zs.close()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Concurrent client for the Kansas Mesonet REST service. Requests for
+many stations (and date ranges / intervals) are sent at the same time over one
+pooled keep-alive session instead of one new connection per station.
+
+    (1) One requests.Session with a connection pool the size of the
+        concurrency limit, so connections to the server are reused
+    (2) asyncio schedules the requests; at most maxConcurrent are in flight
+        (the blocking requests calls run in a thread pool)
+    (3) Connection errors, timeouts and 429/5xx answers are retried with
+        exponential backoff (plus jitter)
+    (4) Every attempt is timed and kept in .metrics (station, window,
+        attempt, HTTP status, seconds, bytes)
+    (5) Long ranges are split into windows sized for the interval (a year
+        of daily data, a month of hourly data, a week of 5-minute data).
+        The windows are fetched in parallel with everything else and joined
+        back in order, keeping the timestamps on window boundaries once
+    (6) Responses are parsed while they download (no copy of the whole body
+        as text): 'M' is read as missing, the variables as float32 and
+        TIMESTAMP as datetime64
+
+    Example:
+
+        client = MesonetClient(maxConcurrent = 8)
+        frames = client.fetch([('Lane',start,end,'day',climVars),
+                               ('Garden City',start,end,'day',climVars)])
+        print(client.summary())
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+REFERENCES:
+
+    See http://mesonet.k-state.edu/rest/ for more information!
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import asyncio
+import datetime
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Location of REST service
+URL_BASE = 'http://mesonet.k-state.edu/rest/stationdata/'
+
+# HTTP answers worth trying again (rate limited / server trouble)
+RETRY_STATUS = [429,500,502,503,504]
+
+# Errors worth trying again (connection lost before/while downloading)
+RETRY_ERRORS = (requests.ConnectionError,requests.Timeout,
+                requests.exceptions.ChunkedEncodingError)
+
+# Mesonet missing value and timestamp format
+MISSING     = 'M'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Longest date range asked for in one request, by interval
+WINDOWS = {'day':datetime.timedelta(days = 366),
+           'hour':datetime.timedelta(days = 31),
+           '5min':datetime.timedelta(days = 7)}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def timeStamp(date):
+
+    """ Date (datetime) in the format the REST service wants """
+
+    return date.strftime('%Y%m%d%H%M%S')
+
+def planWindows(start, end, interval):
+
+    """ Split start -> end into consecutive (start, end) windows no longer
+        than WINDOWS[interval]. Neighbouring windows share their boundary
+    """
+
+    step    = WINDOWS.get(interval.lower())
+    windows = []
+    while step is not None and start + step < end:
+        windows.append((start,start + step))
+        start += step
+    windows.append((start,end))
+
+    return windows
+
+def readCsv(stream, climVars):
+
+    """ Parse a REST response (file-like) into a DataFrame as it is read.
+        Variables are float32 (MISSING is NaN), TIMESTAMP is datetime64
+    """
+
+    variables = climVars.split(',')
+    try:
+        return pd.read_csv(stream,na_values = [MISSING,''],
+                           keep_default_na = False,
+                           dtype = dict({'STATION':str},
+                                        **dict.fromkeys(variables,np.float32)),
+                           parse_dates = ['TIMESTAMP'],
+                           date_format = TIME_FORMAT)
+    except pd.errors.EmptyDataError:
+        df = pd.DataFrame({v:pd.Series(dtype = np.float32) for v in variables})
+        df.insert(0,'STATION',pd.Series(dtype = str))
+        df.insert(0,'TIMESTAMP',pd.Series(dtype = 'datetime64[ns]'))
+        return df
+
+def stitch(frames):
+
+    """ Join the tables of consecutive windows into one, in order, with every
+        (TIMESTAMP, STATION) only once (the request boundaries are inclusive,
+        so they come back twice)
+    """
+
+    if len(frames) == 1:
+        return frames[0]
+
+    return pd.concat(frames,ignore_index = True).drop_duplicates(
+        ['TIMESTAMP','STATION']).reset_index(drop = True)
+
+class MesonetClient(object):
+
+    """ Concurrent Kansas Mesonet REST client
+
+    Parameters
+    ----------
+    urlBase : String
+        Location of the REST service
+    maxConcurrent : Integer
+        Most requests in flight at once (also the connection pool size)
+    retries : Integer
+        Times a failed request is tried again
+    backoff : Float
+        Wait (s) before the first retry; doubles for every retry after it
+    timeout : Float
+        Seconds to wait for the server before giving up on an attempt
+
+    """
+
+    def __init__(self, urlBase = URL_BASE, maxConcurrent = 8, retries = 3,
+                 backoff = 1., timeout = 60.):
+
+        self.urlBase       = urlBase
+        self.maxConcurrent = maxConcurrent
+        self.retries       = retries
+        self.backoff       = backoff
+        self.timeout       = timeout
+        self.metrics       = []
+
+        # Keep-alive connections shared by all requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = 1,
+                                                pool_maxsize = maxConcurrent)
+        self.session.mount('http://',adapter)
+        self.session.mount('https://',adapter)
+
+    def params(self, station, start, end, interval, climVars):
+
+        """ Query parameters of one request """
+
+        return [('stn',station),('int',interval),('t_start',timeStamp(start)),
+                ('t_end',timeStamp(end)),('vars',climVars)]
+
+    def get(self, params, climVars):
+
+        """ Send one request (blocking) and parse the body as it arrives.
+            Returns the HTTP status, the table (None if the request should be
+            retried) and the number of bytes read
+        """
+
+        with self.session.get(self.urlBase,params = params,
+                              timeout = self.timeout,stream = True) as response:
+            if response.status_code in RETRY_STATUS:
+                return response.status_code,None,0
+            response.raise_for_status()
+            response.raw.decode_content = True
+            df = readCsv(response.raw,climVars)
+
+            return response.status_code,df,response.raw.tell()
+
+    async def fetchOne(self, pool, limit, station, start, end, interval,
+                       climVars):
+
+        """ Fetch one station/window, retrying failed attempts """
+
+        loop   = asyncio.get_running_loop()
+        params = self.params(station,start,end,interval,climVars)
+
+        for attempt in range(self.retries + 1):
+
+            # Timed from when the request gets a slot (not the time spent
+            # waiting for one)
+            tic = None
+            try:
+                async with limit:
+                    tic = time.perf_counter()
+                    status,df,nBytes = await loop.run_in_executor(
+                        pool,self.get,params,climVars)
+            except RETRY_ERRORS as e:
+                df     = None
+                status = type(e).__name__
+                nBytes = 0
+
+            self.metrics.append({'station':station,'start':start,'end':end,
+                                 'attempt':attempt + 1,'status':status,
+                                 'seconds':time.perf_counter() - tic
+                                            if tic is not None else 0.,
+                                 'bytes':nBytes})
+
+            if df is not None:
+                return df
+
+            if attempt == self.retries:
+                raise IOError('Mesonet request for %s (%s - %s) failed after '
+                              '%d attempts (%s)'%(station,start,end,
+                              attempt + 1,status))
+
+            # Back off (without holding a slot) before trying again
+            await asyncio.sleep(self.backoff*2**attempt*random.uniform(0.5,1.5))
+
+    async def fetchAll(self, jobs):
+
+        """ Fetch every job concurrently. Results are in the order of jobs """
+
+        limit = asyncio.Semaphore(self.maxConcurrent)
+        with ThreadPoolExecutor(max_workers = self.maxConcurrent) as pool:
+            return await asyncio.gather(*[self.fetchOne(pool,limit,*job)
+                                          for job in jobs])
+
+    def fetch(self, jobs):
+
+        """ Fetch the data of many requests at once. Each request is split
+            into windows (planWindows) and put back together (stitch).
+
+        Parameters
+        ----------
+        jobs : List
+            (station, start, end, interval, climVars) per request. start and
+            end are datetimes, climVars a comma-separated string
+
+        Returns
+        -------
+        frames : List
+            DataFrame (TIMESTAMP, STATION, variables) of each job
+
+        """
+
+        windows = [[(station,s,e,interval,climVars) for s,e in
+                    planWindows(start,end,interval)]
+                   for station,start,end,interval,climVars in jobs]
+        frames  = asyncio.run(self.fetchAll([w for job in windows
+                                             for w in job]))
+
+        out = []
+        for job in windows:
+            out.append(stitch(frames[:len(job)]))
+            frames = frames[len(job):]
+
+        return out
+
+    def summary(self):
+
+        """ Latency summary of all attempts so far """
+
+        if not self.metrics:
+            return 'No requests sent'
+
+        seconds = np.array([m['seconds'] for m in self.metrics])
+        retried = sum(m['attempt'] > 1 for m in self.metrics)
+
+        return ('%d attempts (%d retries), %.1f MB. Latency (s): mean %.2f, '
+                'median %.2f, 95th pct %.2f, max %.2f'%(len(seconds),retried,
+                sum(m['bytes'] for m in self.metrics)/1e6,seconds.mean(),
+                np.median(seconds),np.percentile(seconds,95),seconds.max()))
+
+    def close(self):
+
+        self.session.close()
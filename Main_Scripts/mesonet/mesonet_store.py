@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Local copy of Kansas Mesonet observations so a script only downloads
+the dates (and variables) it doesn't already have.
+
+    Past observations don't change, so every value is downloaded once:
+
+        (1) For each station and variable the store remembers which date
+            ranges it already holds (coverage.json)
+        (2) A request is compared to that, and only the missing ranges are
+            fetched from the REST service (all stations at once, through
+            MesonetClient)
+        (3) The new rows are merged into Parquet files, one per month:
+
+                root/day/Lane/2020-04.parquet
+
+    Only the dates of rows that actually came back are marked as held (an
+    empty or partial answer is asked for again the next time). The last
+    SETTLE of data before today is never marked as held either, so the
+    latest (possibly still changing) observations are downloaded again the
+    next time.
+
+    Requires pandas with pyarrow installed.
+
+    Example:
+
+        store  = MesonetStore('./store')
+        frames = store.fetch([('Lane',start,end,'day',climVars)])
+
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import datetime
+import json
+import os
+import numpy as np
+import pandas as pd
+from mesonet_client import MesonetClient
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Observations younger than this may still be revised
+SETTLE = datetime.timedelta(days = 2)
+
+# How dates are written in coverage.json
+DATE_FORMAT = '%Y%m%d%H%M%S'
+
+# Time between two rows, by interval (a longer gap is data that didn't come)
+STEPS = {'day':datetime.timedelta(days = 1),
+         'hour':datetime.timedelta(hours = 1),
+         '5min':datetime.timedelta(minutes = 5)}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def missingSpans(start, end, covered):
+
+    """ Parts of start -> end (inclusive) that no (start, end) span in
+        covered holds
+    """
+
+    gaps  = []
+    first = start
+    for s,e in sorted(covered):
+        if e < start or s > end:
+            continue
+        if s > start:
+            gaps.append((start,s))
+        start = max(start,e)
+
+    if start < end or (start == end == first and
+                       not any(s <= start <= e for s,e in covered)):
+        gaps.append((start,end))
+
+    return gaps
+
+def mergeSpans(spans):
+
+    """ Union of (start, end) spans as a sorted list of separate spans """
+
+    merged = []
+    for s,e in sorted(spans):
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0],max(merged[-1][1],e))
+        else:
+            merged.append((s,e))
+
+    return merged
+
+def rowSpans(timestamps, start, end, step):
+
+    """ (start, end) spans of a start -> end request held by the rows that
+        came back: consecutive timestamps no more than step apart (one span
+        if step is None). Less than a step at either end of the request
+        has no row to hold it and counts as held
+    """
+
+    ts = pd.DatetimeIndex(timestamps).dropna().sort_values().unique()
+    if len(ts) == 0:
+        return []
+
+    cuts = [0,len(ts)]
+    if step is not None:
+        cuts[1:1] = list(np.flatnonzero(np.diff(ts) > step) + 1)
+
+    spans = [[ts[a].to_pydatetime(),ts[b - 1].to_pydatetime()]
+             for a,b in zip(cuts[:-1],cuts[1:])]
+    if step is not None and spans[0][0] - start < step:
+        spans[0][0] = min(start,spans[0][0])
+    if step is not None and end - spans[-1][1] < step:
+        spans[-1][1] = max(end,spans[-1][1])
+
+    return [tuple(span) for span in spans]
+
+class MesonetStore(object):
+
+    """ Month-partitioned Parquet store of Mesonet observations
+
+    Parameters
+    ----------
+    root : String
+        Directory holding the store (created if missing)
+    client : MesonetClient
+        Client used for the missing data (a default one if None)
+
+    """
+
+    def __init__(self, root, client = None):
+
+        self.root   = root
+        self.client = client if client is not None else MesonetClient()
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def folder(self, station, interval):
+
+        return '%s/%s/%s'%(self.root,interval,station)
+
+    def coverage(self, station, interval):
+
+        """ {variable: [(start, end)]} already in the store """
+
+        cFile = '%s/coverage.json'%(self.folder(station,interval))
+        if not os.path.exists(cFile):
+            return {}
+
+        with open(cFile,'r') as f:
+            cover = json.load(f)
+
+        return {v:[tuple(datetime.datetime.strptime(d,DATE_FORMAT)
+                         for d in span) for span in spans]
+                for v,spans in cover.items()}
+
+    def saveCoverage(self, station, interval, cover):
+
+        cFile = '%s/coverage.json'%(self.folder(station,interval))
+        if not os.path.exists(os.path.dirname(cFile)):
+            os.makedirs(os.path.dirname(cFile))
+        with open(cFile + '.tmp','w') as f:
+            json.dump({v:[[d.strftime(DATE_FORMAT) for d in span]
+                          for span in spans] for v,spans in cover.items()},
+                      f,indent = 1)
+        os.replace(cFile + '.tmp',cFile)
+
+    def merge(self, station, interval, df):
+
+        """ Add newly downloaded rows to the month files (new values win) """
+
+        oDir = self.folder(station,interval)
+        if not os.path.exists(oDir):
+            os.makedirs(oDir)
+
+        df = df.drop(columns = ['STATION']).set_index('TIMESTAMP')
+        for month,part in df.groupby(df.index.to_period('M')):
+            mFile = '%s/%s.parquet'%(oDir,month)
+            if os.path.exists(mFile):
+                part = part.combine_first(pd.read_parquet(mFile))
+            part.sort_index().to_parquet(mFile + '.tmp')
+            os.replace(mFile + '.tmp',mFile)
+
+    def read(self, station, start, end, interval, variables):
+
+        """ Rows of the store between start and end (inclusive) """
+
+        months = pd.period_range(start,end,freq = 'M')
+        files  = ['%s/%s.parquet'%(self.folder(station,interval),m)
+                  for m in months]
+        frames = [pd.read_parquet(f) for f in files if os.path.exists(f)]
+
+        if frames:
+            df = pd.concat(frames)
+            df = df[(df.index >= start) & (df.index <= end)]
+        else:
+            df = pd.DataFrame(index = pd.DatetimeIndex([],name = 'TIMESTAMP'))
+
+        df = df.reindex(columns = variables).astype(np.float32).reset_index()
+        df.insert(1,'STATION',station)
+
+        return df
+
+    def fetch(self, jobs):
+
+        """ Same as MesonetClient.fetch, but only what isn't in the store is
+            downloaded.
+
+        Parameters
+        ----------
+        jobs : List
+            (station, start, end, interval, climVars) per request
+
+        Returns
+        -------
+        frames : List
+            DataFrame (TIMESTAMP, STATION, variables) of each job
+
+        """
+
+        # Missing spans of every job. Variables missing the same span are
+        # asked for in one request
+        todo = {}
+        for station,start,end,interval,climVars in jobs:
+            cover = self.coverage(station,interval)
+            for v in climVars.split(','):
+                for s,e in missingSpans(start,end,cover.get(v,[])):
+                    todo.setdefault((station,s,e,interval),[]).append(v)
+
+        needed = [key + (','.join(variables),)
+                  for key,variables in todo.items()]
+        if needed:
+            settled = datetime.datetime.now() - SETTLE
+            for (station,s,e,interval,climVars),df in zip(needed,
+                                                self.client.fetch(needed)):
+                if df.empty:
+                    continue
+                self.merge(station,interval,df)
+
+                # Only mark the dates rows came back for, and not recent
+                # data (it isn't final yet)
+                spans = [(a,min(b,settled)) for a,b in rowSpans(
+                         df['TIMESTAMP'],s,e,STEPS.get(interval.lower()))
+                         if a <= settled]
+                if not spans:
+                    continue
+                cover = self.coverage(station,interval)
+                for v in climVars.split(','):
+                    cover[v] = mergeSpans(cover.get(v,[]) + spans)
+                self.saveCoverage(station,interval,cover)
+
+        return [self.read(station,start,end,interval,climVars.split(','))
+                for station,start,end,interval,climVars in jobs]
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Tests of mesonet_client and mesonet_store against a local stand-in
+    for the Kansas Mesonet REST service (no network needed).
+
+    python -m pytest -q Main_Scripts/mesonet
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import datetime
+import http.server
+import os
+import sys
+import threading
+import time
+import urllib.parse
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from mesonet_client import MesonetClient, planWindows
+from mesonet_store import MesonetStore
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+D = datetime.datetime
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+
+    """ One row per day from t_start to t_end (inclusive, like the real
+        service). Every variable is the day of the month, 'M' on the 1st.
+        Stations named 'Flaky' answer 503 to their first two requests, days
+        in server.skip (YYYYMMDD) have no row
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+
+        server = self.server
+        q      = dict(urllib.parse.parse_qsl(
+                        urllib.parse.urlparse(self.path).query))
+        with server.lock:
+            server.requests.append(q)
+            server.hits[q['stn']] = server.hits.get(q['stn'],0) + 1
+            hits = server.hits[q['stn']]
+
+        if q['stn'] == 'Flaky' and hits < 3:
+            self.send_response(503)
+            self.send_header('Content-Length','0')
+            self.end_headers()
+            return
+
+        time.sleep(server.delay)
+
+        start = D.strptime(q['t_start'],'%Y%m%d%H%M%S')
+        end   = D.strptime(q['t_end'],'%Y%m%d%H%M%S')
+        vs    = q['vars'].split(',')
+        rows  = ['TIMESTAMP,STATION,' + q['vars']]
+        while start <= end:
+            value = 'M' if start.day == 1 else str(start.day)
+            if start.strftime('%Y%m%d') in server.skip:
+                start += datetime.timedelta(days = 1)
+                continue
+            rows.append('%s,%s,%s'%(start.strftime('%Y-%m-%d %H:%M:%S'),
+                                    q['stn'],','.join([value]*len(vs))))
+            start += datetime.timedelta(days = 1)
+        body = ('\n'.join(rows) + '\n').encode()
+
+        self.send_response(200)
+        self.send_header('Content-Length',str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+
+        pass
+
+@pytest.fixture
+def server():
+
+    srv = http.server.ThreadingHTTPServer(('127.0.0.1',0),StandIn)
+    srv.lock     = threading.Lock()
+    srv.requests = []
+    srv.hits     = {}
+    srv.skip     = set()
+    srv.delay    = 0.
+    srv.url      = 'http://127.0.0.1:%d/'%(srv.server_port)
+    threading.Thread(target = srv.serve_forever,daemon = True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+def test_missing_values_and_types(server):
+
+    client = MesonetClient(server.url)
+    df,    = client.fetch([('Lane',D(2020,4,28),D(2020,5,3),'day','PRECIP,SR')])
+    client.close()
+
+    assert len(df) == 6
+    assert str(df['TIMESTAMP'].dtype).startswith('datetime64')
+    assert df['PRECIP'].dtype == np.float32
+    assert df['SR'].isna().tolist() == [False,False,False,True,False,False]
+
+def test_windows_are_stitched(server):
+
+    start,end = D(2018,1,1),D(2020,6,30)
+    assert len(planWindows(start,end,'day')) == 3
+
+    client = MesonetClient(server.url)
+    df,    = client.fetch([('Lane',start,end,'day','PRECIP')])
+    client.close()
+
+    # Shared window boundaries come back once
+    assert len(server.requests) == 3
+    assert len(df) == (end - start).days + 1
+    assert df['TIMESTAMP'].is_monotonic_increasing
+    assert not df['TIMESTAMP'].duplicated().any()
+
+def test_retries(server):
+
+    client = MesonetClient(server.url,retries = 3,backoff = 0.01)
+    flaky, = client.fetch([('Flaky',D(2020,4,16),D(2020,4,20),'day','SR')])
+    client.close()
+
+    assert len(flaky) == 5
+    assert [m['status'] for m in client.metrics] == [503,503,200]
+    assert [m['attempt'] for m in client.metrics] == [1,2,3]
+
+    client = MesonetClient(server.url,retries = 0,backoff = 0.01)
+    server.hits.clear()
+    with pytest.raises(IOError):
+        client.fetch([('Flaky',D(2020,4,16),D(2020,4,20),'day','SR')])
+    client.close()
+
+def test_latency_excludes_queueing(server):
+
+    # One slot: the last requests wait ~3 delays for it, but are only timed
+    # from when they get it
+    server.delay = 0.2
+    client = MesonetClient(server.url,maxConcurrent = 1)
+    client.fetch([(s,D(2020,4,16),D(2020,4,20),'day','SR')
+                  for s in ['A','B','C','D']])
+    client.close()
+
+    seconds = [m['seconds'] for m in client.metrics]
+    assert len(seconds) == 4
+    assert max(seconds) < 0.4
+    assert min(seconds) >= 0.2
+
+def test_store_fetches_missing_spans_only(server, tmp_path):
+
+    store = MesonetStore(str(tmp_path),MesonetClient(server.url))
+
+    a, = store.fetch([('Lane',D(2020,4,16),D(2020,6,16),'day','PRECIP,SR')])
+    assert len(server.requests) == 1
+
+    # Only the days after the cached span are requested
+    server.requests.clear()
+    b, = store.fetch([('Lane',D(2020,4,16),D(2020,7,16),'day','PRECIP')])
+    assert [(q['t_start'][:8],q['t_end'][:8]) for q in server.requests] == \
+           [('20200616','20200716')]
+
+    # All in the cache
+    server.requests.clear()
+    c, = store.fetch([('Lane',D(2020,5,1),D(2020,6,1),'day','SR')])
+    assert server.requests == []
+
+    assert len(a) == 62 and len(b) == 92 and len(c) == 32
+    assert b['PRECIP'].dtype == np.float32
+
+def test_store_marks_only_rows_that_came_back(server, tmp_path):
+
+    store = MesonetStore(str(tmp_path),MesonetClient(server.url))
+    job   = ('Lane',D(2020,4,16),D(2020,4,30),'day','SR')
+
+    # Nothing came back: asked for again
+    server.skip = {'202004%02d'%(d) for d in range(16,31)}
+    a, = store.fetch([job])
+    server.requests.clear()
+    server.skip = {'20200420','20200421'}
+    b, = store.fetch([job])
+    assert len(a) == 0 and len(b) == 13
+    assert len(server.requests) == 1
+
+    # Only the days without rows are asked for again
+    server.requests.clear()
+    server.skip = set()
+    c, = store.fetch([job])
+    assert [(q['t_start'][:8],q['t_end'][:8]) for q in server.requests] == \
+           [('20200419','20200422')]
+    assert len(c) == 15
@@ -36,8 +36,12 @@ import matplotlib.pyplot as plt
 import statsmodels.api as sm
 import statsmodels.formula.api as smf
 import numpy as np
-import pandas as pd
 import scipy.stats as stats
+import sys
+
+# DSSAT output reader lives with the DSSAT scripts
+sys.path.append('../../Main_Scripts/dssat')
+from summary_parser import readSummary
 
 #------------------------#
 # USER-DEFINED FUNCTIONS #
@@ -69,10 +73,11 @@ if __name__== "__main__":
     # Import data #
     #-------------#
     
-    # Load the .OSU file using fixed width [PANDAS]
-    # If column widths aren't provided,assumes white space is delimeter
-    # Skip rows that are metadata
-    inDSSAT = pd.read_fwf('%s'%(inFile),skiprows = 3)       
+    # Load the .OSU file into a pandas dataframe
+    # pd.read_fwf has to guess the column widths (and can guess wrong when two
+    # numbers run into each other). readSummary uses the widths from the '@'
+    # header line instead, and returns -99 as missing
+    inDSSAT = readSummary(inFile)
     
     print(inDSSAT.columns)
 
@@ -50,7 +50,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import cartopy.crs as ccrs
 from cartopy.io.shapereader import Reader
-import cartopy.feature as cfeature
+import sys
+sys.path.append('..')
+from basemap_cache import Basemap, NE_STATES
 from matplotlib import colors,colorbar
 import matplotlib.ticker as mticker
 
@@ -91,21 +93,19 @@ if __name__== "__main__":
     extent = [-94, -97.5, 38.5,40.1]
     ax.set_extent(extent)
     
-    # Draw states using built-in shape features
-    # First arguement is shapely geometry, second argument is crs
+    # Basemap layers, read once and cached (see ../basemap_cache.py)
+    # simplified to the pixels of the figure (7 inches at 100 dpi)
+    basemap = Basemap(ccrs.PlateCarree(),extent,widthPixels = 700)
+    
+    # Draw states using built-in shape features (Natural Earth)
     # You will notice that the shape is "coarse"
-    ax.add_feature(cfeature.NaturalEarthFeature('cultural','admin_1_states_provinces_lines',
-                                                '10m',edgecolor='gray', 
-                                                facecolor='none'))
+    basemap.add(ax,NE_STATES,edgecolor='gray',facecolor='none')
     
     # Add the counties in the eastern Kansas River Basin
-    # First arguement is shapely geometry, second argument is crs
-    ax.add_geometries(Reader(counties).geometries(),ccrs.PlateCarree(),
-                      edgecolor='gray',facecolor='none')
+    basemap.add(ax,counties,edgecolor='gray',facecolor='none')
     
     # Add eastern KS RB shapefile boundary only
-    ax.add_geometries(Reader(boundary).geometries(),ccrs.PlateCarree(),edgecolor='k',
-                      facecolor='none')
+    basemap.add(ax,boundary,edgecolor='k',facecolor='none')
     
     #plt.close()
     
@@ -29,7 +29,9 @@ AUTHOR: Zachary Zambreski, Kansas State University (2020)
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 from cartopy.io.shapereader import Reader
-import cartopy.feature as cfeature
+import sys
+sys.path.append('..')
+from basemap_cache import Basemap, NE_STATES
 from matplotlib import colors,colorbar
 
 #------------------------#
@@ -73,20 +75,18 @@ if __name__== "__main__":
     extent = [-95.0, -96.3, 38.75,39.6]
     ax.set_extent(extent)
     
-    # Draw states using built-in shape features
-    # First arguement is shapely geometry, second argument is crs
-    ax.add_feature(cfeature.NaturalEarthFeature('cultural','admin_1_states_provinces_lines',
-                                                '10m',edgecolor='gray', 
-                                                facecolor='none'))
+    # Basemap layers projected into UTM 14N once and cached
+    # (see ../basemap_cache.py), simplified to the 600 pixels of the figure
+    basemap = Basemap(prj,extent,widthPixels = 600)
+    
+    # Draw states using built-in shape features (Natural Earth)
+    basemap.add(ax,NE_STATES,edgecolor='gray',facecolor='none')
     
     # Add the counties in the eastern Kansas River Basin
-    # First arguement is shapely geometry, second argument is crs
-    ax.add_geometries(Reader(counties).geometries(),ccrs.PlateCarree(),
-                      edgecolor='gray',facecolor='none')
+    basemap.add(ax,counties,edgecolor='gray',facecolor='none')
  
     # Add eastern KS RB shapefile boundary only
-    ax.add_geometries(Reader(boundary).geometries(),ccrs.PlateCarree(),edgecolor='k',
-                      facecolor='none')
+    basemap.add(ax,boundary,edgecolor='k',facecolor='none')
 
     #
     # Color each shape based on the field 'SVI' in the attribute table
@@ -19,6 +19,11 @@ PURPOSE: Python tutorial: Introduction to GDAL!
     for large rasters. CDL is 30 m data so you may have to zoom to see on matplotlib
     I zoomed in for a small portion of the EKSRB.
     
+    The raster is never read in one piece: BlockRaster (raster_blocks.py)
+    reads it block by block for the class statistics and a decimated copy
+    (overviews) for the plot, both in the native dtype (uint8) with the
+    pixels outside of the EKSRB masked.
+    
     Packages: matplotlib, cartopy, numpy, and gdal
     
    
@@ -29,7 +34,8 @@ INPUTS:
     
 OUTPUTS:
     
-    (1) 
+    (1) Pixel count, area and percent of every CDL category (printed)
+    (2) Fig_9.png
 
 AUTHOR: Zachary Zambreski, Kansas State University (2020)
 
@@ -42,11 +48,12 @@ AUTHOR: Zachary Zambreski, Kansas State University (2020)
 
 import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
-from cartopy.io.shapereader import Reader
-import cartopy.feature as cfeature
 #from matplotlib import colors,colorbar
-from osgeo import gdal
 import numpy as np
+from raster_blocks import BlockRaster
+import sys
+sys.path.append('..')
+from basemap_cache import Basemap, NE_STATES
 
 #------------------------#
 # USER-DEFINED FUNCTIONS #
@@ -81,84 +88,72 @@ if __name__== "__main__":
     # lons that correspond to each pixel location. 
     #
     
-    # Open the raster in python using GDAL
-    raster = gdal.Open(cdl)
+    # Open the raster in python using GDAL (one block at a time)
+    # Values equal to 255 are outside of the EKSRB (I believe value in ArcGIS
+    # when you clip a raster tif). They are masked: not counted, not plotted
+    raster = BlockRaster(cdl,nodata = 255)
     
     #
     # Learn some background about your raster
-    # Check type of the variable 'raster'
     #
-    print(type(raster),'\n')
   
     # Projection
-    print('Projection: ',raster.GetProjection(),'\n')
+    print('Projection: ',raster.proj,'\n')
     
     # Dimensions
-    print('Raster x size: ',raster.RasterXSize,'\n')
-    print('Raster y size: ',raster.RasterYSize,'\n')
+    print('Raster x size: ',raster.xSize,'\n')
+    print('Raster y size: ',raster.ySize,'\n')
     
     # Number of bands
     # There's only 1. It's not multidemnsional. Some rasters from satellite
     # data will contain multiple bands!
-    print('Number of bands in the raster: ',raster.RasterCount,'\n')
+    print('Number of bands in the raster: ',raster.dataset.RasterCount,'\n')
     
     # Metadata for the raster dataset
-    print('Metadata: ', raster.GetMetadata())
-    
-    gt   = raster.GetGeoTransform()
-    proj = raster.GetProjection()
-    
-    # Numbers correspond to categories: crop types
-    data = np.array(raster.ReadAsArray(),dtype=np.float)
+    print('Metadata: ', raster.dataset.GetMetadata())
     
-    print('Geotransform: ',gt)
+    # Numbers correspond to categories: crop types, kept as uint8
+    print('Data type: ',raster.dtype)
+    print('Geotransform: ',raster.gt)
     
     # Tif rasters do not have coordinates for each pixel saved (unfortunately).
     # You have to derive them using the geotransform information such as the
-    # top left corner, x and y resolution....
-    # Corner corodinates and resolution
+    # top left corner, x and y resolution. raster.coords(window) gives the
+    # center coordinates (meters) of the columns and rows of one window, so
+    # a grid of the whole raster never has to be built.
+    extent = raster.extent()
     
-    xres = gt[1] # 30 meters
-    yres = gt[5]
-    # get the edge coordinates and add half the resolution
-    # to go to center coordinates
-    xmin = gt[0] + xres * 0.5
-    xmax = gt[0] + (xres * raster.RasterXSize) - xres * 0.5
-    ymin = gt[3] + (yres * raster.RasterYSize) + yres * 0.5
-    ymax = gt[3] - yres * 0.5
-    
-    
-    extent = (gt[0], gt[0] + raster.RasterXSize * gt[1],
-              gt[3] + raster.RasterYSize * gt[5], gt[3])
+#%%---------------------------------------------------------------------------#
     
-    raster = None # Equivalent to closing a file 
+    #----------------------------#
+    # Statistics of the category #
+    #----------------------------#
     
-    # Create a grid of xy coordinates in the original projection
-    # These will be in meters. WE won't use this to plot, but it's important
-    # to know. 
-    xy_source = np.mgrid[xmin:xmax+xres:xres, ymax+yres:ymin:yres]
-  
+    # Pixels of every category, counted block by block
+    stats = raster.classStats()
     
-    # It's a rectangle!
-    print('Shape of your raster: ',np.shape(data))    
-    print('Shape of your xy_source: ',np.shape(xy_source))
+    print('\n{:>8} {:>12} {:>12} {:>8}'.format('Category','Pixels',
+                                                'Hectares','Percent'))
+    for c,st in stats.items():
+        print('{:>8} {:>12} {:>12.1f} {:>8.2f}'.format(c,st['pixels'],
+                                                      st['hectares'],
+                                                      st['percent']))
 
 #%%---------------------------------------------------------------------------#
     
     #------------------------#
     # Post process the array #
     #------------------------#
-        
-    # Post-process the array
-    # Set values equal to 255 to nan.  (these are outside of the EKSRB)
-    # I believe value in ArcGIS wheny you clip a raster tif 
-    # We don't care about them and don't want them plotted as a color
-    data[data==255] = None
     
-    # Create a new array that only selects pixels with a value that is equal to
-    # 1, which is corn
-    corn = np.array((data == 1)*1,dtype=np.float64)
-    corn[corn==0] = np.nan
+    # A copy small enough to plot (at most 4000 pixels per side). It's a
+    # masked array: pixels outside of the EKSRB are not drawn
+    data = raster.overview(maxSize = 4000)
+    print('Shape of the plotted raster: ',np.shape(data))
+    
+    raster.close()
+    
+    # Only select pixels with a value that is equal to 1, which is corn
+    corn = np.ma.masked_where(data != 1,data)
     
 #%%---------------------------------------------------------------------------#
    
@@ -182,30 +177,30 @@ if __name__== "__main__":
     
     #ax = plt.axes(projection = prj)
     
+    # Extent of the map in latitude and longitude. Here we can use latitude
+    # and longitude rather than use meters, which would be yikes...
+    # LEt's Zoom in!
+    zoom = [-97.0, -94.4, 38.6,40]
+    
+    # Basemap layers projected into Albers once for both subplots (and saved
+    # for the next run, see ../basemap_cache.py). Each map is about half of
+    # the 8 inch figure at 500 dpi
+    basemap = Basemap(prj,zoom,widthPixels = 2000)
+    
     def drawbasemap(ax):
         
         """ Standard basemap for each subplot """
     
-        # Extent of the map in latitude and longitude. Here we can use latitude
-        # and longitude rather than use meters, which would be yikes...
-        # LEt's Zoom in!
-        zoom = [-97.0, -94.4, 38.6,40]
         ax.set_extent(zoom)
     
-        # Draw states using built-in shape features
-        # First arguement is shapely geometry, second argument is crs
-        ax.add_feature(cfeature.NaturalEarthFeature('cultural','admin_1_states_provinces_lines',
-                                                    '10m',edgecolor='gray', 
-                                                    facecolor='none'))
+        # Draw states using built-in shape features (Natural Earth)
+        basemap.add(ax,NE_STATES,edgecolor='gray',facecolor='none')
         
         # Add the counties in the eastern Kansas River Basin
-        # First arguement is shapely geometry, second argument is crs
-        ax.add_geometries(Reader(counties).geometries(),ccrs.PlateCarree(),
-                          edgecolor='gray',facecolor='none')
+        basemap.add(ax,counties,edgecolor='gray',facecolor='none')
      
         # Add eastern KS RB shapefile boundary only
-        ax.add_geometries(Reader(boundary).geometries(),ccrs.PlateCarree(),edgecolor='k',
-                          facecolor='none')
+        basemap.add(ax,boundary,edgecolor='k',facecolor='none')
 
     
     #--
@@ -224,10 +219,7 @@ if __name__== "__main__":
     
     cmap = plt.cm.YlGnBu      # Choose sequential colormap 
     
-    # Plot a color mesh grid
-    gridLons = xy_source[0,:,:].T # Python does rows by columns!! T stands for transpose. Numpy method!
-    gridLats = xy_source[1,:,:].T
-    #img = ax.pcolormesh(gridLons, gridLats, data, transform = prj)  # MUCH SLOWER
+    # Plot the image (pcolormesh with a grid of coordinates is MUCH SLOWER)
     img = ax.imshow(data,extent=extent,vmin=vmin, vmax=vmax,)
     
     ax.set_title('All categories')
@@ -240,7 +232,6 @@ if __name__== "__main__":
     
     ax = axes[1]   
     drawbasemap(ax)
-    #img = ax.pcolormesh(gridLons, gridLats, corn, transform = prj)
     
     # You need to zoom in on this plot to see!!
     img = ax.imshow(corn,extent=extent,vmin=0,vmax=1,cmap=cmap)
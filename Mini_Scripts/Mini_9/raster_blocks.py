@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Read a large raster (like a state CDL mosaic) one window at a time
+instead of loading it all with ReadAsArray().
+
+    (1) Windows follow the GDAL block layout of the file (whole blocks, so
+        no block is decoded twice). Striped tifs have one row blocks, so
+        several block rows are read together until a window holds at least
+        minPixels
+    (2) Values keep the native dtype of the band (uint8 for CDL, not
+        float64). Nodata pixels are masked (numpy masked arrays) instead of
+        being set to NaN
+    (3) Per class pixel counts / areas are summed block by block with
+        np.bincount, so the whole raster is never in memory
+    (4) A decimated read (from the overviews if the file has them) for
+        plotting
+
+    Packages: numpy and gdal
+
+    Example:
+
+        with BlockRaster('./CDL_KSriver_Watershed_2018.tif',nodata = 255) as r:
+            stats = r.classStats()
+            for window,block in r.blocks():
+                ...
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+from osgeo import gdal, gdal_array
+import numpy as np
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def fitsDtype(value, dtype):
+
+    """ value can be stored exactly in dtype. A nodata value that can't
+        (e.g. -9999 on uint8) matches no pixel
+    """
+
+    if np.issubdtype(dtype,np.integer):
+        info = np.iinfo(dtype)
+        return float(value).is_integer() and info.min <= value <= info.max
+
+    return True
+
+class BlockRaster(object):
+
+    """ One band of a raster read window by window
+
+    Parameters
+    ----------
+    path : String
+        Raster file
+    band : Integer
+        Band number (starts at 1)
+    nodata : Number
+        Value that is masked if the file doesn't define a nodata value
+        (e.g. 255 outside of a clipped CDL)
+    minPixels : Integer
+        Smallest window (pixels) read at once
+
+    """
+
+    def __init__(self, path, band = 1, nodata = None, minPixels = 2**20):
+
+        self.path    = path
+        self.dataset = gdal.Open(path)
+        if self.dataset is None:
+            raise IOError('Could not open raster: %s'%(path))
+
+        self.band   = self.dataset.GetRasterBand(band)
+        self.xSize  = self.dataset.RasterXSize
+        self.ySize  = self.dataset.RasterYSize
+        self.gt     = self.dataset.GetGeoTransform()
+        self.proj   = self.dataset.GetProjection()
+        self.dtype  = np.dtype(gdal_array.GDALTypeCodeToNumericTypeCode(
+                                                        self.band.DataType))
+        self.nodata = self.band.GetNoDataValue()
+        if self.nodata is None:
+            self.nodata = nodata
+
+        # Whole blocks per window, at least minPixels each
+        xBlock,yBlock = self.band.GetBlockSize()
+        self.xStep = xBlock
+        self.yStep = yBlock*max(1,int(np.ceil(minPixels/float(xBlock*yBlock))))
+        self.yStep = min(self.yStep,self.ySize)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *args):
+
+        self.close()
+
+    def close(self):
+
+        self.band    = None
+        self.dataset = None # Equivalent to closing a file
+
+    def extent(self):
+
+        """ (left, right, bottom, top) of the raster for imshow """
+
+        gt = self.gt
+        return (gt[0], gt[0] + self.xSize*gt[1],
+                gt[3] + self.ySize*gt[5], gt[3])
+
+    def pixelArea(self):
+
+        """ Area of one pixel in the units of the projection (m2) """
+
+        return abs(self.gt[1]*self.gt[5] - self.gt[2]*self.gt[4])
+
+    def windows(self):
+
+        """ (xoff, yoff, xsize, ysize) of every window, row by row """
+
+        for yoff in range(0,self.ySize,self.yStep):
+            ysize = min(self.yStep,self.ySize - yoff)
+            for xoff in range(0,self.xSize,self.xStep):
+                yield xoff,yoff,min(self.xStep,self.xSize - xoff),ysize
+
+    def mask(self, data):
+
+        """ Masked array of data with the nodata pixels masked """
+
+        if self.nodata is None or not fitsDtype(self.nodata,self.dtype):
+            return np.ma.masked_array(data,mask = False)
+        if np.isnan(self.nodata):
+            return np.ma.masked_invalid(data,copy = False)
+
+        return np.ma.masked_equal(data,self.dtype.type(self.nodata),
+                                  copy = False)
+
+    def read(self, window):
+
+        """ One window as a masked array of the native dtype """
+
+        xoff,yoff,xsize,ysize = window
+
+        return self.mask(self.band.ReadAsArray(xoff,yoff,xsize,ysize))
+
+    def blocks(self):
+
+        """ Iterate over (window, masked array) of the whole raster """
+
+        for window in self.windows():
+            yield window,self.read(window)
+
+    def coords(self, window):
+
+        """ Center x (columns) and y (rows) coordinates of a window in the
+            projection of the raster (1D, build a grid only if needed)
+        """
+
+        xoff,yoff,xsize,ysize = window
+        gt = self.gt
+        x  = gt[0] + (xoff + np.arange(xsize) + 0.5)*gt[1]
+        y  = gt[3] + (yoff + np.arange(ysize) + 0.5)*gt[5]
+
+        return x,y
+
+    def classCounts(self):
+
+        """ Number of valid pixels of every class (value) of an integer
+            raster, summed over the blocks. counts[c] is the count of class c
+        """
+
+        if not np.issubdtype(self.dtype,np.integer):
+            raise TypeError('Class counts need an integer raster, not %s'
+                            %(self.dtype))
+
+        counts = np.zeros(0,dtype = np.int64)
+        for window,block in self.blocks():
+            valid = block.compressed()
+            if valid.size == 0:
+                continue
+            if valid.min() < 0:
+                raise ValueError('Negative class values in %s'%(self.path))
+
+            part   = np.bincount(valid,minlength = len(counts))
+            counts = np.pad(counts,(0,len(part) - len(counts))) + part
+
+        return counts
+
+    def classStats(self):
+
+        """ Statistics of every class present in the raster
+
+        Returns
+        -------
+        stats : Dictionary
+            {class: {'pixels', 'hectares', 'acres', 'percent'}} (areas from
+            the pixel size, percent of all valid pixels)
+
+        """
+
+        counts  = self.classCounts()
+        total   = counts.sum()
+        area    = self.pixelArea()
+
+        stats = {}
+        for c in np.flatnonzero(counts):
+            stats[int(c)] = {'pixels':int(counts[c]),
+                             'hectares':counts[c]*area/1e4,
+                             'acres':counts[c]*area/4046.8564224,
+                             'percent':100.*counts[c]/total}
+
+        return stats
+
+    def overview(self, maxSize = 4000):
+
+        """ Whole raster decimated to at most maxSize pixels per side (nearest
+            value, read from the overviews when there are any) as a masked
+            array of the native dtype. For plotting.
+        """
+
+        step  = max(1,int(np.ceil(max(self.xSize,self.ySize)/float(maxSize))))
+        xBuf  = int(np.ceil(self.xSize/float(step)))
+        yBuf  = int(np.ceil(self.ySize/float(step)))
+        data  = self.band.ReadAsArray(0,0,self.xSize,self.ySize,
+                                      buf_xsize = xBuf,buf_ysize = yBuf,
+                                      resample_alg = gdal.GRIORA_NearestNeighbour)
+
+        return self.mask(data)
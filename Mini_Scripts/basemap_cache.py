@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Basemap layers (state lines, county and watershed boundaries) that
+    are read and reprojected once instead of for every subplot and every
+    figure.
+
+    Reader(shpFile).geometries() and the Natural Earth features are in
+    latitude/longitude, so cartopy reprojects all of them into the map
+    projection every time a map is drawn. Here each layer is:
+
+        (1) Read once, clipped to the map extent in its own coordinates
+            (the Natural Earth lines cover the whole world, and parts far
+            from the map can project badly, e.g. across the dateline) and
+            only then reprojected into the projection of the map (Albers,
+            UTM 14N, PlateCarree...)
+        (2) Clipped to the map again in the map projection and simplified
+            to half a pixel of the saved figure, detail nobody can see anyway
+        (3) Kept in memory (next subplot) and saved to disk (next run of the
+            script, other years of a batch of figures)
+
+    The geometries are drawn in the projection of the map, so cartopy doesn't
+    project them again.
+
+    Packages: cartopy and shapely
+
+    Example:
+
+        basemap = Basemap(prj,extent,widthPixels = 2000)
+        basemap.add(ax,NE_STATES,edgecolor = 'gray',facecolor = 'none')
+        basemap.add(ax,'./boundary_only.shp',edgecolor = 'k',facecolor = 'none')
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import hashlib
+import os
+import pickle
+import numpy as np
+import cartopy.crs as ccrs
+from cartopy.io.shapereader import Reader, natural_earth
+from shapely.geometry import box
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+# Natural Earth state/province lines (category, name, scale)
+NE_STATES = ('cultural','admin_1_states_provinces_lines','10m')
+
+# Layers already loaded by this script {key: geometries}
+LAYERS = {}
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def sourceFile(source):
+
+    """ Shapefile of a layer: a path or a Natural Earth (category, name,
+        scale) tuple (downloaded by cartopy the first time)
+    """
+
+    if isinstance(source,tuple):
+        category,name,scale = source
+        return natural_earth(resolution = scale,category = category,
+                             name = name)
+
+    return source
+
+def mapBounds(prj, extent, margin = 0.1):
+
+    """ (xmin, ymin, xmax, ymax) of a latitude/longitude extent in the map
+        projection, plus a margin (fraction of the size)
+    """
+
+    lon0,lon1 = sorted(extent[:2])
+    lat0,lat1 = sorted(extent[2:])
+
+    # Edges of the extent (curved in most projections)
+    t    = np.linspace(0,1,50)
+    lons = np.r_[lon0 + (lon1 - lon0)*t,np.full(50,lon1),
+                 lon1 - (lon1 - lon0)*t,np.full(50,lon0)]
+    lats = np.r_[np.full(50,lat0),lat0 + (lat1 - lat0)*t,
+                 np.full(50,lat1),lat1 - (lat1 - lat0)*t]
+    xy   = prj.transform_points(ccrs.PlateCarree(),lons,lats)
+
+    xmin,ymin = xy[:,:2].min(axis = 0)
+    xmax,ymax = xy[:,:2].max(axis = 0)
+    dx,dy     = (xmax - xmin)*margin,(ymax - ymin)*margin
+
+    return xmin - dx,ymin - dy,xmax + dx,ymax + dy
+
+class Basemap(object):
+
+    """ Cached basemap layers of one map projection and extent
+
+    Parameters
+    ----------
+    prj : cartopy.crs.Projection
+        Projection of the map axes
+    extent : List
+        [lon, lon, lat, lat] of the map (as in ax.set_extent)
+    widthPixels : Integer
+        Width of one map in the saved figure (figure width x dpi / columns).
+        Geometries are simplified to half a pixel (no simplifying if None)
+    cacheDir : String
+        Directory of the saved layers
+
+    """
+
+    def __init__(self, prj, extent, widthPixels = None,
+                 cacheDir = './basemap_cache'):
+
+        self.prj      = prj
+        self.extent   = extent
+        self.bounds   = mapBounds(prj,extent)
+        self.cacheDir = cacheDir
+
+        self.tolerance = 0.
+        if widthPixels:
+            xmin,ymin,xmax,ymax = mapBounds(prj,extent,margin = 0)
+            self.tolerance = 0.5*(xmax - xmin)/widthPixels
+
+    def key(self, shpFile, srcCrs):
+
+        """ Key of a layer: the geometries, both projections, the clip box
+            and the tolerance
+        """
+
+        h = hashlib.sha1()
+        with open(shpFile,'rb') as f:
+            for chunk in iter(lambda: f.read(2**20),b''):
+                h.update(chunk)
+        h.update(repr([self.prj.proj4_init,srcCrs.proj4_init,
+                       np.round(self.bounds,3).tolist(),
+                       np.round(mapBounds(srcCrs,self.extent),3).tolist(),
+                       round(self.tolerance,6)]).encode())
+
+        return h.hexdigest()[:16]
+
+    def layer(self, source, srcCrs = None):
+
+        """
+
+        Geometries of a layer in the map projection (clipped, simplified)
+
+        Parameters
+        ----------
+        source : String or Tuple
+            Path to shapefile or Natural Earth (category, name, scale)
+        srcCrs : cartopy.crs.CRS
+            Projection of the shapefile (latitude/longitude if None)
+
+        Returns
+        -------
+        geometries : List
+            Shapely geometries in the map projection
+
+        """
+
+        srcCrs  = ccrs.PlateCarree() if srcCrs is None else srcCrs
+        shpFile = sourceFile(source)
+        key     = self.key(shpFile,srcCrs)
+        if key in LAYERS:
+            return LAYERS[key]
+
+        cFile = '%s/layer_%s.pkl'%(self.cacheDir,key)
+        if os.path.exists(cFile):
+            with open(cFile,'rb') as f:
+                LAYERS[key] = pickle.load(f)
+            return LAYERS[key]
+
+        # Clip to the map (plus margin) in the coordinates of the shapefile,
+        # reproject what is left, clip again and simplify, once
+        srcClip    = box(*mapBounds(srcCrs,self.extent))
+        clip       = box(*self.bounds)
+        geometries = []
+        for geom in Reader(shpFile).geometries():
+            geom = geom.intersection(srcClip)
+            if geom.is_empty:
+                continue
+            if srcCrs != self.prj:
+                geom = self.prj.project_geometry(geom,srcCrs)
+            geom = geom.intersection(clip)
+            if self.tolerance > 0:
+                geom = geom.simplify(self.tolerance,preserve_topology = True)
+            if not geom.is_empty:
+                geometries.append(geom)
+
+        if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+        with open(cFile + '.tmp','wb') as f:
+            pickle.dump(geometries,f)
+        os.replace(cFile + '.tmp',cFile)
+
+        LAYERS[key] = geometries
+
+        return geometries
+
+    def add(self, ax, source, srcCrs = None, **kwargs):
+
+        """ Draw a layer on a map axes (kwargs go to ax.add_geometries) """
+
+        return ax.add_geometries(self.layer(source,srcCrs),self.prj,**kwargs)
@@ -33,10 +33,14 @@ REFERENCES:
 # LIBRARIES IMPORTED #
 #--------------------#
 
-import numpy as np
 import pandas as pd
-import requests
 import datetime
+import sys
+
+# Concurrent REST client is shared with the other Mesonet scripts
+sys.path.append('../../../Main_Scripts/mesonet')
+from mesonet_client import MesonetClient
+from mesonet_store import MesonetStore
 
 #------#
 # MAIN #
@@ -70,29 +74,34 @@ if __name__== "__main__":
     # Date information
     start     = datetime.datetime(2020,4,15)
     end       = datetime.datetime(2020,10,15)
+    
+    # Most requests sent to the REST service at the same time
+    maxConcurrent = 8
+    
+    # Local copy of the observations: only dates not already in it are
+    # downloaded (None to download the whole range every time)
+    storeDir = './store'
   
 #%%---------------------------------------------------------------------------#
 
-    for station in stations:
+    #----------------------#
+    # Collect Mesonet data #
+    #----------------------#
     
-        #----------------------#
-        # Collect Mesonet data #
-        #----------------------#
-        
-        # shift date by 1 because the dates will be for the 24 previous hours..
-        sShift = start + datetime.timedelta(days=1)
-        eShift = end + datetime.timedelta(days=1)
-        
-        startTime = '%s000000'%(sShift.strftime('%Y%m%d')) 
-        # End day of month             
-        endTime = '%s000000'%(eShift.strftime('%Y%m%d'))  
-        
-        params =[('stn',station), ('int',interval), ('t_start',startTime),
-                ('t_end',endTime),('vars',climVars)]
-        
-        # Make the request
-        response = requests.get(urlBase, params = params)
-        data = response.text
+    # shift date by 1 because the dates will be for the 24 previous hours..
+    sShift = start + datetime.timedelta(days=1)
+    eShift = end + datetime.timedelta(days=1)
+    
+    # Request every station at once over one pooled session (failed requests
+    # are retried)
+    client = MesonetClient(urlBase, maxConcurrent = maxConcurrent)
+    source = client if storeDir is None else MesonetStore(storeDir,client)
+    frames = source.fetch([(station,sShift,eShift,interval,climVars)
+                           for station in stations])
+    print(client.summary())
+    client.close()
+
+    for station,data in zip(stations,frames):
         
     #%%---------------------------------------------------------------------------#
         
@@ -100,15 +109,9 @@ if __name__== "__main__":
         # Organize into table #
         #---------------------#
             
-        returnedLines = [line.split(',') for line in data.split('\n')]
-        df =  pd.DataFrame(returnedLines)
-        df.columns = df.iloc[0]
-        df = df.reindex(df.index.drop(0))
-    
-        df = df.replace('M', np.nan) # Missing data to nan
-        df[climVars.split(',')] =  df[ climVars.split(',')].apply(pd.to_numeric) 
-        df['TIMESTAMP'] =  pd.to_datetime(df['TIMESTAMP'], 
-                                          format = '%Y-%m-%d %H:%M:%S') 
+        # The client parsed the table while it downloaded: variables are
+        # float32 (missing data 'M' is nan) and TIMESTAMP is already a datetime
+        df = data
         
         # Offset by one day
         # Periods are summarized for the previous 24 hours for the daily interval
@@ -0,0 +1,52 @@
+'''
+Tests of the fixed-width .WTH encoder (wth_writer.py)
+
+    python -m pytest -q travis/dssat_weather
+
+@author: Zach Zambreski 2021
+'''
+
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import wth_writer
+
+
+def test_format_fixed_matches_format():
+
+    # values are rounded to one decimal before they are written (float32
+    # in .WTHB files)
+    rng = np.random.default_rng(0)
+    values = np.r_[rng.uniform(-99.9, 999.9, 1000).round(1),
+                   0.04, -0.04, 999.9, -99.9, 0.0]
+    for column in [values, values.astype(np.float32)]:
+        out = wth_writer.format_fixed(column).tobytes().decode()
+        assert out == ''.join(' {:>5.1f}'.format(v) for v in column)
+
+
+def test_format_fixed_missing_is_blank():
+
+    out = wth_writer.format_fixed([1.0, np.nan, 1e6 * np.nan])
+
+    assert out.tobytes() == b'   1.0' + b' ' * 12
+
+
+@pytest.mark.parametrize('value', [1000.0, 999.96, -100.0, -99.96, 12345.0])
+def test_format_fixed_too_wide(value):
+
+    # 6 characters would touch the previous field (DSSAT misreads the row)
+    with pytest.raises(ValueError):
+        wth_writer.format_fixed([1.0, value])
+
+
+def test_encode_values():
+
+    dates = np.array([20106, 20107])
+    columns = [np.array([23.0, np.nan])] * len(wth_writer.WTH_COLUMNS)
+    rows = wth_writer.encode_values(dates, columns).decode().splitlines()
+
+    assert rows[0] == '20106' + '  23.0' * len(wth_writer.WTH_COLUMNS)
+    assert rows[1] == '20107' + ' ' * 6 * len(wth_writer.WTH_COLUMNS)
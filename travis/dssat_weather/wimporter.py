@@ -11,8 +11,8 @@ Script to import future climate data into DSSAT 4.7
 
 # ! Notes: 
 # ! i.  The configuration file (configuration.xlsx) needs to be filled.
-# ! ii. The script will currently work for a maximum of 99 gcms in a directory/ 
-# !     sub-directory.
+# ! ii. The script will currently work for a maximum of 1035 gcms in a
+# !     directory/sub-directory (stations 01-99, then A0-ZZ).
 # !     
 # Change log
 v1.0
@@ -27,16 +27,32 @@ v0.9.0
 '''
 
 import collections
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
 import numpy as np
 import pandas as pd
 from pathlib import Path
 import sys
+import wth_binary
+import wth_writer
 
 CURRENT_DIRECTORY = Path(sys.argv[0]).parent
 FILE_CONFIGURATION_1 = 'config_1_weather_importer.xlsx'
 # FILE_CONFIGURATION_1 = sys.argv[1]
 LATEST_YEAR = 2100
+# gcm files imported at the same time, and most files submitted at once
+MAX_WORKERS = os.cpu_count()
+MAX_IN_FLIGHT = 2 * MAX_WORKERS
+# also write each station's whole series as a memory mapped binary file
+# (<station>.WTHB, see wth_binary.py) to make .WTH files from later
+WRITE_BINARY = True
 # RUN_SCRIPT = True    
+# characters of the station numbers after 99 (A0 ... ZZ)
+STATION_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+MAX_STATIONS = 99 + 26 * 36
+# gcm file found in the target directory
+GcmFile = collections.namedtuple('GcmFile', ['name', 'path', 'station',
+                                             'size'])
 
 # credits
 HEADER_TEXT = (
@@ -55,37 +71,205 @@ HEADER_TEXT = (
     '#######\n'
 )
 
-print(HEADER_TEXT)
-# 1. Import configuration
-print(''.join([
-    '# 1. Importing configuration\n',
-    'configuration file: ',
-    FILE_CONFIGURATION_1
-    ]),
-    end = '\n\n'
-)
+def station_code(n):
+    '''
+    2 character number of the n-th dssat weather station: 01 to 99, then
+    A0 to ZZ (a letter first, so they never clash with 01-99)
+    '''
+
+    if n < 1 or n > MAX_STATIONS:
+        raise Exception(''.join(['Too many gcm files: at most ',
+                                 str(MAX_STATIONS), ' can be imported']))
+    if n <= 99:
+        return '{:02}'.format(n)
+    n -= 100
+    return STATION_DIGITS[10 + n // 36] + STATION_DIGITS[n % 36]
+
+
+def discover_gcm_files(target_directory, station_prefix):
+    '''
+    walks the target directory once for gcm csv files and gives each one a
+    dssat weather station name (in path order)
+
+    Parameters:
+    target_directory: str
+    station_prefix: str
+        2 letter station prefix
+    Returns:
+    manifest: list of GcmFile (name, path, station, size in bytes)
+    '''
+
+    manifest = []
+    names = set()
+    for file in sorted(Path(target_directory).rglob('*.[Cc][Ss][Vv]')):
+        # Stop script if duplicate gcm file names found in target directory
+        if file.name in names:
+            err_msg = ''.join(['Duplicate filenames found in target ',
+                               'directory.\nCheck: ', file.name])
+            raise Exception(err_msg)
+        names.add(file.name)
+        station = station_prefix + station_code(len(manifest) + 1)
+        manifest.append(GcmFile(name=file.name, path=str(file),
+                                station=station, size=file.stat().st_size))
+
+    return manifest
+
+
+def read_weather_csv(file):
+    '''
+    reads gcm csv file into contiguous numpy arrays sorted by date,
+    calculating annual average temperature and the annual amplitude of
+    monthly average temperature
+
+    The rows of each year are one contiguous block: year i is
+    offsets[i]:offsets[i + 1], so a year is a view of the arrays (no
+    copy, no filtering of the whole series). The offsets are found once
+    and the annual statistics come from the same blocks.
+
+    Parameters:
+    file: str
+        path to file
+    Returns:
+    ws: namedtuple
+        years:   array of the years in the series
+        offsets: array of the first row of each year (plus the end)
+        dates:   array of YYDDD dates
+        values:  2D array, one row per wth_writer.WTH_COLUMNS column
+        tmeans:  dict of annual temperature averages,
+        tamps:   dict of annual monthly temperature amplitudes
+    '''
+
+    try:
+        # import csv
+        dfw = pd.read_csv(file, parse_dates=[0])
+        # check for missing values in csv file
+        if dfw.isna().any().any():
+            err_msg = 'Error: Missing value in input file: ' + str(file)
+            raise Exception(err_msg)
+
+        # rename columns
+        dfw.rename(columns={
+            'tasmax': 'tmax',
+            'tasmin': 'tmin',
+            'pr': 'prec',
+            'rsds': 'srad',
+        }, inplace=True)
+
+        # one DatetimeIndex, sorted so each year is a contiguous block
+        dates = pd.DatetimeIndex(dfw['Date'])
+        order = np.argsort(dates.values, kind='stable')
+        dates = dates[order]
+        year = dates.year.to_numpy()
+        # select all years below 2100 (DSSAT wth files use 2 digit years
+        # in their time series. 2000 and 2100 will have the same
+        # date-doy value)
+        keep = order[year < LATEST_YEAR]
+        dates = dates[year < LATEST_YEAR]
+        year = year[year < LATEST_YEAR]
+        month = dates.month.to_numpy()
+        yydoy = (year % 100) * 1000 + dates.dayofyear.to_numpy()
 
-try:
-    df_config = pd.read_excel(FILE_CONFIGURATION_1,
-                    sheet_name='config_1', skiprows=2, index_col=0,
-                    usecols=[0, 1], header=1)
-    
-    # configuration parameters
-    TARGET_DIRECTORY = str(df_config.at['target_directory', 'Value'])
-    OUT_DIRECTORY = Path(str(df_config.at['out_directory', 'Value']))
-    STATION_PREFIX = str(df_config.at['station_prefix','Value'])[:2].upper()
-    LATITUDE = float(df_config.at['latitude', 'Value'])
-    LONGITUDE = float(df_config.at['longitude', 'Value'])
-    ELEVATION = int(df_config.at['elevation', 'Value'])
-    INSTRUMENT_HEIGHT = float(
-        df_config.at['instrument_height', 'Value'])
-    ANEMOMETER_HEIGHT = float(
-        df_config.at['anemometer_height', 'Value'])
-    FILE_LEGEND_GCMS_DSSAT_STATIONS = 'gcm-dssat_station_legend.csv'
-    
-except Exception as e:
-    print(e, '\nFailed to import configuration!', end='\n')
-    input("Enter any key to quit.")
+        # value columns (dewp, par and evap aren't in the gcm files)
+        values = np.vstack([
+            dfw[col].to_numpy(dtype=np.float64)[keep]
+            if col not in ['dewp', 'par', 'evap']
+            else np.full(len(keep), np.nan)
+            for col in wth_writer.WTH_COLUMNS])
+        tmean = values[[wth_writer.WTH_COLUMNS.index('tmax'),
+                        wth_writer.WTH_COLUMNS.index('tmin')]].mean(axis=0)
+
+        # first row of each year, annual tmean and annual tamp (spread of
+        # the monthly means within each year)
+        years, offsets, tmean_annual, tamp_annual = \
+            wth_writer.annual_temperature(year, month, tmean)
+
+        # wseries named tuple
+        wseries = collections.namedtuple(
+            'wseries', ['years', 'offsets', 'dates', 'values', 'tmeans',
+                        'tamps', 'file_path'])
+        ws = wseries(years=years,
+                offsets=offsets,
+                dates=yydoy,
+                values=np.round(values, 1),
+                tmeans=dict(zip(years, tmean_annual)),
+                tamps=dict(zip(years, tamp_annual)),
+                file_path=file)
+        print('input file read: ', file)
+        return ws
+
+    except Exception as e:
+        print(e, '\nError: Could not import csv file: ', file, end='\n')
+        return None
+
+
+def import_gcm(file, station, settings):
+    '''
+    reads one gcm csv file and writes a wth file for each of its years
+    (runs in a worker process)
+
+    Parameters:
+    file: str
+        path to file
+    station: str
+        dssat weather station name (prefix and number)
+    settings: dict
+        out_directory, latitude, longitude, elevation, instrument_height
+        and anemometer_height from the configuration
+    Returns:
+    file, station and the number of wth files written
+    '''
+
+    wseries = read_weather_csv(file)
+    if(wseries == None):
+        raise Exception('Error: Could not import csv file: ' + str(file))
+
+    # years in the series and where their rows start
+    for i, year in enumerate(wseries.years):
+        rows = slice(wseries.offsets[i], wseries.offsets[i + 1])
+        yy = str(year)[-2:]
+
+        # generate wth file name
+        wth_filename = ''.join([station, yy, '01.WTH'])
+
+        # create header
+        sect_header = wth_writer.format_header(
+            insi=station,
+            lat=settings['latitude'],
+            long=settings['longitude'],
+            elev=settings['elevation'],
+            tavg=wseries.tmeans[year],
+            tamp=wseries.tamps[year],
+            ref_ht=settings['instrument_height'],
+            wind_ht=settings['anemometer_height'],
+            co2_conc = -99.0)
+
+        # create values section (all days formatted at once, NaN left
+        # blank)
+        sect_values = wth_writer.encode_values(
+            wseries.dates[rows], wseries.values[:, rows])
+
+        # write file
+        wth_file = Path(settings['out_directory']).joinpath(wth_filename)
+        wth_writer.write_wth(wth_file, sect_header, sect_values)
+        print('wrote: ', wth_file, end='\n')
+
+    if WRITE_BINARY:
+        full_years = np.repeat(wseries.years, np.diff(wseries.offsets))
+        wth_binary.write_binary(
+            Path(settings['out_directory']).joinpath(station + '.WTHB'),
+            insi=station,
+            lat=settings['latitude'],
+            long=settings['longitude'],
+            elev=settings['elevation'],
+            ref_ht=settings['instrument_height'],
+            wind_ht=settings['anemometer_height'],
+            dates=full_years * 1000 + wseries.dates % 1000,
+            values=wseries.values,
+            annual=(wseries.years,
+                    [wseries.tmeans[y] for y in wseries.years],
+                    [wseries.tamps[y] for y in wseries.years]))
+
+    return file, station, len(wseries.years)
 
 def main():
     '''
@@ -100,37 +284,16 @@ def main():
         ]),
         end = '\n\n'
     ) 
+    manifest = []
     while(True):
         try:
-            dssat_weather_stations = []  # names for dssat weather stations
-            wfiles_in = {}      # dictionary for gcm file name, path, and dssat
-            
-            # weather station name
-            # file_list = []      # file paths
-            filenames = []     # file names
-            station_counter = 1
-  
-            for file in Path(TARGET_DIRECTORY).rglob('*.[Cc][Ss][Vv]'):
-                # Stop script if duplicate gcm file names found in target
-                # directory
-               
-                filenames.append(str(file).split(
-                    '\\')[-1])  # extract file name
-                
-                for filename in filenames:
-                    if filenames.count(filename) > 1:
-                        err_msg = ''.join(
-                            ['Duplicate filenames found in target directory.',
-                                '\nCheck: ', filename])
-                        raise Exception(err_msg)
-                dssat_station_name = '{}{:>02}'.format(STATION_PREFIX,
-                                                        station_counter)
-                # create dictionary: keys=gcm file name, values= file path,
-                # station name
-                wfiles_in[str(file).split('\\')[-1]] = [str(file),
-                                                        dssat_station_name]
-                dssat_weather_stations.append(dssat_station_name)
-                station_counter += 1
+            manifest = discover_gcm_files(TARGET_DIRECTORY, STATION_PREFIX)
+            print(''.join([
+                str(len(manifest)), ' gcm files found (',
+                '{:.1f}'.format(sum(f.size for f in manifest) / 1e6), ' MB)'
+                ]),
+                end = '\n\n'
+            )
             break
 
         except Exception as e:
@@ -138,98 +301,10 @@ def main():
             input("Enter any key to quit.")
             break
 
-    def read_weather_csv(file):
-        '''
-        reads gcm csv file into a pandas dataframe calculating annual 
-        average temperature and the average of monthyly temperature 
-        amplitudes monthly
-
-        Parameters:
-        file: str
-            path to file
-        Returns:
-        ws: namedtuple
-            df :    weather series pandas DataFrame 
-            tmeans: list of annual temperature averages, 
-            tamps:  list of the annual average of monthyly temperature 
-                    amplitudes
-        '''
-
-        try:
-            # import csv
-            dfw = pd.read_csv(file, parse_dates=[0])
-            # check for missing values in csv file
-            if dfw.isna().any().any():
-                err_msg = 'Error: Missing value in input file: ' + str(file)
-                raise Exception(err_msg)
-
-            else:
-                # rename columns
-                dfw.rename(columns={
-                    'tasmax': 'tmax',
-                    'tasmin': 'tmin',
-                    'pr': 'prec',
-                    'rsds': 'srad',
-                }, inplace=True)
-
-                dfw['tmean'] = dfw[['tmax', 'tmin']].mean(axis=1)
-                dfw['year'] = pd.DatetimeIndex(dfw['Date']).year
-                dfw['month'] = pd.DatetimeIndex(dfw['Date']).month
-                dfw['day'] = pd.DatetimeIndex(dfw['Date']).day
-                dfw['doy'] = pd.DatetimeIndex(dfw['Date']).dayofyear
-                dfw['dewp'] = np.nan
-                dfw['par'] = np.nan
-                dfw['evap'] = np.nan
-            
-            # select all years below 2100 (DSSAT wth files use 2 digit years
-            # in their time series. 2000 and 2100 will have the same 
-            # date-doy value)
-            dfw = dfw[dfw.year < LATEST_YEAR]
-            # dfw['date_yydoy'] = dfw['date'].dt.strftime('%y') +\
-            #                     dfw['doy'].astype(str)
-            dfw['date_yydoy'] = dfw['year'].astype(str).str[-2:] +\
-                dfw['doy'].astype(str).str.pad(width=3, fillchar='0')
-
-            # annual tmean
-            tmean_annual = dfw[['year', 'tmean']].\
-                groupby(['year']).mean().to_dict('index')
-            # convert dict to year: value
-            tmean_annual = {
-                k:v['tmean'] for k,v in tmean_annual.items()
-            }  
-            # annual tamp
-            tmean_monthly = dfw[['year', 'month', 'tmean']].\
-                groupby(['year', 'month']).mean()
-            tmax_monthly_means = tmean_monthly.groupby(['year']).max()
-            tmin_monthly_means = tmean_monthly.groupby(['year']).min()
-            tamp_annual = (tmax_monthly_means - tmin_monthly_means).\
-                to_dict('index')
-            tamp_annual = {k:v['tmean'] for k,v in tamp_annual.items()}
-            # wseries named tuple
-            wseries = collections.namedtuple(
-                'wseries', ['df', 'tmeans', 'tamps', 'file_path'])
-            ws = wseries(df=dfw[['year', 'date_yydoy', 'srad', 'tmax',
-                    'tmin', 'prec', 'dewp', 'wind', 'par', 'evap', 'rh','et'
-                    ]].round({
-                        'srad': 1, 'tmax': 1, 'tmin': 1, 'prec': 1,
-                        'dewp': 1, 'wind': 1, 'par': 1, 'rh': 1,'et':1,
-                    }),
-                    tmeans=tmean_annual,
-                    tamps=tamp_annual,
-                    file_path=file)
-            print('input file read: ', file)
-            return ws
-
-        except Exception as e:
-            print(e, '\nError: Could not import csv file: ', file, end='\n')
-            return None
-
     # 3. Read in gcm weather series and write DSSAT wth files
     while(True):
         # Check weather directory for old files and read new files
         try:
-            # Get file paths for gcm weather files
-            file_list = [file[0] for file in wfiles_in.values()]
             # Check if one or more files in the dssat weather folder have 
             # the same station prefix as in the configuration file
             print(''.join([
@@ -239,8 +314,7 @@ def main():
             )
             wfile_list = Path(
                OUT_DIRECTORY).glob('*.[Ww][Tt][Hh]')
-            station_prefixes = [str(value).split('\\')[-1][:2]
-                                for value in wfile_list]
+            station_prefixes = [value.name[:2] for value in wfile_list]
             check = [idx for idx in station_prefixes if idx.upper() ==
                     STATION_PREFIX]
             if(check):
@@ -257,92 +331,55 @@ def main():
                     'No previous dssat weather stations found!', 
                     end = '\n\n'
                 )
-                station_counter = 1
                 weather_stations = {}
-                future_weather_list = []
+                failed = []
+                settings = {
+                    'out_directory': OUT_DIRECTORY,
+                    'latitude': LATITUDE,
+                    'longitude': LONGITUDE,
+                    'elevation': ELEVATION,
+                    'instrument_height': INSTRUMENT_HEIGHT,
+                    'anemometer_height': ANEMOMETER_HEIGHT,
+                }
 
-                # read in weather series and break their import in case 
-                # there's an issue reading in one of the files
+                # each gcm file is read, checked and written as its own task
+                # in a process pool. Only MAX_IN_FLIGHT files are submitted
+                # at a time, so memory doesn't grow with the number of gcms.
+                # Station names were given in discovery order, so they don't
+                # depend on which task finishes first. Largest files go
+                # first so the pool doesn't end on one big file. Stop
+                # submitting if one of the files can't be imported
                 print('# 4. Importing weather series', end = '\n')
-                for file in file_list:
-                    ws = read_weather_csv(file)
-                    if(ws == None):
-                        raise Exception()
-                    else:
-                        future_weather_list.append(ws)
-
-                for wseries in future_weather_list:
-                    
-                    station_counter_fmt = '{:02}'.format(station_counter)
-                    weather_station = ''.join(
-                        [STATION_PREFIX, station_counter_fmt])
-                    weather_stations[wseries.file_path] = weather_station
-                    # get list of unique years to use in generating file names
-                    wth_years = wseries.df.year.unique()
-                    for year in wth_years:
-                        yy = str(year)[-2:]
-                        
-                        # generate wth file name
-                        wth_filename = ''.join(
-                            [STATION_PREFIX, station_counter_fmt, yy, '01.WTH'])
-                        
-                        # create header
-                        sect_header = ''.join(['*WEATHER DATA : {insi}\n',
-                            '\n', '@ INSI      LAT     LONG  ELEV   TAV   AMP ',
-                            'REFHT WNDHT    CO2\n',
-                            '  {insi:>4} {lat:>8.3f} {long:>8.3f} {elev:>5} ',
-                            '{tavg:>5.1f} {tamp:>5.1f} {ref_ht:>5.1f} ',
-                            '{wind_ht:5.1f} {co2_conc:>6.1f}\n',
-                            '@DATE  SRAD  TMAX  TMIN  RAIN  DEWP  WIND   PAR  ',
-                            'EVAP  RHUM  RFET\n']).format(
-                            insi=''.join(
-                                [STATION_PREFIX, station_counter_fmt]),
-                            lat=LATITUDE,
-                            long=LONGITUDE,
-                            elev=ELEVATION,
-                            tavg=wseries.tmeans[year],
-                            tamp=wseries.tamps[year],
-                            ref_ht=INSTRUMENT_HEIGHT,
-                            wind_ht=ANEMOMETER_HEIGHT,
-                            co2_conc = -99.0)
-
-                        # create values section               
-                        sect_values = wseries.df[
-                            wseries.df.year == year]\
-                            .drop(columns='year').to_string(
-                                header=False,
-                                index=False,
-                                formatters={
-                                    'date_yydoy': '{:<5}'.format,
-                                    'srad': '{:>5.1f}'.format,
-                                    'tmax': '{:>5.1f}'.format,
-                                    'tmin': '{:>5.1f}'.format,
-                                    'prec': '{:>5.1f}'.format,
-                                    'wind': '{:>5.1f}'.format,
-                                    'rh': '{:>5.1f}'.format,
-                                    'et':'{:>5.1f}'.format
-                                },
-                                na_rep='     ')
-                        
-                        
-
-                        sect_values_n = ''
-                        for line in sect_values.splitlines():
-                            line = line[1:] +'\n'
-                            sect_values_n += line 
-
-                        # build full file
-                        file_text = sect_header + sect_values_n
-                        # write file
-                        
-                        wth_file =OUT_DIRECTORY.joinpath(
-                            wth_filename)
-                  
-                        with open(wth_file, 'w') as f:
-                            f.write(file_text)
-                            print('wrote: ', wth_file, end='\n')
-
-                    station_counter += 1
+                pending = collections.deque(
+                    sorted(manifest, key=lambda f: f.size, reverse=True))
+                running = set()
+                with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+                    while pending or running:
+                        while (pending and not failed and
+                               len(running) < MAX_IN_FLIGHT):
+                            gcm = pending.popleft()
+                            running.add(pool.submit(import_gcm, gcm.path,
+                                                    gcm.station, settings))
+                        if failed:
+                            pending.clear()
+                        if not running:
+                            break
+                        done, running = wait(running,
+                                             return_when=FIRST_COMPLETED)
+                        for future in done:
+                            try:
+                                file, station, n_files = future.result()
+                                weather_stations[file] = station
+                                print('imported: ', file, '->', station,
+                                      '({} wth files)'.format(n_files),
+                                      end='\n')
+                            except Exception as e:
+                                failed.append(e)
+                                print(e, end='\n')
+                if failed:
+                    raise Exception(''.join([
+                        'Import stopped: ', str(len(failed)),
+                        ' gcm file(s) could not be imported']))
 
             # write gcm weather series - dssat weather station legend
             try:
@@ -357,10 +394,11 @@ def main():
                     ]), 
                     end = '\n\n'
                 )
-                for k in weather_stations.keys():
+                for k in sorted(weather_stations,
+                                key=weather_stations.get):
                     file_text = file_text +\
                         '{},{},{}\n'.format(
-                            str(k).split('\\')[-1],
+                            Path(k).name,
                             weather_stations[k],
                             str(k)
                         )
@@ -391,5 +429,38 @@ def main():
             break
 
 if __name__ == "__main__":
+    print(HEADER_TEXT)
+    # 1. Import configuration
+    print(''.join([
+        '# 1. Importing configuration\n',
+        'configuration file: ',
+        FILE_CONFIGURATION_1
+        ]),
+        end = '\n\n'
+    )
+
+    try:
+        df_config = pd.read_excel(FILE_CONFIGURATION_1,
+                        sheet_name='config_1', skiprows=2, index_col=0,
+                        usecols=[0, 1], header=1)
+        
+        # configuration parameters
+        TARGET_DIRECTORY = str(df_config.at['target_directory', 'Value'])
+        OUT_DIRECTORY = Path(str(df_config.at['out_directory', 'Value']))
+        STATION_PREFIX = str(
+            df_config.at['station_prefix','Value'])[:2].upper()
+        LATITUDE = float(df_config.at['latitude', 'Value'])
+        LONGITUDE = float(df_config.at['longitude', 'Value'])
+        ELEVATION = int(df_config.at['elevation', 'Value'])
+        INSTRUMENT_HEIGHT = float(
+            df_config.at['instrument_height', 'Value'])
+        ANEMOMETER_HEIGHT = float(
+            df_config.at['anemometer_height', 'Value'])
+        FILE_LEGEND_GCMS_DSSAT_STATIONS = 'gcm-dssat_station_legend.csv'
+        
+    except Exception as e:
+        print(e, '\nFailed to import configuration!', end='\n')
+        input("Enter any key to quit.")
+
     main()
 
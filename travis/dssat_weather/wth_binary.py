@@ -0,0 +1,238 @@
+'''
+Binary weather series (.WTHB) for DSSAT weather stations
+
+A whole daily series of a station in one file that is read with a memory map
+(no parsing): a 68 byte header, a table of the annual TAV and AMP (20 bytes
+per year) and fixed 44 byte records of float32
+
+    header:  magic 'WTHB', version, number of records, INSI, LAT, LONG, ELEV,
+             TAV, AMP, REFHT, WNDHT (TAV and AMP of the whole series), number
+             of years
+    years:   year, TAV, AMP (float64, the values of the .WTH headers)
+    records: date (YYYYDDD), srad, tmax, tmin, rain, dewp, wind, par, evap,
+             rhum, rfet   (NaN for missing values)
+
+Records are sorted by date, so a date range is a slice of the memory map.
+.WTH files (one per year, each year with its own TAV and AMP like
+wimporter.py writes them) are made from it on demand:
+
+    wb = BinaryWeather('LN01.WTHB')
+    wb.to_wth('./weather', years=range(2030, 2041))
+
+or from the command line:
+
+    python wth_binary.py LN01.WTHB ./weather [first_year last_year]
+
+@author: Zach Zambreski 2021
+'''
+
+import sys
+from pathlib import Path
+import numpy as np
+import wth_writer
+
+MAGIC = b'WTHB'
+VERSION = 2
+
+HEADER = np.dtype([
+    ('magic', 'S4'), ('version', '<u4'), ('count', '<u8'), ('insi', 'S4'),
+    ('lat', '<f4'), ('long', '<f4'), ('elev', '<f4'), ('tav', '<f4'),
+    ('amp', '<f4'), ('refht', '<f4'), ('wndht', '<f4'), ('years', '<u4'),
+    ('reserved', 'S16')])
+ANNUAL = np.dtype([('year', '<i4'), ('tav', '<f8'), ('amp', '<f8')])
+RECORD = np.dtype([('date', '<f4')] +
+                  [(col, '<f4') for col in wth_writer.WTH_COLUMNS])
+
+
+def write_binary(wthb_file, insi, lat, long, elev, ref_ht, wind_ht, dates,
+                 values, annual=None):
+    '''
+    writes a station's daily series as a .WTHB file
+
+    Parameters:
+    wthb_file: str or Path
+    insi: str
+        4 character station name
+    lat, long, elev, ref_ht, wind_ht: float
+        station information for the wth header
+    dates: array of int
+        YYYYDDD date of each day, sorted
+    values: 2D array
+        one row per wth_writer.WTH_COLUMNS column
+    annual: tuple of arrays
+        years, TAV and AMP of each year as written in the .WTH headers
+        (calculated from values if None)
+    '''
+
+    dates = np.asarray(dates)
+    records = np.empty(len(dates), dtype=RECORD)
+    records['date'] = dates
+    for col, column in zip(wth_writer.WTH_COLUMNS, values):
+        records[col] = column
+
+    year, month, doy = split_dates(dates)
+    tmean = (np.asarray(values[wth_writer.WTH_COLUMNS.index('tmax')],
+                        dtype=np.float64) +
+             values[wth_writer.WTH_COLUMNS.index('tmin')]) / 2
+    if annual is None:
+        annual = wth_writer.annual_temperature(year, month, tmean)
+        annual = (annual[0], annual[2], annual[3])
+    years = np.empty(len(annual[0]), dtype=ANNUAL)
+    years['year'], years['tav'], years['amp'] = annual
+
+    # whole series TAV and AMP (spread of the calendar month averages)
+    month = month - 1
+    days = np.bincount(month, minlength=12)
+    monthly = np.bincount(month, tmean, minlength=12)[days > 0] /\
+        days[days > 0]
+
+    header = np.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['count'] = len(records)
+    header['insi'] = insi.encode('ascii')
+    header['lat'] = lat
+    header['long'] = long
+    header['elev'] = elev
+    header['tav'] = tmean.mean() if len(tmean) else np.nan
+    header['amp'] = monthly.max() - monthly.min() if len(monthly) else np.nan
+    header['refht'] = ref_ht
+    header['wndht'] = wind_ht
+    header['years'] = len(years)
+
+    with open(wthb_file, 'wb') as f:
+        f.write(header.tobytes() + years.tobytes() + records.tobytes())
+
+
+def split_dates(dates):
+    '''
+    year, month and day of year of YYYYDDD dates
+    '''
+
+    dates = np.asarray(dates, dtype=np.int64)
+    year = dates // 1000
+    doy = dates % 1000
+    days = (year - 1970).astype('datetime64[Y]').astype('datetime64[D]') +\
+        (doy - 1)
+    month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+
+    return year, month, doy
+
+
+class BinaryWeather(object):
+    '''
+    memory mapped .WTHB file
+
+    Parameters:
+    wthb_file: str or Path
+    '''
+
+    def __init__(self, wthb_file):
+
+        self.path = Path(wthb_file)
+        header = np.fromfile(self.path, dtype=HEADER, count=1)
+        if len(header) == 0 or header['magic'][0] != MAGIC:
+            raise Exception('Not a binary weather file: ' + str(wthb_file))
+        if header['version'][0] != VERSION:
+            raise Exception(''.join(['Unsupported binary weather version ',
+                                     str(header['version'][0]), ': ',
+                                     str(wthb_file)]))
+        self.header = {name: header[name][0] for name in HEADER.names
+                       if name not in ['magic', 'reserved']}
+        self.header['insi'] = self.header['insi'].decode('ascii')
+        annual = np.fromfile(self.path, dtype=ANNUAL,
+                             count=int(self.header['years']),
+                             offset=HEADER.itemsize)
+        self.annual = {int(a['year']): (float(a['tav']), float(a['amp']))
+                       for a in annual}
+        self.records = np.memmap(self.path, dtype=RECORD, mode='r',
+                                 offset=HEADER.itemsize + annual.nbytes,
+                                 shape=(int(self.header['count']),))
+
+    def __len__(self):
+
+        return len(self.records)
+
+    def dates(self):
+        '''
+        YYYYDDD dates as int
+        '''
+
+        return self.records['date'].astype(np.int64)
+
+    def subset(self, start=None, end=None):
+        '''
+        records between YYYYDDD start and end (inclusive), a view of the
+        memory map
+        '''
+
+        dates = self.records['date']
+        first = 0 if start is None else np.searchsorted(dates, start, 'left')
+        last = len(dates) if end is None else\
+            np.searchsorted(dates, end, 'right')
+
+        return self.records[first:last]
+
+    def to_wth(self, out_directory, years=None, station=None):
+        '''
+        writes one .WTH file per year
+
+        Parameters:
+        out_directory: str or Path
+        years: list of int
+            years to write (all if None)
+        station: str
+            4 character station name for the files (the INSI of the header
+            if None)
+        Returns:
+        list of the files written
+        '''
+
+        station = self.header['insi'] if station is None else station
+        records = self.records
+        if years is not None:
+            years = list(years)
+            records = self.subset(min(years) * 1000 + 1,
+                                  max(years) * 1000 + 366)
+        if len(records) == 0:
+            return []
+
+        # first row of each year; TAV and AMP come from the annual table
+        # (the values wimporter.py wrote, not the rounded float32 records)
+        year, month, doy = split_dates(records['date'])
+        offsets = np.r_[0, np.flatnonzero(np.diff(year)) + 1, len(year)]
+        wyears = year[offsets[:-1]]
+        dates = (year % 100) * 1000 + doy
+
+        written = []
+        for i, wyear in enumerate(wyears):
+            if years is not None and wyear not in years:
+                continue
+            rows = slice(offsets[i], offsets[i + 1])
+            header = wth_writer.format_header(
+                insi=station,
+                lat=self.header['lat'],
+                long=self.header['long'],
+                elev=int(self.header['elev']),
+                tavg=self.annual[wyear][0],
+                tamp=self.annual[wyear][1],
+                ref_ht=self.header['refht'],
+                wind_ht=self.header['wndht'])
+            values = wth_writer.encode_values(
+                dates[rows],
+                [records[col][rows] for col in wth_writer.WTH_COLUMNS])
+            wth_file = Path(out_directory).joinpath(
+                ''.join([station, str(wyear)[-2:], '01.WTH']))
+            wth_writer.write_wth(wth_file, header, values)
+            written.append(wth_file)
+
+        return written
+
+
+if __name__ == '__main__':
+    wb = BinaryWeather(sys.argv[1])
+    years = None
+    if len(sys.argv) > 4:
+        years = range(int(sys.argv[3]), int(sys.argv[4]) + 1)
+    for wth_file in wb.to_wth(sys.argv[2], years):
+        print('wrote: ', wth_file, end='\n')
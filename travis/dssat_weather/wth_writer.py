@@ -0,0 +1,191 @@
+'''
+Fixed-width encoder for DSSAT weather (.WTH) files
+
+Formats whole NumPy columns at once into a byte buffer (one row per day)
+instead of formatting every value as a Python string, and writes each file
+with a single write call.
+
+    Every value takes 6 characters (a space and a 5 character number with one
+    decimal) after the 5 character YYDDD date; missing values (NaN) are left
+    blank:
+
+        @DATE  SRAD  TMAX  TMIN  RAIN  DEWP  WIND   PAR  EVAP  RHUM  RFET
+        20106  23.0  17.0  -7.7   0.0       198.7              73.4   4.1
+
+@author: Zach Zambreski 2021
+'''
+
+import numpy as np
+
+# value columns of a wth file, in order, and their DSSAT header names
+WTH_COLUMNS = ['srad', 'tmax', 'tmin', 'prec', 'dewp', 'wind', 'par',
+               'evap', 'rh', 'et']
+WTH_NAMES = ['SRAD', 'TMAX', 'TMIN', 'RAIN', 'DEWP', 'WIND', 'PAR', 'EVAP',
+             'RHUM', 'RFET']
+
+# ascii codes
+SPACE = 32
+ZERO = 48
+DOT = 46
+MINUS = 45
+NEWLINE = 10
+
+
+def annual_temperature(year, month, tmean):
+    '''
+    splits a date-sorted daily series into years and calculates the annual
+    average temperature (TAV) and the amplitude of the monthly average
+    temperatures (AMP) of each year, in one pass over the contiguous blocks
+
+    Parameters:
+    year, month: array of int
+        of each day, sorted by date
+    tmean: array of float
+        daily mean temperature
+    Returns:
+    years: array of the years in the series
+    offsets: array of the first row of each year (plus the end), so year i
+        is offsets[i]:offsets[i + 1]
+    tav, amp: arrays, one value per year
+    '''
+
+    # first row of each year and of each month
+    offsets = np.r_[0, np.flatnonzero(np.diff(year)) + 1, len(year)]
+    m_offsets = np.r_[0, np.flatnonzero(
+        (np.diff(year) != 0) | (np.diff(month) != 0)) + 1, len(year)]
+    years = year[offsets[:-1]]
+
+    tav = np.add.reduceat(tmean, offsets[:-1]) / np.diff(offsets)
+    tmean_monthly = np.add.reduceat(tmean, m_offsets[:-1]) /\
+        np.diff(m_offsets)
+    m_starts = np.searchsorted(m_offsets, offsets[:-1])
+    amp = np.maximum.reduceat(tmean_monthly, m_starts) -\
+        np.minimum.reduceat(tmean_monthly, m_starts)
+
+    return years, offsets, tav, amp
+
+
+def format_int(values, width):
+    '''
+    zero padded integers as a (n, width) array of ascii codes
+
+    Parameters:
+    values: array of non-negative int
+    width: int
+        characters per value
+    '''
+
+    values = np.asarray(values, dtype=np.int64)
+    out = np.empty((len(values), width), dtype=np.uint8)
+    for pos in range(width - 1, -1, -1):
+        out[:, pos] = ZERO + values % 10
+        values = values // 10
+
+    return out
+
+
+def format_fixed(values, width=6, decimals=1):
+    '''
+    right aligned fixed point numbers (' {:>5.1f}') as a (n, width) array of
+    ascii codes, blank where the value is NaN. The first character is always
+    a space (DSSAT reads the columns by whitespace), so a value that needs
+    all width characters (e.g. 1000.0 or -100.0) raises a ValueError
+
+    Parameters:
+    values: array of float
+    width: int
+        characters per value (including the leading space)
+    decimals: int
+        digits after the decimal point
+    '''
+
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    scaled = np.round(np.where(missing, 0, values) * 10 ** decimals)
+    negative = np.signbit(scaled)
+    digits = np.abs(scaled).astype(np.int64)
+
+    out = np.full((len(values), width), SPACE, dtype=np.uint8)
+    pos = width - 1
+    # decimals, point and the first integer digit are always written
+    for _ in range(decimals):
+        out[:, pos] = ZERO + digits % 10
+        digits //= 10
+        pos -= 1
+    out[:, pos] = DOT
+    pos -= 1
+    out[:, pos] = ZERO + digits % 10
+    digits //= 10
+    # sign goes right before the leading digit, neither of them in the
+    # leading space
+    sign_pos = np.full(len(values), pos - 1)
+    for pos in range(pos - 1, 0, -1):
+        more = digits > 0
+        out[more, pos] = ZERO + digits[more] % 10
+        sign_pos[more] = pos - 1
+        digits //= 10
+
+    too_wide = (digits > 0) | (negative & (sign_pos < 1))
+    if (too_wide & ~missing).any():
+        err_msg = 'Value too wide for {}.{}f: {}'.format(
+            width, decimals, values[too_wide & ~missing][0])
+        raise ValueError(err_msg)
+
+    rows = np.nonzero(negative & ~missing)[0]
+    out[rows, sign_pos[rows]] = MINUS
+    out[missing] = SPACE
+
+    return out
+
+
+def encode_values(dates, columns):
+    '''
+    daily section of a wth file as bytes
+
+    Parameters:
+    dates: array of int
+        YYDDD date of each day
+    columns: list of arrays of float
+        one array per value column, in WTH_COLUMNS order
+    Returns:
+    bytes
+    '''
+
+    blocks = [format_int(dates, 5)]
+    blocks += [format_fixed(column) for column in columns]
+    blocks.append(np.full((len(dates), 1), NEWLINE, dtype=np.uint8))
+
+    return np.hstack(blocks).tobytes()
+
+
+def format_header(insi, lat, long, elev, tavg, tamp, ref_ht, wind_ht,
+                  co2_conc=-99.0):
+    '''
+    header of a wth file (station line and column names)
+    '''
+
+    return ''.join(['*WEATHER DATA : {insi}\n',
+        '\n', '@ INSI      LAT     LONG  ELEV   TAV   AMP ',
+        'REFHT WNDHT    CO2\n',
+        '  {insi:>4} {lat:>8.3f} {long:>8.3f} {elev:>5} ',
+        '{tavg:>5.1f} {tamp:>5.1f} {ref_ht:>5.1f} ',
+        '{wind_ht:5.1f} {co2_conc:>6.1f}\n',
+        '@DATE', ''.join('{:>6}'.format(n) for n in WTH_NAMES), '\n']).format(
+        insi=insi, lat=lat, long=long, elev=elev, tavg=tavg, tamp=tamp,
+        ref_ht=ref_ht, wind_ht=wind_ht, co2_conc=co2_conc)
+
+
+def write_wth(wth_file, header, values):
+    '''
+    write a wth file with a single write call
+
+    Parameters:
+    wth_file: str or Path
+    header: str
+        from format_header
+    values: bytes
+        from encode_values
+    '''
+
+    with open(wth_file, 'wb') as f:
+        f.write(header.encode('ascii') + values)
@@ -4,14 +4,26 @@
 PURPOSE: Create input forcing data files for basil crop coefficient for DSSAT.
 MAke sure it matches the length of the 
 
+    val_col in the configuration file is either one zone (column) of the input
+    file or 'all'. With 'all', the input file is read once, every zone is put
+    on the daily START_DATE - END_DATE range in one array operation and the
+    .KCB files are written in parallel (one file per zone). Zones are named
+    with the station prefix and the zone number: 01-99, then A0-ZZ like the
+    weather stations of wimporter.py.
+    
+    DSSAT station names have 4 characters, so one station prefix holds at
+    most MAX_STATIONS (1035) zones, and the zone columns must be numbered 1,
+    2, ... (zone_stations checks both when the input file is read). Split a
+    larger input file and give each part its own station prefix.
     
 INPUTS:
     
-    (1)
+    (1) kcb_import_control.xlsx
+    (2) Kcb values of each zone by date (csv)
     
 OUTPUTS:
     
-    (1)
+    (1) One .KCB file per zone
 
 AUTHOR: Zachary Zambreski, Kansas State University (2021)
 
@@ -23,8 +35,19 @@ Created on Mon May  3 08:52:23 2021
 # LIBRARIES IMPORTED #
 #--------------------#
 
+import numpy as np
 import pandas as pd
+from scipy.interpolate import PchipInterpolator
+from scipy.linalg import solveh_banded
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+# Station numbers are shared with the weather importer
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..','dssat_weather'))
+from wimporter import MAX_STATIONS, station_code
 
 #--------#
 # INPUTS #
@@ -34,7 +57,188 @@ START_DATE = '4/15/2020'
 END_DATE   = '10/15/2020'
 FILE_CONFIGURATION_1 = 'kcb_import_control.xlsx'
 
+# Files are written by this many processes when importing all zones
+MAX_WORKERS = os.cpu_count()
+
+# How the days between imagery observations are filled:
+#   'zero':   no interpolation, days without an observation are KC = 0.0
+#   'linear': straight line between observations
+#   'pchip':  monotone cubic (no overshoot between observations)
+#   'smooth': smoothing spline on the daily grid (SMOOTHING sets how much
+#             the noise of single observations is smoothed out)
+# Days before the first / after the last observation are KCB_MIN
+INTERPOLATION = 'linear'
+SMOOTHING     = 10.
+
+# Crop-stage envelope: every daily value is clamped to KCB_MIN - KCB_MAX
+# (numbers, or arrays with one value per day from START_DATE to END_DATE)
+KCB_MIN = 0.0
+KCB_MAX = 1.4
+
+HEADER_TEXT = (
+'*DAILY CROP COEFFICENTS (KCB) values\n\n'
+'!Values were modeled using geospatial vegetation index imagery at the field scale\n'
+'!Values are directly forced in the PETPEN subroutine in the SPAM module\n'
+'!Modelers: Travis Wiederstein, Vaishali Sharda\n'
+'!Coded by Zach Zambreski\n'
+'!Kansas State University\n'
+'!May 2021\n\n'
+)
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def read_kcb(target_file, date_col, val_col):
+    
+    """ Read the input file once. Returns the dates, the zone names and a
+        (dates x zones) array of Kcb values. val_col is one zone or 'all'
+    """
+    
+    dfk   = pd.read_csv(target_file)
+    if val_col.lower() == 'all':
+        zones = [c for c in dfk.columns if c != date_col]
+    else:
+        zones = [val_col]
+    dates = pd.DatetimeIndex(pd.to_datetime(dfk[date_col]))
+    
+    return dates, zones, dfk[zones].to_numpy(dtype = np.float64)
+
+def smooth_daily(pos, values, n, lam):
+    
+    """ Smoothing spline on a daily grid of n days (Whittaker smoother).
+    
+        Finds the daily series z that minimises the misfit at the observed
+        days (pos) plus lam times the squared second differences of z. The
+        system is banded and shared by all zones, so every zone is solved in
+        one call (values: observations x zones).
+    
+    """
+    
+    # W + lam * D'D, D = second differences (upper banded form): every
+    # row (1, -2, 1) of D adds to three diagonals
+    ab          = np.zeros((3,n))
+    ab[0,2:]   += lam
+    ab[1,1:-1] += -2*lam
+    ab[1,2:]   += -2*lam
+    ab[2,:-2]  += lam
+    ab[2,1:-1] += 4*lam
+    ab[2,2:]   += lam
+    ab[2,pos]  += 1
+    
+    rhs      = np.zeros((n,values.shape[1]))
+    rhs[pos] = values
+    
+    return solveh_banded(ab,rhs)
+
+def daily_grid(dates, values, start, end, method = 'linear', lam = 10.,
+               envelope = (0.,None)):
+    
+    """ Put the values of every zone on the daily start - end range in one
+        operation (all zones share the observation dates).
+        
+        method is 'zero', 'linear', 'pchip' or 'smooth' (see INTERPOLATION).
+        Days outside the observations are the envelope minimum and every day
+        is clamped to the envelope (min, max).
+    """
+    
+    days = pd.date_range(start,end)
+    if len(dates) > len(days):
+        err_msg= ('Number of dates in input file is greater than '
+                  'number of dates between start and end date.')
+        raise Exception(err_msg)
+    
+    # Row of each input date in the daily range (in date order). Values of
+    # the same date are averaged (no slope between them)
+    pos,index,counts = np.unique((dates - days[0]).days.to_numpy(),
+                                 return_inverse = True,return_counts = True)
+    sums   = np.zeros((len(pos),values.shape[1]))
+    np.add.at(sums,index.ravel(),values)
+    values = sums/counts[:,None]
+    inside = (pos >= 0) & (pos < len(days))
+    
+    low,high = envelope
+    out      = np.zeros((len(days),values.shape[1]))
+    out[:]   = np.reshape(low if low is not None else 0.,(-1,1))
+    
+    # Days from the first to the last observation (observations before or
+    # after the range still anchor the days in between)
+    x = (np.arange(max(0,pos[0]),min(len(days) - 1,pos[-1]) + 1)
+         if len(pos) else pos)
+    
+    if method == 'zero' or len(pos) < 2 or len(x) == 0:
+        out[pos[inside]] = values[inside]
+    
+    else:
+        if method == 'linear':
+            # Observation before each day and the weight of the one after
+            j = np.clip(np.searchsorted(pos,x,'right') - 1,0,len(pos) - 2)
+            w = ((x - pos[j])/(pos[j + 1] - pos[j]))[:,None]
+            out[x] = values[j]*(1 - w) + values[j + 1]*w
+        elif method == 'pchip':
+            out[x] = PchipInterpolator(pos,values,axis = 0)(x)
+        elif method == 'smooth':
+            # Smoothed over the days of all the observations (not only the
+            # ones in the range) so the ends don't extrapolate
+            z      = smooth_daily(pos - pos[0],values,pos[-1] - pos[0] + 1,
+                                  lam)
+            out[x] = z[x - pos[0]]
+        else:
+            raise Exception('Unknown interpolation method: %s'%(method))
+    
+    np.clip(out,np.reshape(low,(-1,1)) if low is not None else None,
+            np.reshape(high,(-1,1)) if high is not None else None,out = out)
+    
+    return days, out
+
+def zone_stations(zones, station_prefix):
+    
+    """ Station name (prefix and zone number) of every zone. Zone columns
+        are numbered 1 ... MAX_STATIONS, every number once
+    """
+    
+    numbers = []
+    for zone in zones:
+        try:
+            numbers.append(int(str(zone).strip()))
+        except ValueError:
+            raise Exception('Zone column \'%s\' is not a zone number (1 - %d)'
+                            %(zone,MAX_STATIONS))
+    
+    bad = [z for z,n in zip(zones,numbers) if n < 1 or n > MAX_STATIONS]
+    if bad:
+        raise Exception('Zones %s are outside 1 - %d: a station prefix holds '
+                        'at most %d zones (4 character DSSAT station names). '
+                        'Split the input file and use another station prefix '
+                        'for the rest'%(', '.join(map(str,bad[:5])),
+                                        MAX_STATIONS,MAX_STATIONS))
+    if len(set(numbers)) < len(numbers):
+        raise Exception('Zone numbers used more than once in the input file')
+    
+    return [station_prefix + station_code(n) for n in numbers]
 
+def write_zones(job):
+    
+    """ Write the .KCB file of a group of zones. Returns the files written """
+    
+    out_directory, stations, dates, block = job
+    
+    sect_header = ''.join(['@DATE  KCB\n'])
+    yy          = dates[0][:2]
+    
+    files = []
+    for i,station in enumerate(stations):
+        
+        sect_values = ''.join(np.char.add(np.char.add(dates,
+                              np.char.mod('%7.2f',block[:,i])),'\n'))
+        
+        kcb_file = Path(out_directory).joinpath(''.join([station, yy,
+                                                         '01.KCB']))
+        with open(kcb_file, 'w') as f:
+            f.write(HEADER_TEXT + sect_header + sect_values)
+        files.append(kcb_file)
+    
+    return files
 
 #------#
 # MAIN #
@@ -43,16 +247,6 @@ FILE_CONFIGURATION_1 = 'kcb_import_control.xlsx'
 if __name__== "__main__":
     
   
-    HEADER_TEXT = (
-    '*DAILY CROP COEFFICENTS (KCB) values\n\n'
-    '!Values were modeled using geospatial vegetation index imagery at the field scale\n'
-    '!Values are directly forced in the PETPEN subroutine in the SPAM module\n'
-    '!Modelers: Travis Wiederstein, Vaishali Sharda\n'
-    '!Coded by Zach Zambreski\n'
-    '!Kansas State University\n'
-    '!May 2021\n\n'
-    )
-    
     try:
         
         df_config = pd.read_excel(FILE_CONFIGURATION_1,
@@ -71,13 +265,7 @@ if __name__== "__main__":
     
     # Open the input file
     try: 
-         # import csv
-         dfk   = pd.read_csv(TARGET_FILE)
-         DATES = pd.DatetimeIndex(pd.to_datetime(dfk[DATE_COL]))
-         KCB   = dfk[[DATE_COL,VAL_COL]].set_index(DATE_COL).squeeze()
-         # Converting the index as date
-         KCB.index = pd.to_datetime(KCB .index)
-         
+         DATES,ZONES,KCB = read_kcb(TARGET_FILE,DATE_COL,VAL_COL)
          
     except Exception as e:
         err_msg = ('There was an error importing the file or extracting the '
@@ -85,21 +273,21 @@ if __name__== "__main__":
                    'or input files')
         print(e,err_msg)
     
-    # Create a daily pandas series from start to end date   
-    # Fit in the data from the input file into the blank date series
-    # Assume all dates where no data is KC= 0.0
-    OUT = pd.Series(0,index= pd.date_range(START_DATE,END_DATE),name=VAL_COL,
-                    dtype='float64')
+    # Station name of every zone, checked before anything is computed
+    try:
+        STATIONS = zone_stations(ZONES,STATION_PREFIX)
+    
+    except Exception as e:
+        print(e)
+        input("Enter any key to quit.")
+        sys.exit(1)
     
+    # Create a daily series from start to end date for every zone
+    # Fit in the data from the input file into the blank date series,
+    # filling the days between observations (INTERPOLATION)
     try:
-        if OUT.shape < KCB.shape:
-            err_msg= ('Number of dates in input file is greater than '
-                   'number of dates between start and end date.'
-                     )
-            raise Exception(err_msg)
-        else:
-            ixs = OUT.index.intersection(KCB.index)
-            OUT.loc[ixs] = KCB.loc[ixs]
+        DAYS,OUT = daily_grid(DATES,KCB,START_DATE,END_DATE,INTERPOLATION,
+                              SMOOTHING,(KCB_MIN,KCB_MAX))
         
     except Exception as e:
         
@@ -115,39 +303,23 @@ if __name__== "__main__":
     
     try:
     
-        sect_header = ''.join(['@DATE  KCB\n'])
-        OUT.index = OUT.index.strftime('%y%j')
-    
-        FORM_DATA = OUT.to_string(header=False,
-                index=True,
-                float_format= '{:>2.2f}'.format
-                )
-        sect_values_n = ''
-        for line in FORM_DATA.splitlines():
-            line = line +'\n'
-            sect_values_n += line 
-        
-        # Combine all strings
-        o_text = HEADER_TEXT + sect_header + sect_values_n
-        
-        # Create file name
-        yy = OUT.index[0][:2]
-        station_counter_fmt = '{:02}'.format(int(VAL_COL))
-        kcb_filename = ''.join([STATION_PREFIX, station_counter_fmt, yy,
-                                '01.KCB'])
+        YYDOY    = np.array(DAYS.strftime('%y%j'))
         
-       
+        # Split the zones in one group per process
+        n    = max(1,min(MAX_WORKERS,len(ZONES)))
+        jobs = [(OUT_DIRECTORY,STATIONS[i::n],YYDOY,OUT[:,i::n]) 
+                for i in range(n)]
         
-        kcb_file = OUT_DIRECTORY.joinpath(kcb_filename)
-        with open(kcb_file, 'w') as f:
-            f.write(o_text)
+        if n == 1:
+            written = [write_zones(jobs[0])]
+        else:
+            with ProcessPoolExecutor(max_workers = n) as pool:
+                written = list(pool.map(write_zones,jobs))
         
+        print('Wrote %d .KCB files'%(sum(len(w) for w in written)))
         print('Program completed with no errors')
     
     except Exception as e:
         
         err_msg = ('There was an error writing the output file\n')
         print(err_msg,e)
-    
-   
-    
\ No newline at end of file
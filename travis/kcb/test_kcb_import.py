@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+
+PURPOSE: Tests of the daily Kcb grid of kcb_import.py
+
+    python -m pytest -q travis/kcb
+
+AUTHOR: Zachary Zambreski, Kansas State University (2021)
+
+"""
+
+#--------------------#
+# LIBRARIES IMPORTED #
+#--------------------#
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from kcb_import import MAX_STATIONS, daily_grid, zone_stations
+
+#-----------#
+# CONSTANTS #
+#-----------#
+
+START    = '4/15/2020'
+END      = '10/15/2020'
+METHODS  = ['linear','pchip','smooth']
+ENVELOPE = (0.,1.4)
+
+#------------------------#
+# USER-DEFINED FUNCTIONS #
+#------------------------#
+
+def grid(dates, values, method):
+
+    return daily_grid(pd.DatetimeIndex(dates),np.array(values,dtype = float),
+                      START,END,method,envelope = ENVELOPE)
+
+@pytest.mark.parametrize('method',METHODS)
+def test_observation_after_the_range(method):
+
+    # The Oct 20 observation anchors the end of the range, nothing is
+    # extrapolated past Jun 1 and pinned to the envelope maximum
+    days,out = grid(['2020-06-01','2020-10-20'],[[1.0],[0.3]],method)
+
+    assert out[:47,0].tolist() == [0.]*47
+    assert out[47,0] == pytest.approx(1.0,abs = 0.01)
+    assert out.max() <= 1.0 + 1e-6
+    assert out[-1,0] == pytest.approx(0.3 + 0.7*5/141,abs = 0.01)
+
+@pytest.mark.parametrize('method',METHODS)
+def test_observations_on_both_sides(method):
+
+    days,out = grid(['2020-04-01','2020-05-01','2020-11-01'],
+                    [[0.2],[0.6],[1.0]],method)
+
+    assert len(days) == len(out) == 184
+    assert out[0,0] > 0.2
+    assert out[16,0] == pytest.approx(0.6,abs = 0.05)
+    assert 0.6 < out[-1,0] < 1.1
+
+@pytest.mark.parametrize('method',METHODS)
+def test_repeated_dates_are_averaged(method):
+
+    days,out = grid(['2020-05-01','2020-05-01','2020-06-01','2020-07-01'],
+                    [[0.2],[0.4],[0.6],[1.0]],method)
+
+    assert np.isfinite(out).all()
+    assert out[16,0] == pytest.approx(0.3,abs = 0.05)
+
+def test_no_observations_in_the_range():
+
+    days,out = grid(['2019-01-01','2019-02-01'],[[0.5],[0.6]],'linear')
+
+    assert out.tolist() == [[0.]]*len(days)
+
+def test_zone_stations():
+
+    stations = zone_stations(['1','02',99,100,MAX_STATIONS],'KS')
+
+    assert stations == ['KS01','KS02','KS99','KSA0','KSZZ']
+
+@pytest.mark.parametrize('zones',[['1','field_a'],['1',MAX_STATIONS + 1],
+                                  ['0'],['3','03']])
+def test_zone_stations_rejects(zones):
+
+    with pytest.raises(Exception):
+        zone_stations(zones,'KS')